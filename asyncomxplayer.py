@@ -0,0 +1,336 @@
+"""
+asyncio-native OMXPlayer.
+
+All output is read through the event loop's reader on the omxplayer pty, so
+any number of players can be driven from one loop without extra threads::
+
+    player = await AsyncOMXPlayer.start('/tmp/video.mp4')
+    async for position in player:
+        if position > 10:
+            await player.stop()
+"""
+
+import asyncio
+import errno
+import logging
+import os
+import signal
+
+from .pyomxplayer import (HeaderParser, OMXPlayer, OMXPlayerError, StartupTimeoutError,
+                          StatusParser)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOMXPlayer(object):
+
+    _LAUNCH_ARGV = OMXPlayer._LAUNCH_ARGV
+    _PROCESS_CLASS = OMXPlayer._PROCESS_CLASS
+
+    _READ_SIZE = OMXPlayer._READ_SIZE
+    _STARTUP_TIMEOUT = OMXPlayer._STARTUP_TIMEOUT
+    _STOP_TIMEOUT = 1.0 # seconds to wait for omxplayer to quit before killing it
+    _EVENT_QUEUE_SIZE = 64 # status events buffered per iterator
+
+    SLOW_SPEED = OMXPlayer.SLOW_SPEED
+    NORMAL_SPEED = OMXPlayer.NORMAL_SPEED
+    FAST_SPEED = OMXPlayer.FAST_SPEED
+    VFAST_SPEED = OMXPlayer.VFAST_SPEED
+
+    def __init__(self, mediafile, args=(), loop=None):
+        """
+        Use `AsyncOMXPlayer.start` rather than creating instances directly.
+        """
+        self.mediafile = mediafile
+        self._args = list(args)
+        self._loop = loop or asyncio.get_event_loop()
+        self._process = None
+        self._queues = set()
+
+        self._paused = False
+        self._subtitles_visible = True
+        self._volume = 0 # dB
+        self._speed = self.NORMAL_SPEED
+        self.position = 0.0
+        self.video = dict()
+        self.audio = dict()
+        self.chapters = None
+        self.subtitles = None
+        self.finished = False
+        self._finished_event = asyncio.Event()
+
+    @classmethod
+    async def start(cls, mediafile, args=None, start_playback=False, fullscreen=True,
+                    startup_timeout=None):
+        """
+        Spawns omxplayer and returns the player once its headers have been parsed.
+
+        Raises StartupTimeoutError if that takes longer than `startup_timeout`.
+        """
+        args = OMXPlayer._split_args(args, fullscreen)
+
+        player = cls(mediafile, args)
+        player.startup_timeout = startup_timeout or cls._STARTUP_TIMEOUT
+        await player._launch(args)
+        if start_playback:
+            await player.toggle_pause()
+        await player.toggle_subtitles()
+        return player
+
+    async def _launch(self, args):
+        self._process = self._PROCESS_CLASS(self._LAUNCH_ARGV + args + [self.mediafile])
+        self._fd = self._process.child_fd
+
+        self._paused = False
+        self._subtitles_visible = True
+        self._volume = 0
+        self._speed = self.NORMAL_SPEED
+        self.position = 0.0
+        self.finished = False
+        self._header_parser = HeaderParser()
+        self._status_parser = StatusParser(self._READ_SIZE)
+        self._headers_future = self._loop.create_future()
+
+        start = self._loop.time()
+        self._loop.add_reader(self._fd, self._on_readable, self._process)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._headers_future), self.startup_timeout)
+        except asyncio.TimeoutError:
+            self._headers_future.cancel()
+            self._kill(self._process)
+            raise StartupTimeoutError("omxplayer printed no headers within %ss"
+                                      % self.startup_timeout)
+        except BaseException:
+            self._headers_future.cancel()
+            self._kill(self._process)
+            raise
+        self.startup_time = self._loop.time() - start
+
+    def _kill(self, process):
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self._close(process)
+
+    def _on_readable(self, process):
+        try:
+            if self._headers_future.done():
+                count = self._status_parser.read(self._fd)
+            else:
+                data = os.read(self._fd, self._READ_SIZE)
+                count = len(data)
+        except OSError as e:
+            if e.errno not in (errno.EIO, errno.EBADF):
+                raise
+            count = 0
+        if not count:
+            self._close(process)
+            return
+
+        if not self._headers_future.done():
+            parser = self._header_parser
+            if not parser.feed(data):
+                return
+            self.video, self.audio = parser.video, parser.audio
+            self.chapters, self.subtitles = parser.chapters, parser.subtitles
+            self._status_parser.feed(parser.leftover)
+            self._headers_future.set_result(None)
+
+        while True:
+            position = self._status_parser.next()
+            if position is None:
+                break
+            if position is StatusParser.DONE:
+                self._close(process)
+                return
+            if position is StatusParser.VOLUME:
+                continue
+            self.position = position
+            self._publish(position)
+
+    def _publish(self, position):
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(position)
+
+    def _close(self, process):
+        """
+        Stops watching `process` and marks the player as finished.
+        """
+        if process is not self._process or self.finished:
+            return
+        self._loop.remove_reader(self._fd)
+        self.finished = True
+        if not self._headers_future.done():
+            self._headers_future.set_exception(
+                OMXPlayerError("omxplayer exited before printing its headers"))
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._finished_event.set()
+
+    def __aiter__(self):
+        return self.statuses()
+
+    async def statuses(self):
+        """
+        Yields the position of every status line until omxplayer finishes.
+
+        Slow consumers only miss the oldest positions, see `_EVENT_QUEUE_SIZE`.
+        """
+        queue = asyncio.Queue(self._EVENT_QUEUE_SIZE)
+        self._queues.add(queue)
+        try:
+            while not self.finished or not queue.empty():
+                position = await queue.get()
+                if position is None:
+                    break
+                yield position
+        finally:
+            self._queues.discard(queue)
+
+    async def wait_finished(self, timeout=None):
+        """
+        Waits until omxplayer has exited. Returns whether it did within `timeout`.
+        """
+        if self.finished:
+            return True
+        try:
+            await asyncio.wait_for(self._finished_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _send(self, cmd):
+        if self.finished:
+            return False
+        os.write(self._fd, cmd.encode())
+        return True
+
+    async def pause(self):
+        if not self._paused:
+            await self.toggle_pause()
+
+    async def play(self):
+        if self._paused:
+            await self.toggle_pause()
+
+    async def toggle_pause(self):
+        if self._send(OMXPlayer._PAUSE_CMD):
+            self._paused = not self._paused
+
+    async def toggle_subtitles(self):
+        if self._send(OMXPlayer._TOGGLE_SUB_CMD):
+            self._subtitles_visible = not self._subtitles_visible
+
+    async def stop(self):
+        """
+        Asks omxplayer to quit, killing it if it has not within `_STOP_TIMEOUT`.
+        """
+        process = self._process
+        self._send(OMXPlayer._QUIT_CMD)
+        if not await self.wait_finished(self._STOP_TIMEOUT):
+            logger.info("omxplayer did not quit, killing it")
+            self._kill(process)
+        # Reap the child without blocking the loop.
+        while process.isalive():
+            await asyncio.sleep(0.01)
+        process.close()
+
+    async def decrease_speed(self):
+        self._send(OMXPlayer._DECREASE_SPEED_CMD)
+
+    async def increase_speed(self):
+        self._send(OMXPlayer._INCREASE_SPEED_CMD)
+
+    async def set_speed(self, speed):
+        """
+        Set speed to one of the supported speed levels.
+        """
+        logger.info("Setting speed = %s" % speed)
+
+        assert speed in (self.SLOW_SPEED, self.NORMAL_SPEED, self.FAST_SPEED, self.VFAST_SPEED)
+
+        changes = speed - self._speed
+        cmd = OMXPlayer._INCREASE_SPEED_CMD if changes > 0 else OMXPlayer._DECREASE_SPEED_CMD
+        self._send(cmd * abs(changes))
+        self._speed = speed
+
+    async def decrease_volume(self):
+        self._volume -= OMXPlayer._VOLUME_INCREMENT
+        self._send(OMXPlayer._DECREASE_VOLUME_CMD)
+
+    async def increase_volume(self):
+        self._volume += OMXPlayer._VOLUME_INCREMENT
+        self._send(OMXPlayer._INCREASE_VOLUME_CMD)
+
+    async def set_volume(self, volume):
+        """
+        Set volume to `volume` dB.
+        """
+        logger.info("Setting volume = %s" % volume)
+
+        changes = int(round((volume - self._volume) / OMXPlayer._VOLUME_INCREMENT))
+        cmd = OMXPlayer._INCREASE_VOLUME_CMD if changes > 0 else OMXPlayer._DECREASE_VOLUME_CMD
+        self._send(cmd * abs(changes))
+        self._volume = volume
+
+    async def seek(self, offset):
+        """
+        Restarts omxplayer at `offset` seconds, like `OMXPlayer.seek`.
+
+        Status iterators and `wait_finished` callers carry on with the new
+        process, and pause, subtitle, volume and speed state carry over.
+        """
+        logger.info("Restarting at offset %s" % offset)
+        paused = self._paused
+        subtitles_visible = self._subtitles_visible
+        volume = self._volume
+        speed = self._speed
+
+        await self._retire(self._process)
+        # Wait for the first status line so `position` reflects the seek.
+        first_status = asyncio.Queue(1)
+        self._queues.add(first_status)
+        try:
+            await self._launch(self._args + ["-l", str(offset)])
+            await asyncio.wait_for(first_status.get(), self._STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._queues.discard(first_status)
+
+        if paused:
+            await self.toggle_pause()
+        if subtitles_visible != self._subtitles_visible:
+            await self.toggle_subtitles()
+        if volume != self._volume:
+            await self.set_volume(volume)
+        if speed != self._speed:
+            await self.set_speed(speed)
+
+    async def _retire(self, process):
+        """
+        Stops watching `process` without finishing the player, then asks it
+        to quit, killing it if it has not within `_STOP_TIMEOUT`.
+        """
+        self._loop.remove_reader(process.child_fd)
+        self._process = None
+        try:
+            os.write(process.child_fd, OMXPlayer._QUIT_CMD.encode())
+        except OSError:
+            pass
+        deadline = self._loop.time() + self._STOP_TIMEOUT
+        while process.isalive():
+            if self._loop.time() > deadline:
+                logger.info("omxplayer did not quit, killing it")
+                try:
+                    os.kill(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                deadline = float('inf')
+            await asyncio.sleep(0.01)
+        process.close()
@@ -0,0 +1,304 @@
+"""
+Capture of omxplayer's raw output for diagnostics.
+
+An OutputCapture keeps everything a player read from omxplayer's pty, with
+the time it was read, in a fixed-size ring in a memory-mapped file. Writing
+a chunk is a few copies into the map, with no objects per line, and the
+file survives the process, so after a crash the last seconds of output can
+be dumped with::
+
+    python -m pyomxplayer.capture /tmp/omxplayer/1234-0.ring --seconds 30
+
+Players capture when `OMXPlayer.output_capture` is set::
+
+    OMXPlayer.output_capture = CaptureDirectory('/tmp/omxplayer')
+    player = OMXPlayer('/tmp/video.mp4')
+    player.capture.path # '/tmp/omxplayer/<pid>-<n>.ring'
+
+File layout: a header of the magic bytes, the ring size and the number of
+bytes written in total, then the ring. Each record is the wall time, its
+kind, the payload length, the payload and its own total length again, so
+the ring can be walked backwards from the newest record.
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+import weakref
+
+from threading import Lock
+
+from .pyomxplayer import OMXPlayerError
+
+_MAGIC = b"OMXRING1"
+_HEADER = struct.Struct("<8sQQ") # magic, ring size, bytes written
+_RECORD = struct.Struct("<dBI") # wall time, kind, payload length
+_TRAILER = struct.Struct("<I") # record length
+
+OUTPUT = 0 # bytes read from omxplayer
+EVENT = 1 # a note from the player, e.g. the argv of a launch
+
+_KIND_NAMES = {OUTPUT: "output", EVENT: "event"}
+
+
+class CaptureError(OMXPlayerError):
+    """
+    A capture file is missing, truncated or not a capture file.
+    """
+
+
+class OutputCapture(object):
+    """
+    Writes records into the ring file at `path`, `size` bytes long, creating
+    or emptying it. Records are written whole, from any thread; once closed,
+    writes are dropped.
+    """
+
+    _SIZE = 1 << 20 # bytes of output kept
+
+    def __init__(self, path, size=_SIZE):
+        if size < 4 * (_RECORD.size + _TRAILER.size):
+            raise ValueError("capture size %s is too small" % size)
+        self.path = path
+        self.size = size
+        self.written = 0
+        self._lock = Lock()
+        self._scratch = bytearray(_RECORD.size)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, _HEADER.size + size)
+            self._map = mmap.mmap(fd, _HEADER.size + size)
+        finally:
+            os.close(fd)
+        self._ring = memoryview(self._map)[_HEADER.size:]
+        _HEADER.pack_into(self._map, 0, _MAGIC, size, 0)
+
+    def __repr__(self):
+        return "<OutputCapture %s>" % self.path
+
+    def write(self, data, kind=OUTPUT):
+        """
+        Appends `data`, a bytes-like object, as one record stamped with the
+        current time. Data longer than a quarter of the ring is split.
+        """
+        limit = self.size // 4 - _RECORD.size - _TRAILER.size
+        with self._lock:
+            if self._map is None:
+                return
+            if len(data) > limit:
+                data = memoryview(data)
+                for start in range(0, len(data), limit):
+                    self._append(data[start:start + limit], kind)
+            else:
+                self._append(data, kind)
+
+    def event(self, text):
+        """
+        Appends a note, e.g. that omxplayer was (re)started.
+        """
+        self.write(text.encode("utf-8", "replace"), EVENT)
+
+    def _append(self, data, kind):
+        count = len(data)
+        length = _RECORD.size + count + _TRAILER.size
+        offset = self.written
+        start = offset % self.size
+        if start + length <= self.size:
+            # The common case: the record fits before the end of the ring.
+            ring = self._ring
+            _RECORD.pack_into(ring, start, time.time(), kind, count)
+            start += _RECORD.size
+            ring[start:start + count] = data
+            _TRAILER.pack_into(ring, start + count, length)
+        else:
+            _RECORD.pack_into(self._scratch, 0, time.time(), kind, count)
+            offset = self._put(offset, self._scratch)
+            offset = self._put(offset, data)
+            _TRAILER.pack_into(self._scratch, 0, length)
+            self._put(offset, memoryview(self._scratch)[:_TRAILER.size])
+        self.written += length
+        # Published last, so a reader never sees a partial record.
+        struct.pack_into("<Q", self._map, 16, self.written)
+
+    def _put(self, offset, data):
+        """
+        Copies `data` into the ring at the total byte `offset`, wrapping
+        around. Returns the offset after it.
+        """
+        start = offset % self.size
+        count = len(data)
+        first = min(count, self.size - start)
+        self._ring[start:start + first] = data[:first]
+        if first < count:
+            self._ring[:count - first] = data[first:]
+        return offset + count
+
+    @property
+    def closed(self):
+        return self._map is None
+
+    def close(self):
+        with self._lock:
+            if self._map is None:
+                return
+            self._ring.release()
+            self._map.flush()
+            self._map.close()
+            self._map = None
+
+
+class CaptureDirectory(object):
+    """
+    Gives every player an OutputCapture of `size` bytes in `directory`,
+    named after the process id and a counter.
+
+    Opening one first deletes the oldest capture files beyond `max_files`,
+    and those last written more than `max_age` seconds ago, except the ones
+    still open here. None disables either limit.
+    """
+
+    _MAX_FILES = 32 # capture files kept in the directory
+
+    def __init__(self, directory, size=OutputCapture._SIZE, max_files=_MAX_FILES,
+                 max_age=None):
+        self.directory = directory
+        self.size = size
+        self.max_files = max_files
+        self.max_age = max_age
+        self._counter = itertools.count()
+        self._captures = weakref.WeakSet()
+        self._lock = Lock()
+
+    def open(self, mediafile):
+        with self._lock:
+            self._prune()
+            capture = OutputCapture(os.path.join(self.directory, "%d-%d.ring"
+                                                 % (os.getpid(), next(self._counter))),
+                                    self.size)
+            self._captures.add(capture)
+        capture.event("capturing %s" % mediafile)
+        return capture
+
+    def _prune(self):
+        """
+        Deletes old capture files to make room for one more.
+        """
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".ring")]
+        except FileNotFoundError:
+            return
+        open_paths = set(capture.path for capture in self._captures if not capture.closed)
+        files = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path in open_paths:
+                continue
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue # deleted meanwhile
+        files.sort()
+        stale = []
+        if self.max_age is not None:
+            oldest = time.time() - self.max_age
+            stale = [f for f in files if f[0] < oldest]
+            files = files[len(stale):]
+        if self.max_files is not None:
+            excess = len(files) + len(open_paths) + 1 - self.max_files
+            if excess > 0:
+                stale += files[:excess]
+        for mtime, path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def read_capture(path, seconds=None):
+    """
+    Returns the records of the capture file at `path`, oldest first, as
+    (wall time, kind, bytes) tuples; only those of the last `seconds` before
+    the newest record, if given.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise CaptureError("Could not read %s: %s" % (path, e))
+    if len(data) < _HEADER.size:
+        raise CaptureError("%s is not a capture file" % path)
+    magic, size, written = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or len(data) < _HEADER.size + size:
+        raise CaptureError("%s is not a capture file" % path)
+    ring = data[_HEADER.size:_HEADER.size + size]
+
+    def get(offset, count):
+        start = offset % size
+        chunk = ring[start:start + count]
+        if len(chunk) < count:
+            chunk += ring[:count - len(chunk)]
+        return chunk
+
+    records = []
+    end = written
+    while end > 0:
+        length, = _TRAILER.unpack(get(end - _TRAILER.size, _TRAILER.size))
+        start = end - length
+        if start < max(written - size, 0) or length < _RECORD.size + _TRAILER.size:
+            break # overwritten
+        t, kind, count = _RECORD.unpack(get(start, _RECORD.size))
+        if seconds is not None and records and t < records[0][0] - seconds:
+            break
+        records.append((t, kind, get(start + _RECORD.size, count)))
+        end = start
+    records.reverse()
+    return records
+
+
+def dump(records, out, raw=False):
+    """
+    Writes `records` to the text file `out`: every line of output with the
+    time it was read, or, if `raw`, the output bytes alone.
+    """
+    if raw:
+        out = getattr(out, "buffer", out)
+        for t, kind, data in records:
+            if kind == OUTPUT:
+                out.write(data)
+        return
+    for t, kind, data in records:
+        stamp = "%s.%03d" % (time.strftime("%H:%M:%S", time.localtime(t)), int(t * 1000) % 1000)
+        text = data.decode("utf-8", "replace")
+        if kind != OUTPUT:
+            out.write("%s %s: %s\n" % (stamp, _KIND_NAMES.get(kind, kind), text))
+            continue
+        for line in text.replace("\r", "\n").split("\n"):
+            if line.strip():
+                out.write("%s %s\n" % (stamp, line.rstrip()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="dump a pyomxplayer output capture")
+    parser.add_argument("path")
+    parser.add_argument("--seconds", type=float, default=None,
+                        help="only the last SECONDS of output")
+    parser.add_argument("--raw", action="store_true",
+                        help="write the output bytes as omxplayer printed them")
+    options = parser.parse_args(argv)
+    try:
+        records = read_capture(options.path, options.seconds)
+    except CaptureError as e:
+        parser.exit(1, "%s\n" % e)
+    dump(records, sys.stdout, options.raw)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
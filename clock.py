@@ -0,0 +1,199 @@
+"""
+Clocks that OMXPlayer's timing paths read and wait on.
+
+Players use the real `Clock` unless their class says otherwise. A
+`VirtualClock` only moves when it is advanced, which lets tests run minutes
+of playback in milliseconds and make exact timing assertions::
+
+    clock = VirtualClock()
+    OMXPlayer.clock = clock
+    ...
+    clock.advance(10) # wakes every timed wait that falls due on the way
+
+Code that waits on a condition through a clock notifies it through the same
+clock, so a virtual clock knows which threads are still busy.
+"""
+
+import heapq
+import itertools
+import time
+
+from threading import Condition, Lock, current_thread, get_ident
+
+
+class Clock(object):
+    """
+    The monotonic clock, with `threading.Condition` waits.
+    """
+
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    def wait(self, condition, timeout=None):
+        """
+        Waits on `condition`, whose lock the caller holds, until it is
+        notified or `timeout` seconds passed. Returns whether it was notified.
+        """
+        return condition.wait(timeout)
+
+    def wait_for(self, condition, predicate, timeout=None):
+        """
+        Waits on `condition` until `predicate` is true or `timeout` seconds
+        passed. Returns the last result of `predicate`.
+        """
+        return condition.wait_for(predicate, timeout)
+
+    def notify(self, condition):
+        """
+        Wakes all threads waiting on `condition`, whose lock the caller holds.
+        """
+        condition.notify_all()
+
+
+class VirtualClock(object):
+    """
+    A clock that stands still until `advance` moves it.
+
+    Timed waits register a timer. `advance` fires the timers that fall due
+    in order, with the clock set to each one's due time, and after each one
+    `settle`s: it waits until every thread that ever waited on the clock is
+    waiting again, so what happens at a given virtual time does not depend
+    on how threads are scheduled.
+    """
+
+    _SETTLE_TIMEOUT = 0.1 # real seconds a busy thread may take to wait again
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._lock = Lock()
+        self._changed = Condition(self._lock)
+        self._timers = [] # heap of [due, sequence number, condition, thread id]
+        self._sequence = itertools.count()
+        self._threads = {} # id -> every thread that waited on the clock
+        self._waiting = {} # id -> condition of the threads waiting, not woken yet
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        condition = Condition()
+        with condition:
+            self.wait_for(condition, lambda: False, seconds)
+
+    def wait(self, condition, timeout=None):
+        """
+        Like `Clock.wait`, with `timeout` in virtual seconds.
+        """
+        timer = self._enter(condition, timeout)
+        try:
+            condition.wait()
+        finally:
+            fired = self._leave(timer)
+        return not fired
+
+    def wait_for(self, condition, predicate, timeout=None):
+        """
+        Like `Clock.wait_for`, with `timeout` in virtual seconds.
+        """
+        due = None if timeout is None else self._now + timeout
+        result = predicate()
+        while not result:
+            if due is not None and self._now >= due:
+                break
+            timer = self._enter(condition, None if due is None else due - self._now)
+            try:
+                condition.wait()
+            finally:
+                self._leave(timer)
+            result = predicate()
+        return result
+
+    def notify(self, condition):
+        with self._lock:
+            for thread, waited_on in list(self._waiting.items()):
+                if waited_on is condition:
+                    del self._waiting[thread]
+        condition.notify_all()
+
+    def advance(self, seconds, ignore=()):
+        """
+        Moves the clock forward by `seconds`, firing the timers due on the
+        way. See `settle` for `ignore`.
+        """
+        with self._lock:
+            target = self._now + seconds
+        while True:
+            with self._lock:
+                while self._timers and self._timers[0][2] is None:
+                    heapq.heappop(self._timers)
+                if not self._timers or self._timers[0][0] > target:
+                    self._now = max(self._now, target)
+                    return
+                timer = heapq.heappop(self._timers)
+                self._now = max(self._now, timer[0])
+                condition, thread = timer[2], timer[3]
+                timer[2] = None
+                self._waiting.pop(thread, None)
+            with condition:
+                condition.notify_all()
+            self.settle(ignore)
+
+    def settle(self, ignore=()):
+        """
+        Waits until every thread that waited on the clock before, other than
+        the calling one and those in `ignore`, is waiting again or gone.
+        Returns False if some were still busy after `_SETTLE_TIMEOUT` real
+        seconds.
+        """
+        skip = set(ignore)
+        skip.add(get_ident())
+        def settled():
+            return all(ident in self._waiting or ident in skip or not thread.is_alive()
+                       for ident, thread in self._threads.items())
+        with self._lock:
+            return self._changed.wait_for(settled, self._SETTLE_TIMEOUT)
+
+    def waiting(self, thread):
+        """
+        Returns whether the thread with id `thread` is waiting on the clock
+        and has not been woken.
+        """
+        with self._lock:
+            return thread in self._waiting
+
+    def pending(self):
+        """
+        Returns the due time of the next timer, or None if none is set.
+        """
+        with self._lock:
+            due = [timer[0] for timer in self._timers if timer[2] is not None]
+        return min(due) if due else None
+
+    def _enter(self, condition, timeout):
+        thread = get_ident()
+        with self._lock:
+            if thread not in self._threads:
+                for ident, known in list(self._threads.items()):
+                    if not known.is_alive():
+                        del self._threads[ident]
+                self._threads[thread] = current_thread()
+            self._waiting[thread] = condition
+            self._changed.notify_all()
+            if timeout is None:
+                return None
+            timer = [self._now + timeout, next(self._sequence), condition, thread]
+            heapq.heappush(self._timers, timer)
+            return timer
+
+    def _leave(self, timer):
+        """
+        Cancels `timer` if it has not fired. Returns whether it had.
+        """
+        with self._lock:
+            self._waiting.pop(get_ident(), None)
+            if timer is None:
+                return False
+            if timer[2] is None:
+                return True
+            timer[2] = None
+            return False
@@ -0,0 +1,383 @@
+"""
+Network control of players.
+
+A ControlServer runs AsyncOMXPlayers for remote clients. Requests and
+responses are JSON objects, one per line, over a persistent TCP connection.
+Clients may pipeline: send any number of requests without waiting, and match
+the responses, which come back in order, by their `id`::
+
+    {"id": 1, "op": "open", "mediafile": "/media/a.mp4", "start_playback": true}
+    {"id": 1, "result": {"player": "1", "video": {...}, "audio": {...}, ...}}
+    {"id": 2, "op": "set_volume", "player": "1", "volume": -6}
+    {"id": 2, "result": null}
+    {"id": 3, "op": "subscribe", "player": "1"}
+    {"id": 3, "result": null}
+    {"event": "status", "player": "1", "position": 0.84}
+    {"event": "status", "player": "1", "position": 0.88}
+    ...
+    {"id": 4, "op": "foo"}
+    {"id": 4, "error": "unknown op: foo"}
+
+Operations are open, play, pause, toggle_pause, seek, set_volume, set_speed,
+stop, status, players, subscribe and unsubscribe. Players belong to the
+server, not the connection, so a scheduler can reconnect and carry on.
+
+Run a server with::
+
+    python -m pyomxplayer.control --port 7000
+
+and drive it with ControlClient, or anything that writes JSON lines.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+
+from .asyncomxplayer import AsyncOMXPlayer
+from .pyomxplayer import OMXPlayerError
+
+logger = logging.getLogger(__name__)
+
+
+class ControlError(OMXPlayerError):
+    """
+    A request the server answered with an error.
+    """
+
+
+class ControlServer(object):
+    """
+    Serves the operations of `player_class` players over TCP.
+    """
+
+    _LINE_LIMIT = 1 << 20 # longest request line accepted, in bytes
+    _EVENT_BUFFER = 1 << 16 # bytes of unsent events before a subscriber misses some
+
+    def __init__(self, player_class=AsyncOMXPlayer, host="127.0.0.1", port=0):
+        self.player_class = player_class
+        self.host = host
+        self.port = port
+        self.players = {} # name -> player
+        self._names = itertools.count(1)
+        self._server = None
+        self._connections = {} # Task serving a connection -> its StreamWriter
+        self._ops = dict(
+            open=self._open, play=self._play, pause=self._pause,
+            toggle_pause=self._toggle_pause, seek=self._seek,
+            set_volume=self._set_volume, set_speed=self._set_speed, stop=self._stop,
+            status=self._status, players=self._players,
+            subscribe=self._subscribe, unsubscribe=self._unsubscribe)
+
+    async def start(self):
+        """
+        Starts listening. Returns the port, which is picked if `port` is 0.
+        """
+        self._server = await asyncio.start_server(self._serve, self.host, self.port,
+                                                  limit=self._LINE_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Control server listening on %s:%s" % (self.host, self.port))
+        return self.port
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening, drops all connections and stops all players.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # Closing the sockets ends every connection's request loop.
+        tasks = list(self._connections)
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        players, self.players = list(self.players.values()), {}
+        await asyncio.gather(*[player.stop() for player in players], return_exceptions=True)
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        subscriptions = {} # player name -> Task pushing its statuses
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError) as e:
+                    logger.info("Dropping control connection: %s" % e)
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self._handle(line, writer, subscriptions)
+                writer.write(response)
+                # Only wait for the client to read when it is far behind, so
+                # pipelined requests are answered without a round trip each.
+                if writer.transport.get_write_buffer_size() > self._EVENT_BUFFER:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for subscription in subscriptions.values():
+                subscription.cancel()
+            writer.close()
+            self._connections.pop(task, None)
+
+    async def _handle(self, line, writer, subscriptions):
+        """
+        Runs one request line and returns its encoded response.
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request is not an object")
+            request_id = request.pop('id', None)
+            op = request.pop('op', None)
+            if op not in self._ops:
+                raise ValueError("unknown op: %s" % op)
+            if op in ('subscribe', 'unsubscribe'):
+                request.update(writer=writer, subscriptions=subscriptions)
+            result = await self._ops[op](**request)
+            response = dict(id=request_id, result=result)
+        except Exception as e:
+            logger.debug("Control request failed: %r" % e)
+            response = dict(id=request_id, error=str(e) or e.__class__.__name__)
+        return json.dumps(response).encode() + b"\n"
+
+    def _player(self, name):
+        if name not in self.players:
+            raise OMXPlayerError("unknown player: %s" % name)
+        if self.players[name] is None:
+            raise OMXPlayerError("player is starting: %s" % name)
+        return self.players[name]
+
+    async def _open(self, mediafile, player=None, args=None, start_playback=False,
+                    fullscreen=True):
+        name = player if player is not None else str(next(self._names))
+        if name in self.players:
+            raise OMXPlayerError("player exists: %s" % name)
+        # Claim the name while omxplayer starts.
+        self.players[name] = None
+        try:
+            instance = await self.player_class.start(mediafile, args=args,
+                                                     start_playback=start_playback,
+                                                     fullscreen=fullscreen)
+        except BaseException:
+            del self.players[name]
+            raise
+        self.players[name] = instance
+        return dict(player=name, video=instance.video, audio=instance.audio,
+                    chapters=instance.chapters, subtitles=instance.subtitles)
+
+    async def _play(self, player):
+        await self._player(player).play()
+
+    async def _pause(self, player):
+        await self._player(player).pause()
+
+    async def _toggle_pause(self, player):
+        await self._player(player).toggle_pause()
+
+    async def _seek(self, player, offset):
+        await self._player(player).seek(float(offset))
+
+    async def _set_volume(self, player, volume):
+        await self._player(player).set_volume(volume)
+
+    async def _set_speed(self, player, speed):
+        instance = self._player(player)
+        if speed not in (instance.SLOW_SPEED, instance.NORMAL_SPEED,
+                         instance.FAST_SPEED, instance.VFAST_SPEED):
+            raise ValueError("unsupported speed: %s" % speed)
+        await instance.set_speed(speed)
+
+    async def _stop(self, player):
+        instance = self._player(player)
+        del self.players[player]
+        await instance.stop()
+
+    async def _status(self, player):
+        instance = self._player(player)
+        return dict(position=instance.position, paused=instance._paused,
+                    volume=instance._volume, speed=instance._speed,
+                    subtitles_visible=instance._subtitles_visible,
+                    finished=instance.finished)
+
+    async def _players(self):
+        return sorted(name for name, player in self.players.items() if player is not None)
+
+    async def _subscribe(self, player, writer, subscriptions, interval=0):
+        """
+        Pushes a status event for every status line of `player`, at most one
+        per `interval` seconds, then a finished event.
+        """
+        instance = self._player(player)
+        if player in subscriptions:
+            return
+        subscriptions[player] = asyncio.ensure_future(
+            self._push_statuses(player, instance, writer, float(interval)))
+
+    async def _unsubscribe(self, player, writer, subscriptions):
+        subscription = subscriptions.pop(player, None)
+        if subscription is not None:
+            subscription.cancel()
+
+    async def _push_statuses(self, name, player, writer, interval):
+        loop = asyncio.get_running_loop()
+        last = None
+        async for position in player.statuses():
+            now = loop.time()
+            if last is not None and now - last < interval:
+                continue
+            # A subscriber that does not keep up misses statuses rather
+            # than holding up the server.
+            if writer.transport.get_write_buffer_size() > self._EVENT_BUFFER:
+                continue
+            last = now
+            self._push(writer, dict(event="status", player=name, position=position))
+        self._push(writer, dict(event="finished", player=name))
+
+    def _push(self, writer, event):
+        if not writer.is_closing():
+            writer.write(json.dumps(event).encode() + b"\n")
+
+
+class ControlClient(object):
+    """
+    An asyncio client for ControlServer. Calls may be made concurrently; they
+    are pipelined on the one connection::
+
+        client = await ControlClient.connect('10.0.0.7', 7000)
+        player = (await client.call('open', mediafile='/media/a.mp4'))['player']
+        await asyncio.gather(client.call('set_volume', player=player, volume=-6),
+                             client.call('play', player=player))
+        async for event in client.subscribe(player):
+            ...
+    """
+
+    _EVENT_QUEUE_SIZE = 64 # events buffered per subscription
+
+    def __init__(self, reader, writer):
+        """
+        Use `ControlClient.connect` rather than creating instances directly.
+        """
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._pending = {} # request id -> Future
+        self._subscriptions = {} # player name -> Queue of events
+        self._reader_task = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=7000):
+        reader, writer = await asyncio.open_connection(host, port,
+                                                      limit=ControlServer._LINE_LIMIT)
+        return cls(reader, writer)
+
+    def send(self, op, **params):
+        """
+        Sends a request without waiting for it. Returns a future of its result.
+        """
+        if self._reader_task.done():
+            raise ControlError("connection closed")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        params.update(id=request_id, op=op)
+        self._writer.write(json.dumps(params).encode() + b"\n")
+        return future
+
+    async def call(self, op, **params):
+        """
+        Sends a request and returns its result. Raises ControlError if the
+        server answered with an error.
+        """
+        future = self.send(op, **params)
+        await self._writer.drain()
+        return await future
+
+    async def subscribe(self, player, interval=0):
+        """
+        Yields the status events pushed for `player` until it finishes.
+        """
+        queue = asyncio.Queue(self._EVENT_QUEUE_SIZE)
+        self._subscriptions[player] = queue
+        try:
+            await self.call('subscribe', player=player, interval=interval)
+            while True:
+                event = await queue.get()
+                if event is None or event['event'] == 'finished':
+                    break
+                yield event
+        finally:
+            if self._subscriptions.get(player) is queue:
+                del self._subscriptions[player]
+                if not self._reader_task.done():
+                    self.send('unsubscribe', player=player)
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._reader_task
+
+    async def _read(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if 'event' in message:
+                    queue = self._subscriptions.get(message['player'])
+                    if queue is not None:
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(message)
+                    continue
+                future = self._pending.pop(message['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(ControlError(message['error']))
+                else:
+                    future.set_result(message['result'])
+        except (ConnectionError, ValueError) as e:
+            logger.info("Control connection lost: %s" % e)
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ControlError("connection closed"))
+            self._pending.clear()
+            for queue in self._subscriptions.values():
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyomxplayer control server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7000)
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = ControlServer(host=options.host, port=options.port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,431 @@
+"""
+Keyframe indexes of MP4 and Matroska files.
+
+omxplayer started with ``-l offset`` begins at the keyframe before `offset`,
+so where a restart seek lands depends on the file. A KeyframeIndex lists the
+keyframe times of a file's video track, read from the container without
+decoding anything:
+
+- MP4: the sync samples (stss) of the video track, timed with its sample
+  durations (stts) and media timescale (mdhd).
+- Matroska/WebM: the CuePoints (Cues) of the video track, timed with the
+  segment's TimecodeScale.
+
+Files are memory-mapped and only the index boxes and elements are touched,
+so building the index of a multi-GB file costs about as much as a small one.
+Indexes are persisted by a KeyframeCache, keyed by path, size and mtime::
+
+    cache = KeyframeCache()
+    index = cache.get('/media/movie.mkv')
+    index.nearest(95.0) # 96.0
+    OMXPlayer.keyframe_cache = cache # seek() lands on keyframes
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+logger = logging.getLogger(__name__)
+
+_KEYFRAMES_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "pyomxplayer", "keyframes")
+
+
+class KeyframeIndex(object):
+    """
+    The sorted keyframe times of a file, in seconds.
+    """
+
+    def __init__(self, times):
+        self.times = array('d', sorted(times))
+
+    def __len__(self):
+        return len(self.times)
+
+    def nearest(self, offset):
+        """
+        Returns the keyframe time closest to `offset`, or None if there are none.
+        """
+        times = self.times
+        if not times:
+            return None
+        i = bisect_left(times, offset)
+        if i == 0:
+            return times[0]
+        if i == len(times):
+            return times[-1]
+        before, after = times[i - 1], times[i]
+        return before if offset - before <= after - offset else after
+
+    def before(self, offset):
+        """
+        Returns the last keyframe time at or before `offset`, where omxplayer
+        -l `offset` starts, or None if there is none.
+        """
+        i = bisect_right(self.times, offset)
+        return self.times[i - 1] if i else None
+
+    @property
+    def size(self):
+        """
+        The size of the index in bytes.
+        """
+        return self.times.itemsize * len(self.times)
+
+
+def build_index(path):
+    """
+    Returns the KeyframeIndex of the MP4 or Matroska file at `path`, or None
+    if it is in neither format or its index cannot be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < 8:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if int.from_bytes(data[:4], "big") == _EBML:
+                    times = _matroska_keyframes(data)
+                elif data[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide"):
+                    times = _mp4_keyframes(data)
+                else:
+                    return None
+    except (OSError, ValueError, IndexError, struct.error) as e:
+        logger.warning("Could not index %s: %s" % (path, e))
+        return None
+    if not times:
+        return None
+    return KeyframeIndex(times)
+
+
+def _uint32s(data, start, count):
+    """
+    Returns `count` big-endian uint32s at `start` of `data` as an array.
+    """
+    values = array('I')
+    if values.itemsize != 4:
+        values = array('L')
+    end = start + 4 * count
+    if end > len(data):
+        raise ValueError("table runs past the end of its box")
+    values.frombytes(data[start:end])
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+# MP4
+
+def _mp4_boxes(data, start, end):
+    """
+    Yields the (type, payload start, end) of the boxes between `start` and `end`.
+    """
+    while start + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            raise ValueError("corrupt %r box at %d" % (kind, start))
+        yield kind, start + header, start + size
+        start += size
+
+
+def _mp4_child(data, start, end, kind):
+    for child, child_start, child_end in _mp4_boxes(data, start, end):
+        if child == kind:
+            return child_start, child_end
+    return None
+
+
+def _mp4_keyframes(data):
+    moov = _mp4_child(data, 0, len(data), b"moov")
+    if moov is None:
+        return None
+    for kind, start, end in _mp4_boxes(data, *moov):
+        if kind != b"trak":
+            continue
+        mdia = _mp4_child(data, start, end, b"mdia")
+        if mdia is None:
+            continue
+        hdlr = _mp4_child(data, mdia[0], mdia[1], b"hdlr")
+        if hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        mdhd = _mp4_child(data, mdia[0], mdia[1], b"mdhd")
+        minf = _mp4_child(data, mdia[0], mdia[1], b"minf")
+        stbl = minf and _mp4_child(data, minf[0], minf[1], b"stbl")
+        if mdhd is None or stbl is None:
+            continue
+        if data[mdhd[0]] == 1:
+            timescale = struct.unpack_from(">I", data, mdhd[0] + 20)[0]
+        else:
+            timescale = struct.unpack_from(">I", data, mdhd[0] + 12)[0]
+        return _mp4_sync_times(data, stbl, timescale)
+    return None
+
+
+def _mp4_sync_times(data, stbl, timescale):
+    """
+    Returns the decode times of the sync samples of a sample table.
+    """
+    stts = _mp4_child(data, stbl[0], stbl[1], b"stts")
+    if stts is None or not timescale:
+        return None
+    count = struct.unpack_from(">I", data, stts[0] + 4)[0]
+    runs = _uint32s(data, stts[0] + 8, 2 * count) # (sample count, duration) pairs
+
+    stss = _mp4_child(data, stbl[0], stbl[1], b"stss")
+    if stss is None:
+        # Every sample is a sync sample.
+        syncs = None
+    else:
+        count = struct.unpack_from(">I", data, stss[0] + 4)[0]
+        syncs = _uint32s(data, stss[0] + 8, count) # 1-based sample numbers
+
+    times = array('d')
+    sample = 1 # first sample of the current run
+    t = 0 # its decode time in timescale units
+    i = 0 # next sync sample
+    for run in range(len(runs) // 2):
+        samples, duration = runs[2 * run], runs[2 * run + 1]
+        following = sample + samples
+        if syncs is None:
+            times.extend((t + n * duration) / timescale for n in range(samples))
+        else:
+            while i < len(syncs) and syncs[i] < following:
+                times.append((t + (syncs[i] - sample) * duration) / timescale)
+                i += 1
+        t += samples * duration
+        sample = following
+    return times
+
+
+# Matroska
+
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_SEEK_HEAD = 0x114D9B74
+_SEEK = 0x4DBB
+_SEEK_ID = 0x53AB
+_SEEK_POSITION = 0x53AC
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_NUMBER = 0xD7
+_TRACK_TYPE = 0x83
+_CUES = 0x1C53BB6B
+_CUE_POINT = 0xBB
+_CUE_TIME = 0xB3
+_CUE_TRACK_POSITIONS = 0xB7
+_CUE_TRACK = 0xF7
+_CLUSTER = 0x1F43B675
+
+_VIDEO_TRACK_TYPE = 1
+_DEFAULT_TIMECODE_SCALE = 1000000 # nanoseconds per timecode unit
+
+
+def _ebml_vint(data, pos):
+    """
+    Returns the length of the variable-size integer at `pos` and its raw value.
+    """
+    first = data[pos]
+    if not first:
+        raise ValueError("invalid EBML integer at %d" % pos)
+    length = 9 - first.bit_length()
+    return length, int.from_bytes(data[pos:pos + length], "big")
+
+
+def _ebml_elements(data, start, end):
+    """
+    Yields the (id, payload start, end) of the elements between `start` and
+    `end`. Elements of unknown size extend to `end`.
+    """
+    while start < end:
+        id_length, element_id = _ebml_vint(data, start)
+        size_length, size = _ebml_vint(data, start + id_length)
+        size &= (1 << (7 * size_length)) - 1
+        payload = start + id_length + size_length
+        if size == (1 << (7 * size_length)) - 1:
+            element_end = end
+        else:
+            element_end = payload + size
+        if element_end > end:
+            raise ValueError("element %x at %d runs past its parent" % (element_id, start))
+        yield element_id, payload, element_end
+        start = element_end
+
+
+def _ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def _matroska_keyframes(data):
+    segment = None
+    for element_id, start, end in _ebml_elements(data, 0, len(data)):
+        if element_id == _SEGMENT:
+            segment = (start, end)
+            break
+    if segment is None:
+        return None
+
+    found = {} # element id -> (start, end)
+    positions = {} # element id -> offset from the segment's payload, from the SeekHead
+    for element_id, start, end in _ebml_elements(data, *segment):
+        if element_id == _SEEK_HEAD:
+            positions.update(_matroska_seek_head(data, start, end))
+        elif element_id in (_INFO, _TRACKS, _CUES):
+            found.setdefault(element_id, (start, end))
+        elif element_id == _CLUSTER:
+            # The media data; jump over it to what the SeekHead points at.
+            missing = [e for e in (_INFO, _TRACKS, _CUES) if e not in found]
+            if not missing or all(e in positions for e in missing):
+                break
+    for element_id in (_INFO, _TRACKS, _CUES):
+        if element_id not in found and element_id in positions:
+            for child_id, start, end in _ebml_elements(data, segment[0] + positions[element_id],
+                                                       segment[1]):
+                if child_id == element_id:
+                    found[element_id] = (start, end)
+                break
+    if _CUES not in found:
+        return None
+
+    timecode_scale = _DEFAULT_TIMECODE_SCALE
+    if _INFO in found:
+        for element_id, start, end in _ebml_elements(data, *found[_INFO]):
+            if element_id == _TIMECODE_SCALE:
+                timecode_scale = _ebml_uint(data, start, end)
+    video_track = None
+    if _TRACKS in found:
+        video_track = _matroska_video_track(data, *found[_TRACKS])
+
+    # Cues are small and read element by element; bytes index faster than mmap.
+    start, end = found[_CUES]
+    cues = data[start:end]
+    scale = timecode_scale / 1e9
+    times = array('d')
+    for element_id, start, end in _ebml_elements(cues, 0, len(cues)):
+        if element_id != _CUE_POINT:
+            continue
+        time = None
+        tracks = []
+        for child_id, child_start, child_end in _ebml_elements(cues, start, end):
+            if child_id == _CUE_TIME:
+                time = _ebml_uint(cues, child_start, child_end)
+            elif child_id == _CUE_TRACK_POSITIONS:
+                for position_id, position_start, position_end in _ebml_elements(
+                        cues, child_start, child_end):
+                    if position_id == _CUE_TRACK:
+                        tracks.append(_ebml_uint(cues, position_start, position_end))
+        if time is not None and (video_track is None or video_track in tracks):
+            times.append(time * scale)
+    return times
+
+
+def _matroska_seek_head(data, start, end):
+    positions = {}
+    for element_id, seek_start, seek_end in _ebml_elements(data, start, end):
+        if element_id != _SEEK:
+            continue
+        target = position = None
+        for child_id, child_start, child_end in _ebml_elements(data, seek_start, seek_end):
+            if child_id == _SEEK_ID:
+                target = _ebml_uint(data, child_start, child_end)
+            elif child_id == _SEEK_POSITION:
+                position = _ebml_uint(data, child_start, child_end)
+        if target is not None and position is not None:
+            positions[target] = position
+    return positions
+
+
+def _matroska_video_track(data, start, end):
+    for element_id, entry_start, entry_end in _ebml_elements(data, start, end):
+        if element_id != _TRACK_ENTRY:
+            continue
+        number = kind = None
+        for child_id, child_start, child_end in _ebml_elements(data, entry_start, entry_end):
+            if child_id == _TRACK_NUMBER:
+                number = _ebml_uint(data, child_start, child_end)
+            elif child_id == _TRACK_TYPE:
+                kind = _ebml_uint(data, child_start, child_end)
+        if kind == _VIDEO_TRACK_TYPE:
+            return number
+    return None
+
+
+class KeyframeCache(object):
+    """
+    Keyframe indexes persisted in `directory`, one file per media file,
+    rebuilt when the media file's size or mtime changes.
+    """
+
+    def __init__(self, directory=_KEYFRAMES_CACHE):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """
+        Returns the KeyframeIndex of the local file `path`, building and
+        storing it if needed, or None if it cannot be indexed.
+        """
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = dict(path=path, size=st.st_size, mtime=st.st_mtime)
+        index = self._load(path, key)
+        if index is not None:
+            self.hits += 1
+            return index
+        self.misses += 1
+        index = build_index(path)
+        if index is not None:
+            self._store(path, key, index)
+        return index
+
+    def invalidate(self, path):
+        try:
+            os.remove(self._cache_file(os.path.abspath(path)))
+        except OSError:
+            pass
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+    def _cache_file(self, path):
+        return os.path.join(self.directory,
+                            hashlib.sha1(path.encode("utf-8", "surrogateescape")).hexdigest())
+
+    def _load(self, path, key):
+        try:
+            with open(self._cache_file(path), "rb") as f:
+                header = json.loads(f.readline())
+                if header.get('key') != key or header.get('byteorder') != sys.byteorder:
+                    return None
+                index = KeyframeIndex(())
+                index.times.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        return index
+
+    def _store(self, path, key, index):
+        filename = self._cache_file(path)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(filename + ".tmp", "wb") as f:
+                f.write(json.dumps(dict(key=key, byteorder=sys.byteorder)).encode() + b"\n")
+                f.write(index.times.tobytes())
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            logger.warning("Could not cache the keyframes of %s: %s" % (path, e))
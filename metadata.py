@@ -0,0 +1,206 @@
+"""
+Persistent cache of media metadata.
+
+Reading the codec information of a file otherwise means spawning omxplayer.
+A MetadataCache keeps the `video`, `audio`, `chapters` and `subtitles` that
+omxplayer printed for every file in a small sqlite database, so `probe` can
+answer from it straight away::
+
+    cache = MetadataCache()
+    OMXPlayer.metadata_cache = cache # players store what they parse
+    cache.warm('/media/library')     # probe a directory in the background
+    ...
+    info = probe('/media/library/bbb.mp4', cache=cache)
+    info['video']['dimensions']
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from .pyomxplayer import OMXPlayer, OMXPlayerError
+
+logger = logging.getLogger(__name__)
+
+_METADATA_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "pyomxplayer",
+                               "metadata.sqlite")
+
+
+# Probes only read the headers: omxplayer draws fully transparent, muted and
+# without switching the display mode, until it is stopped right after.
+_PROBE_ARGS = ["--alpha=0", "--vol=-6000", "--no-osd"]
+
+
+def _is_url(mediafile):
+    return "://" in mediafile
+
+
+class MetadataCache(object):
+    """
+    Metadata of media files, stored in sqlite at `path`.
+
+    Local files are keyed by path, size and mtime, so a changed file is probed
+    again. URLs are keyed by the URL alone and expire after `url_ttl` seconds.
+    Beyond `max_entries` the least recently used entries are evicted.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (
+            mediafile TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            stored REAL NOT NULL,
+            used REAL NOT NULL,
+            data TEXT NOT NULL
+        )"""
+    _MEDIA_EXTENSIONS = ('.mp4', '.m4v', '.mkv', '.mov', '.avi', '.ts', '.mpg', '.mpeg',
+                         '.mp3', '.m4a', '.aac', '.flac', '.ogg', '.wav')
+
+    def __init__(self, path=_METADATA_CACHE, max_entries=10000, url_ttl=3600.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.url_ttl = url_ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute(self._SCHEMA)
+        self._db.execute("CREATE INDEX IF NOT EXISTS metadata_used ON metadata (used)")
+        self._lock = Lock()
+        self._stats = dict(hits=0, misses=0, stored=0, evicted=0)
+
+    def _stat(self, mediafile):
+        """
+        Returns (size, mtime) of a local file, (None, None) for URLs and None
+        if the file does not exist.
+        """
+        if _is_url(mediafile):
+            return None, None
+        try:
+            st = os.stat(mediafile)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def get(self, mediafile):
+        """
+        Returns the cached metadata dict of `mediafile`, or None.
+        """
+        stat = self._stat(mediafile)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime, stored, data FROM metadata WHERE mediafile = ?",
+                (mediafile,)).fetchone()
+            if row is not None and stat is not None:
+                size, mtime, stored, data = row
+                if _is_url(mediafile):
+                    fresh = now - stored < self.url_ttl
+                else:
+                    fresh = (size, mtime) == stat
+                if fresh:
+                    self._db.execute("UPDATE metadata SET used = ? WHERE mediafile = ?",
+                                     (now, mediafile))
+                    self._stats['hits'] += 1
+                    return self._decode(data)
+            self._stats['misses'] += 1
+            return None
+
+    def store(self, mediafile, metadata):
+        """
+        Stores the metadata dict of `mediafile`, evicting the least recently
+        used entries beyond `max_entries`.
+        """
+        stat = self._stat(mediafile)
+        if stat is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                             (mediafile, stat[0], stat[1], now, now, json.dumps(metadata)))
+            self._stats['stored'] += 1
+            excess = self._db.execute("SELECT COUNT(*) FROM metadata").fetchone()[0] \
+                - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM metadata WHERE mediafile IN ("
+                                 "SELECT mediafile FROM metadata ORDER BY used LIMIT ?)",
+                                 (excess,))
+                self._stats['evicted'] += excess
+
+    def invalidate(self, mediafile=None):
+        """
+        Forgets `mediafile`, or everything if it is None.
+        """
+        with self._lock:
+            if mediafile is None:
+                self._db.execute("DELETE FROM metadata")
+            else:
+                self._db.execute("DELETE FROM metadata WHERE mediafile = ?", (mediafile,))
+
+    def stats(self):
+        """
+        Returns a dict of hit/miss/store/eviction counters and the number of entries.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = self._db.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def warm(self, media, workers=4, player_class=OMXPlayer):
+        """
+        Probes every media file in directory `media`, or in the list `media`,
+        that is not cached yet, `workers` at a time. Returns a dict mapping
+        each file to its metadata, or to the OMXPlayerError probing it raised.
+        """
+        if isinstance(media, str):
+            media = sorted(os.path.join(root, name)
+                           for root, _, names in os.walk(media) for name in names
+                           if name.lower().endswith(self._MEDIA_EXTENSIONS))
+
+        def probe_one(mediafile):
+            try:
+                return probe(mediafile, cache=self, player_class=player_class)
+            except OMXPlayerError as e:
+                logger.warning("Could not probe %s: %s" % (mediafile, e))
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(media, executor.map(probe_one, media)))
+
+    @staticmethod
+    def _decode(data):
+        metadata = json.loads(data)
+        # JSON has no tuples.
+        if 'dimensions' in metadata['video']:
+            metadata['video']['dimensions'] = tuple(metadata['video']['dimensions'])
+        return metadata
+
+
+def probe(mediafile, cache=None, player_class=OMXPlayer):
+    """
+    Returns a dict with the `video`, `audio`, `chapters` and `subtitles` of
+    `mediafile`. Cached metadata is returned straight away; otherwise
+    omxplayer is spawned, invisible and muted, to read the headers and
+    stopped again.
+    """
+    if cache is not None:
+        metadata = cache.get(mediafile)
+        if metadata is not None:
+            return metadata
+
+    player = player_class(mediafile, args=_PROBE_ARGS, fullscreen=False)
+    try:
+        metadata = player.metadata()
+    finally:
+        player.stop()
+    if cache is not None and player.metadata_cache is not cache:
+        cache.store(mediafile, metadata)
+    return metadata
@@ -0,0 +1,202 @@
+"""
+Metrics and tracing for player operations.
+
+Players report nothing until a Metrics instance is attached; with one
+attached they count and time startup, commands, status lines, seeks,
+restarts and stop(), and forward them to its sinks::
+
+    exporter = PrometheusExporter()
+    exporter.serve(9105)
+    OMXPlayer.metrics = Metrics(exporter)
+
+A span hook, e.g. an OpenTelemetry tracer's ``start_as_current_span``, is
+wrapped around player startup, `seek` and `stop`::
+
+    OMXPlayer.metrics = Metrics(exporter, span_hook=lambda name, attributes:
+                                tracer.start_as_current_span(name, attributes=attributes))
+"""
+
+import logging
+
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+_NO_SPAN = nullcontext()
+
+# Metrics reported by the players, with their type and help text.
+METRICS = {
+    'omxplayer_startup_seconds':
+        ('histogram', "Time from spawning omxplayer until its headers were parsed."),
+    'omxplayer_command_latency_seconds':
+        ('histogram', "Time keystrokes were queued before being written to omxplayer."),
+    'omxplayer_status_lines_total':
+        ('counter', "Status lines parsed."),
+    'omxplayer_position_staleness_seconds':
+        ('histogram', "Age of the last status sample when the next one arrived."),
+    'omxplayer_seek_seconds':
+        ('histogram', "Latency of OMXPlayer.seek, by method."),
+    'omxplayer_seek_error_seconds':
+        ('histogram', "Absolute distance between the seek target and where playback ended up."),
+    'omxplayer_restarts_total':
+        ('counter', "omxplayer processes restarted to seek."),
+    'omxplayer_stop_seconds':
+        ('histogram', "Duration of OMXPlayer.stop."),
+    'omxplayer_stall_recoveries_total':
+        ('counter', "Stalled omxplayer processes restarted by a StallWatchdog."),
+    'omxplayer_stall_recovery_failures_total':
+        ('counter', "Restarts of stalled omxplayer processes that failed."),
+    'omxplayer_stall_recovery_seconds':
+        ('histogram', "Time from noticing a stall until the restarted omxplayer played."),
+}
+
+
+class Metrics(object):
+    """
+    Forwards counter increments and histogram observations to `sinks`, and
+    opens spans through `span_hook`.
+
+    A sink has ``increment(name, value, labels)`` and
+    ``observe(name, value, labels)`` methods; `labels` is a dict. The span
+    hook is called as ``span_hook(name, attributes)`` and returns a context
+    manager.
+    """
+
+    def __init__(self, *sinks, span_hook=None):
+        self.sinks = list(sinks)
+        self.span_hook = span_hook
+
+    def increment(self, name, value=1, **labels):
+        for sink in self.sinks:
+            sink.increment(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        for sink in self.sinks:
+            sink.observe(name, value, labels)
+
+    def span(self, name, **attributes):
+        if self.span_hook is None:
+            return _NO_SPAN
+        return self.span_hook(name, attributes)
+
+
+class PrometheusExporter(object):
+    """
+    Sink that aggregates counters and histograms and renders them in the
+    Prometheus text exposition format, see `render` and `serve`.
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+               10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {} # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> [bucket counts..., count, sum]
+        self._lock = Lock()
+        self._server = None
+
+    def increment(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def value(self, name, **labels):
+        """
+        Returns a counter's value, or a histogram's (count, sum), or None.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            if key in self._histograms:
+                return tuple(self._histograms[key][-2:])
+        return None
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(h)) for key, h in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                help_text = METRICS.get(name, (kind, name))[1]
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s %s" % (name, kind))
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append("%s%s %s" % (name, _format_labels(labels), _format_value(value)))
+        for (name, labels), histogram in histograms:
+            describe(name, 'histogram')
+            for bound, count in zip(self.buckets, histogram):
+                lines.append("%s_bucket%s %d" % (
+                    name, _format_labels(labels + (('le', _format_value(bound)),)), count))
+            lines.append("%s_bucket%s %d" % (name, _format_labels(labels + (('le', "+Inf"),)),
+                                             histogram[-2]))
+            lines.append("%s_count%s %d" % (name, _format_labels(labels), histogram[-2]))
+            lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                                          _format_value(histogram[-1])))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host=""):
+        """
+        Serves `render` over HTTP on `port` from a daemon thread.
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = HTTPServer((host, port), Handler)
+        thread = Thread(target=self._server.serve_forever, name="PrometheusExporter")
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\")
+                                          .replace('"', '\\"').replace("\n", "\\n"))
+                             for key, value in labels)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,260 @@
+"""
+Gapless playlists.
+
+Starting omxplayer only after the previous item finished leaves a black gap
+of a whole startup time. A Playlist spawns the next item paused while the
+current one plays, and at the boundary, which it times with the current
+item's position feed, unpauses the next item and stops the old one::
+
+    playlist = Playlist(['/media/a.mp4', '/media/b.mp4'], preroll=5, loop=True)
+    playlist.play()
+    ...
+    playlist.insert_next('/media/announcement.mp4')
+    ...
+    playlist.stop()
+    print(playlist.transitions) # the measured gap of every handover
+"""
+
+import logging
+import random
+import time
+
+from collections import deque
+from threading import Condition, Thread
+
+from .pyomxplayer import OMXPlayer, stop_all
+
+logger = logging.getLogger(__name__)
+
+
+class Playlist(object):
+    """
+    Plays `items` one after the other without a gap between them.
+
+    The next item is spawned paused `preroll` seconds before the current
+    one ends, and unpaused `_HANDOVER_LEAD` seconds before it ends to make
+    up for the keystroke's latency. Items whose length omxplayer does not
+    print are handed over when they finish.
+
+    `loop` starts over after the last item, and `shuffle` plays every round
+    in a new random order. Every handover is appended to `transitions` as a
+    dict with the `mediafile` started, whether it was `preloaded` and the
+    measured `gap` in seconds between the old item's end and the first
+    status line of the new one moving; negative gaps are overlaps.
+
+    When `player_class` has a `resolver`, the stream URLs of the next
+    `_PREFETCH` items are resolved in the background.
+    """
+
+    _HANDOVER_LEAD = 0.02 # seconds before the end to unpause the next item
+    _POLL_TIMEOUT = 0.5 # seconds to wait for a status line before checking again
+    _STATUS_INTERVAL = 0.1 # seconds between status lines to allow for
+    _PREFETCH = 3 # upcoming items resolved ahead when the player class has a resolver
+
+    def __init__(self, items, player_class=OMXPlayer, args=None, fullscreen=True,
+                 preroll=2.0, loop=False, shuffle=False):
+        self.items = list(items)
+        self.player_class = player_class
+        self.args = args
+        self.fullscreen = fullscreen
+        self.preroll = preroll
+        self.loop = loop
+        self.shuffle = shuffle
+
+        self.current = None # the playing OMXPlayer
+        self.transitions = []
+        self.finished = False
+
+        self._upcoming = deque() # mediafiles after the preloaded one
+        self._next = None # (mediafile, spawning Thread, [player or exception])
+        self._condition = Condition()
+        self._closed = False
+        self._thread = None
+
+    def play(self):
+        """
+        Starts the first item and the thread that hands over to the next ones.
+        """
+        self._refill()
+        if not self._upcoming:
+            raise ValueError("Playlist has no items")
+        self._prefetch()
+        self.current = self._spawn(self._upcoming.popleft(), paused=False)
+        self._thread = Thread(target=self._run, name="Playlist")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def insert_next(self, mediafile):
+        """
+        Plays `mediafile` after the current item, or after the next one if
+        that has been preloaded already.
+        """
+        with self._condition:
+            self._upcoming.appendleft(mediafile)
+        self._prefetch()
+
+    def upcoming(self):
+        """
+        Returns the mediafiles still to play in this round, preloaded one first.
+        """
+        with self._condition:
+            preloaded = [self._next[0]] if self._next is not None else []
+            return preloaded + list(self._upcoming)
+
+    def stop(self):
+        """
+        Stops the current and the preloaded item and the handover thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        stop_all(player for player in (self.current, self._take_next()) if player is not None)
+        self.finished = True
+
+    def wait_finished(self, timeout=None):
+        """
+        Blocks until the last item finished. Returns whether it did within `timeout`.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.finished
+
+    def _refill(self):
+        items = list(self.items)
+        if self.shuffle:
+            random.shuffle(items)
+        self._upcoming.extend(items)
+
+    def _prefetch(self):
+        """
+        Starts resolving the stream URLs of the next `_PREFETCH` items.
+        """
+        resolver = self.player_class.resolver
+        if resolver is not None:
+            with self._condition:
+                upcoming = list(self._upcoming)[:self._PREFETCH]
+            resolver.prefetch(upcoming)
+
+    def _spawn(self, mediafile, paused):
+        player = self.player_class(mediafile, args=self.args, fullscreen=self.fullscreen)
+        if paused:
+            player.pause()
+        elif player._paused:
+            player.play()
+        return player
+
+    def _preload(self):
+        """
+        Starts spawning the next item paused, if there is one.
+        """
+        with self._condition:
+            if self._next is not None:
+                return
+            if not self._upcoming and self.loop:
+                self._refill()
+            if not self._upcoming:
+                return
+            mediafile = self._upcoming.popleft()
+            result = []
+
+            def spawn():
+                try:
+                    result.append(self._spawn(mediafile, paused=True))
+                except Exception as e:
+                    logger.exception("Could not preload %s" % mediafile)
+                    result.append(e)
+            thread = Thread(target=spawn, name="Playlist preload")
+            thread.daemon = True
+            self._next = (mediafile, thread, result)
+        thread.start()
+
+    def _take_next(self):
+        """
+        Returns the preloaded player, once it is ready, and forgets it. Returns
+        None if there is none or it failed to start.
+        """
+        with self._condition:
+            if self._next is None:
+                return None
+            mediafile, thread, result = self._next
+            self._next = None
+        thread.join()
+        player = result[0]
+        return None if isinstance(player, Exception) else player
+
+    def _remaining(self, player, position):
+        """
+        Returns the seconds of playback left, or None if the length is unknown.
+        """
+        if not player.length:
+            return None
+        rate = player._playback_rate()
+        if not rate:
+            return float('inf')
+        return (player.length - position) / rate
+
+    def _run(self):
+        while True:
+            player = self.current
+            position = player.wait_for_position(self._POLL_TIMEOUT)
+            with self._condition:
+                if self._closed:
+                    return
+            if player.finished:
+                self._handover(time.monotonic())
+            elif position is not None:
+                remaining = self._remaining(player, player.position)
+                if remaining is None or remaining > self.preroll:
+                    continue
+                self._preload()
+                if remaining > self._HANDOVER_LEAD + self._STATUS_INTERVAL:
+                    continue
+                # Close enough to time the rest by extrapolating the position.
+                end = time.monotonic() + max(remaining, 0)
+                time.sleep(max(remaining - self._HANDOVER_LEAD, 0))
+                self._handover(end)
+            if self.current is None:
+                self.finished = True
+                return
+
+    def _handover(self, end):
+        """
+        Unpauses the preloaded item, stops the current one and measures the
+        gap between `end`, when the current item ended, and the new one moving.
+        """
+        old = self.current
+        with self._condition:
+            preloaded = self._next is not None
+        self._preload()
+        with self._condition:
+            mediafile = self._next[0] if self._next is not None else None
+        new = self._take_next()
+        if new is None and mediafile is not None:
+            preloaded = False
+            try:
+                new = self._spawn(mediafile, paused=True)
+            except Exception:
+                logger.exception("Could not start %s" % mediafile)
+        if new is not None:
+            start_position = new.position
+            new.play()
+        # Stopping takes a while; do not hold up the new item for it.
+        stopper = Thread(target=old.stop, name="Playlist stop")
+        stopper.daemon = True
+        stopper.start()
+        self.current = new
+        if new is None:
+            stopper.join()
+            return
+        self._prefetch()
+
+        gap = None
+        while not new.finished:
+            position = new.wait_for_position(self._POLL_TIMEOUT)
+            if position is not None and position > start_position:
+                gap = time.monotonic() - end
+                break
+        self.transitions.append(dict(mediafile=mediafile, preloaded=preloaded, gap=gap))
+        logger.info("Started %s, gap %s" % (mediafile, gap))
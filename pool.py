@@ -0,0 +1,213 @@
+"""
+Pool of pre-warmed players.
+
+Spawning omxplayer and parsing its headers dominates the latency of switching
+content. A PlayerPool keeps players for upcoming media spawned and paused in
+the background so `acquire` can hand one out immediately::
+
+    pool = PlayerPool(size=2)
+    pool.prepare('/media/next.mp4', '/media/after.mp4')
+    ...
+    player = pool.acquire('/media/next.mp4') # already playing
+"""
+
+import logging
+import time
+
+from collections import deque
+from threading import Condition, Thread
+
+from .pyomxplayer import OMXPlayer, stop_all
+
+logger = logging.getLogger(__name__)
+
+
+def process_rss(pid):
+    """
+    Returns the resident set size of process `pid` in bytes, or 0 if unknown.
+    """
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return 0
+
+
+class PlayerPool(object):
+    """
+    Keeps up to `size` players spawned and paused on upcoming media.
+
+    Ready players are evicted once they have been idle for `idle_timeout`
+    seconds, or oldest first while their total resident memory exceeds
+    `max_memory` bytes.
+    """
+
+    _CHECK_INTERVAL = 1.0 # seconds between idle/memory checks
+
+    def __init__(self, size=1, player_class=OMXPlayer, args=None, fullscreen=True,
+                 idle_timeout=None, max_memory=None):
+        self.size = size
+        self.player_class = player_class
+        self.args = args
+        self.fullscreen = fullscreen
+        self.idle_timeout = idle_timeout
+        self.max_memory = max_memory
+
+        self._upcoming = deque()
+        self._ready = [] # (mediafile, player, ready since) in spawn order
+        self._spawning = [] # mediafiles being spawned
+        self._closed = False
+        self._condition = Condition()
+        self._stats = dict(hits=0, misses=0, spawned=0, evicted=0, failed=0)
+
+        self._refill_thread = Thread(target=self._refill)
+        self._refill_thread.daemon = True
+        self._refill_thread.start()
+
+    def prepare(self, *mediafiles):
+        """
+        Queues `mediafiles` as upcoming; players are pre-warmed in this order.
+        """
+        with self._condition:
+            self._upcoming.extend(mediafiles)
+            self._condition.notify_all()
+
+    def acquire(self, mediafile):
+        """
+        Returns a playing player for `mediafile`, pre-warmed if one is ready.
+        """
+        with self._condition:
+            try:
+                self._upcoming.remove(mediafile)
+            except ValueError:
+                pass
+            for i, (ready_mediafile, player, since) in enumerate(self._ready):
+                if ready_mediafile == mediafile and not player.finished:
+                    del self._ready[i]
+                    self._stats['hits'] += 1
+                    self._condition.notify_all()
+                    break
+            else:
+                player = None
+                self._stats['misses'] += 1
+
+        if player is None:
+            logger.info("Pool miss for %s" % mediafile)
+            return self._spawn(mediafile, paused=False)
+        player.play()
+        return player
+
+    def stats(self):
+        """
+        Returns a dict of hit/miss/spawn/eviction counters and the current
+        number of ready players and their memory use.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            players = [player for _, player, _ in self._ready]
+        stats['ready'] = len(players)
+        stats['memory'] = sum(process_rss(p._process.pid) for p in players)
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / requests if requests else 0.0
+        return stats
+
+    def close(self):
+        """
+        Stops the refill thread and every ready player.
+        """
+        with self._condition:
+            self._closed = True
+            ready, self._ready = self._ready, []
+            self._condition.notify_all()
+        self._refill_thread.join()
+        stop_all(player for _, player, _ in ready)
+
+    def _spawn(self, mediafile, paused):
+        player = self.player_class(mediafile, args=self.args, fullscreen=self.fullscreen)
+        if paused:
+            player.pause()
+        return player
+
+    def _next_to_prepare(self):
+        """
+        Returns the first upcoming mediafile without a ready or spawning
+        player, if the pool has room for one.
+        """
+        if len(self._ready) + len(self._spawning) >= self.size:
+            return None
+        taken = [mediafile for mediafile, _, _ in self._ready] + self._spawning
+        for mediafile in self._upcoming:
+            if mediafile in taken:
+                taken.remove(mediafile)
+            else:
+                return mediafile
+        return None
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                evicted = self._evict()
+                mediafile = self._next_to_prepare()
+                if mediafile is None and not evicted and not self._closed:
+                    self._condition.wait(self._CHECK_INTERVAL)
+                    continue
+                if mediafile is not None and not self._closed:
+                    self._spawning.append(mediafile)
+            stop_all(evicted)
+            if self._closed:
+                return
+            if mediafile is None:
+                continue
+
+            try:
+                player = self._spawn(mediafile, paused=True)
+            except Exception:
+                logger.exception("Could not pre-warm %s" % mediafile)
+                player = None
+
+            with self._condition:
+                self._spawning.remove(mediafile)
+                if player is None:
+                    self._stats['failed'] += 1
+                    # Do not retry the same mediafile forever.
+                    if mediafile in self._upcoming:
+                        self._upcoming.remove(mediafile)
+                    continue
+                self._stats['spawned'] += 1
+                if not self._closed:
+                    self._ready.append((mediafile, player, time.monotonic()))
+                    player = None
+            if player is not None:
+                player.stop()
+
+    def _evict(self):
+        """
+        Removes ready players that finished, idled too long or exceed the
+        memory budget, and returns them to be stopped. Evicted mediafiles are
+        dropped from the upcoming queue so they are not spawned again straight
+        away. Called with the condition held.
+        """
+        now = time.monotonic()
+        evicted = []
+        for entry in list(self._ready):
+            mediafile, player, since = entry
+            if player.finished or (self.idle_timeout is not None and
+                                   now - since > self.idle_timeout):
+                self._ready.remove(entry)
+                evicted.append(player)
+
+        if self.max_memory is not None:
+            sizes = [process_rss(player._process.pid) for _, player, _ in self._ready]
+            while self._ready and sum(sizes) > self.max_memory:
+                evicted.append(self._ready.pop(0)[1])
+                sizes.pop(0)
+
+        for player in evicted:
+            logger.info("Evicting pre-warmed player for %s" % player.mediafile)
+            self._stats['evicted'] += 1
+            if player.mediafile in self._upcoming:
+                self._upcoming.remove(player.mediafile)
+        return evicted
@@ -1,35 +1,580 @@
 import os
-import pexpect
+import json
 import re
 import logging
 import math
+import select
+import shlex
+import signal
+import subprocess
+import time
 
-from threading import Thread
-from time import sleep
+from array import array
+from concurrent.futures import Future
+from contextlib import nullcontext
+from threading import Condition, Lock, Thread, current_thread
+
+from .clock import Clock
+from .transport import PtyProcess
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 _OMXPLAYER_EXECUTABLE = "/usr/bin/omxplayer"
 
+_NO_SPAN = nullcontext()
+
+_CAPABILITIES_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "pyomxplayer",
+                                   "capabilities.json")
+
+class Capabilities(object):
+    """
+    The options and version supported by an omxplayer binary.
+
+    The help output is parsed once and persisted to `cache_path`, keyed by the
+    executable's path, mtime and size, so later checks are set lookups that
+    do not run omxplayer at all. Call `invalidate` to probe again.
+    """
+
+    _OPTION_REXP = re.compile(r"(?:^|\s)(--?[A-Za-z][\w-]*)")
+    _VERSION_REXP = re.compile(r"Version\s*:\s*(\S+)")
+    _PROBE_TIMEOUT = 10.0 # seconds allowed for omxplayer to print its help
+
+    def __init__(self, executable=_OMXPLAYER_EXECUTABLE, cache_path=_CAPABILITIES_CACHE):
+        self.executable = executable
+        self.cache_path = cache_path
+        self._lock = Lock()
+        self._options = None
+        self._version = None
+        self._available = None
+
+    @property
+    def available(self):
+        """
+        Whether the executable exists and may be run.
+        """
+        if self._available is None:
+            self._available = os.access(self.executable, os.X_OK)
+        return self._available
+
+    @property
+    def options(self):
+        """
+        The frozenset of options listed in the help output.
+        """
+        if self._options is None:
+            self._load()
+        return self._options
+
+    @property
+    def version(self):
+        """
+        The version string reported by omxplayer, or None if it reports none.
+        """
+        if self._options is None:
+            self._load()
+        return self._version
+
+    def supports(self, option):
+        return option.strip() in self.options
+
+    def invalidate(self):
+        """
+        Forgets everything known about the executable, in memory and on disk.
+        """
+        with self._lock:
+            self._options = self._version = self._available = None
+            cache = self._read_cache()
+            if cache.pop(self.executable, None) is not None:
+                self._write_cache(cache)
+
+    def _key(self):
+        try:
+            st = os.stat(self.executable)
+        except OSError:
+            return None
+        return [st.st_mtime, st.st_size]
+
+    def _load(self):
+        with self._lock:
+            if self._options is not None:
+                return
+            key = self._key()
+            cache = self._read_cache()
+            entry = cache.get(self.executable)
+            if key is None or entry is None or entry.get('key') != key:
+                entry = dict(key=key, **self._probe())
+                if key is not None:
+                    cache[self.executable] = entry
+                    self._write_cache(cache)
+            self._version = entry['version']
+            self._options = frozenset(entry['options'])
+
+    def _probe(self):
+        """
+        Runs omxplayer without a file, as that prints its help, and asks for
+        its version.
+        """
+        logger.info("Probing capabilities of %s" % self.executable)
+        help_text = self._run([self.executable])
+        version_text = self._run([self.executable, "--version"])
+        match = self._VERSION_REXP.search(version_text) or self._VERSION_REXP.search(help_text)
+        return dict(options=sorted(set(self._OPTION_REXP.findall(help_text))),
+                    version=match.group(1) if match else None)
+
+    def _run(self, argv):
+        try:
+            return subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT, timeout=self._PROBE_TIMEOUT
+                                  ).stdout.decode("utf-8", "replace")
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("Could not run %s: %s" % (argv[0], e))
+            return ""
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = "%s.%d.tmp" % (self.cache_path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except (IOError, OSError) as e:
+            logger.warning("Could not write %s: %s" % (self.cache_path, e))
+
+_capabilities = {}
+
+def get_capabilities(executable=_OMXPLAYER_EXECUTABLE):
+    """
+    Returns the shared Capabilities of `executable`.
+    """
+    try:
+        return _capabilities[executable]
+    except KeyError:
+        return _capabilities.setdefault(executable, Capabilities(executable))
+
+def invalidate_capabilities():
+    """
+    Forgets all probed capabilities, e.g. after omxplayer was upgraded.
+    """
+    for capabilities in list(_capabilities.values()):
+        capabilities.invalidate()
+    _capabilities.clear()
+
 def is_omxplayer_available():
     """
     :rtype: boolean
     """
-    return os.access(_OMXPLAYER_EXECUTABLE, os.X_OK)
+    return get_capabilities().available
 
 def omxplayer_parameter_exists(parameter_string):
-    return bool(re.search(b"\s%s\s" % parameter_string.strip(), os.popen("/usr/bin/omxplayer").read()))
+    return get_capabilities().supports(parameter_string)
+
+class OMXPlayerError(Exception):
+    pass
+
+class StartupTimeoutError(OMXPlayerError):
+    """
+    Raised when omxplayer does not print its headers within the startup deadline.
+    """
+    pass
+
+class CommandTimeoutError(OMXPlayerError):
+    """
+    Set on a command's future when omxplayer's output does not show its
+    effect within the deadline, see `OMXPlayer._expect`.
+    """
+    pass
+
+class HeaderParser(object):
+    """
+    Incrementally parses the headers omxplayer prints on startup.
+
+    Feed it output as it arrives; `feed` returns True as soon as the stream
+    layout is known, which is when both the video and audio lines were seen,
+    or when the file line announced which of them to expect and those were
+    seen. Anything after the last complete header line is kept in `leftover`.
+    """
+
+    _FILEPROP_REXP = re.compile(br".*audio streams (\d+) video streams (\d+) chapters (\d+) subtitles (\d+).*")
+    _VIDEOPROP_REXP = re.compile(br".*Video codec ([\w-]+) width (\d+) height (\d+) profile (-?\d+) fps ([\d.]+).*")
+    _AUDIOPROP_REXP = re.compile(br".*Audio codec (\w+) channels (\d+) samplerate (\d+) bitspersample (\d+).*")
+    _LENGTH_REXP = re.compile(br"\blength (\d+)")
+    _LINE_END_REXP = re.compile(br"[\r\n]")
+
+    def __init__(self):
+        self.video = dict()
+        self.audio = dict()
+        self.chapters = None
+        self.subtitles = None
+        self.length = None # seconds, if the file line gives it
+        self.done = False
+        self.leftover = b""
+        self._streams = None # (audio streams, video streams) from the file line
+
+    def feed(self, data):
+        """
+        Parses the complete lines in `data`. Returns whether the headers are done.
+        """
+        if self.done:
+            self.leftover += data
+            return True
+
+        data = self.leftover + data
+        start = 0
+        for match in self._LINE_END_REXP.finditer(data):
+            self._parse_line(data[start:match.start()])
+            start = match.end()
+            if self._is_done():
+                self.done = True
+                self._finish()
+                break
+        self.leftover = data[start:]
+        return self.done
+
+    def _parse_line(self, line):
+        match = self._VIDEOPROP_REXP.search(line)
+        if match:
+            video_props = match.groups()
+            self.video['decoder'] = video_props[0].decode()
+            self.video['dimensions'] = tuple(int(x) for x in video_props[1:3])
+            self.video['profile'] = int(video_props[3])
+            self.video['fps'] = float(video_props[4])
+            return
+
+        match = self._AUDIOPROP_REXP.search(line)
+        if match:
+            audio_props = match.groups()
+            self.audio['decoder'] = audio_props[0].decode()
+            (self.audio['channels'], self.audio['rate'],
+             self.audio['bps']) = [int(x) for x in audio_props[1:]]
+            return
+
+        match = self._FILEPROP_REXP.search(line)
+        if match:
+            file_props = [int(x) for x in match.groups()]
+            self._streams = tuple(file_props[:2])
+            self.chapters, self.subtitles = file_props[2:]
+            match = self._LENGTH_REXP.search(line)
+            if match:
+                self.length = int(match.group(1))
+
+    def _is_done(self):
+        has_video = 'decoder' in self.video
+        has_audio = 'decoder' in self.audio
+        if has_video and has_audio:
+            return True
+        if self._streams is None:
+            return False
+        audio_streams, video_streams = self._streams
+        return (has_video or not video_streams) and (has_audio or not audio_streams)
+
+    def _finish(self):
+        if self._streams is not None:
+            self.audio['streams'], self.video['streams'] = self._streams
+        else:
+            self.audio['streams'] = 1 if self.audio else 0
+            self.video['streams'] = 1 if self.video else 0
+            self.chapters = self.subtitles = 0
+
+class CommandQueue(object):
+    """
+    Coalesces keystrokes for omxplayer into a single write per tick.
+
+    Commands pushed within `tick` seconds of the oldest pending one are
+    written together, and a pending command is cancelled by pushing its opposite (for instance
+    '+' followed by '-'), so a ramp of any size costs one write.
+    """
+
+    def __init__(self, write, tick, opposites, observe=None, clock=None):
+        self._write = write
+        self._tick = tick
+        self._opposites = opposites
+        self._observe = observe # called with how long each write was queued
+        self._clock = clock or Clock()
+        self._pending = []
+        self._queued = None # when the oldest pending command was pushed
+        self._condition = Condition()
+        self._closed = False
+        self.writes = 0 # number of writes made, for statistics
+
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def push(self, cmd, count=1):
+        """
+        Queues `cmd` `count` times, cancelling pending opposite commands first.
+        """
+        with self._condition:
+            opposite = self._opposites.get(cmd)
+            while count and opposite in self._pending:
+                # Remove the most recent one, keeping the others in order.
+                index = len(self._pending) - 1 - self._pending[::-1].index(opposite)
+                del self._pending[index]
+                count -= 1
+            if not self._pending:
+                self._queued = self._clock.monotonic()
+            self._pending.extend([cmd] * count)
+            self._clock.notify(self._condition)
+
+    def flush(self):
+        """
+        Writes all pending commands now.
+        """
+        with self._condition:
+            self._flush()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._clock.notify(self._condition)
+
+    def _flush(self):
+        if self._pending:
+            data = "".join(self._pending).encode()
+            self._pending = []
+            self.writes += 1
+            try:
+                self._write(data)
+            except OSError as e:
+                logger.warning("Could not send %r to omxplayer: %s" % (data, e))
+            if self._observe is not None:
+                self._observe(self._clock.monotonic() - self._queued)
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._pending:
+                    self._clock.wait(self._condition)
+                    continue
+                # Give the caller a tick to queue more, then write it all.
+                remaining = self._queued + self._tick - self._clock.monotonic()
+                if remaining > 0:
+                    self._clock.wait(self._condition, remaining)
+                    continue
+                self._flush()
+
+class PositionSamples(object):
+    """
+    Fixed-size ring buffer of (monotonic time, media position, playback rate)
+    samples, one per status line, with drift and jitter statistics.
+
+    Only the output reader thread adds samples.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0 # samples added in total
+        self._data = array('d', bytes(8 * 3 * size))
+
+    def add(self, t, position, rate):
+        i = (self.count % self.size) * 3
+        self._data[i] = t
+        self._data[i + 1] = position
+        self._data[i + 2] = rate
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def samples(self):
+        """
+        Returns the buffered samples as a list of tuples, oldest first.
+        """
+        count = min(self.count, self.size)
+        start = self.count - count
+        data = self._data
+        return [tuple(data[(j % self.size) * 3:(j % self.size) * 3 + 3])
+                for j in range(start, start + count)]
+
+    def stats(self, jump_threshold):
+        """
+        Returns a dict with the mean and standard deviation of the `interval`
+        between samples and of the `jitter` of each position against the one
+        extrapolated from its predecessor, and the `drift` of the media clock
+        against the monotonic clock in seconds per second. Jumps of more than
+        `jump_threshold` seconds, i.e. seeks, are left out.
+        """
+        samples = self.samples()
+        intervals = []
+        residuals = []
+        for (t0, p0, rate), (t1, p1, _) in zip(samples, samples[1:]):
+            residual = p1 - (p0 + (t1 - t0) * rate)
+            if abs(residual) > jump_threshold:
+                continue
+            intervals.append(t1 - t0)
+            residuals.append(residual)
+        elapsed = sum(intervals)
+        return dict(samples=len(samples),
+                    interval=_mean_stdev(intervals),
+                    jitter=_mean_stdev(residuals),
+                    drift=sum(residuals) / elapsed if elapsed else 0.0)
+
+
+def _mean_stdev(values):
+    if not values:
+        return dict(mean=0.0, stdev=0.0)
+    mean = sum(values) / len(values)
+    return dict(mean=mean, stdev=(sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5)
+
+
+class StatusParser(object):
+    """
+    Parses omxplayer's output after the headers without regular expressions.
+
+    The pty is read straight into one reusable bytearray. All complete lines
+    in it are split off at once, and the position is taken from the field
+    after 'M:' (or 'V :'), so a status line costs a few C-level byte
+    operations rather than a regex search.
+    """
+
+    DONE = "done" # returned by `next` for omxplayer's goodbye line
+    VOLUME = "volume" # returned by `next` for a volume echo, see `volume`
+
+    _STATUS_MARKERS = (b"M:", b"V :")
+    _DONE_MARKER = b"have a nice day"
+    _VOLUME_MARKER = b"Current Volume:"
+
+    def __init__(self, size=4096):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0 # first byte not split into lines yet
+        self._end = 0 # end of the data read so far
+        self._lines = [] # complete lines not parsed yet, last first
+        self.lines = 0 # lines parsed, for statistics
+        self.volume = None # dB, from the last volume echo
+
+    def feed(self, data):
+        """
+        Adds `data` that was read elsewhere, e.g. HeaderParser.leftover.
+        """
+        self._make_room(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def read(self, fd):
+        """
+        Reads what is available on `fd` into the buffer, blocking until
+        something is. Returns the number of bytes read, 0 at end of file.
+        """
+        self._make_room(1)
+        count = os.readv(fd, [self._view[self._end:]])
+        self._end += count
+        return count
+
+    def tail(self, count):
+        """
+        Returns a view of the last `count` bytes read, e.g. to capture them.
+        Release it before the next `read` or `feed`.
+        """
+        return self._view[self._end - count:self._end]
+
+    def _make_room(self, count):
+        if self._start:
+            # Move the partial line to the front.
+            remaining = self._end - self._start
+            self._buffer[:remaining] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, remaining
+        if len(self._buffer) - self._end < count:
+            self._view.release()
+            self._buffer.extend(bytes(max(count, len(self._buffer))))
+            self._view = memoryview(self._buffer)
+
+    def _split_lines(self):
+        """
+        Moves all complete lines from the buffer to `_lines`.
+        """
+        buffer, start, end = self._buffer, self._start, self._end
+        line_end = max(buffer.rfind(b"\r", start, end), buffer.rfind(b"\n", start, end))
+        if line_end < 0:
+            return
+        lines = self._view[start:line_end].tobytes().replace(b"\n", b"\r").split(b"\r")
+        lines.reverse()
+        self._lines = lines
+        self._start = line_end + 1
+
+    def next(self):
+        """
+        Returns the position in seconds of the next complete status line,
+        DONE for the goodbye line, VOLUME for the line omxplayer echoes after
+        a volume key or None once all complete lines were parsed. Other lines
+        are skipped.
+        """
+        lines = self._lines
+        while True:
+            if not lines:
+                self._split_lines()
+                lines = self._lines
+                if not lines:
+                    return None
+            line = lines.pop()
+            if not line:
+                continue
+            self.lines += 1
+            for marker in self._STATUS_MARKERS:
+                i = line.find(marker)
+                if i >= 0:
+                    fields = line[i + len(marker):].split(None, 1)
+                    try:
+                        return float(fields[0]) / 1000000
+                    except (IndexError, ValueError):
+                        break
+            if self._DONE_MARKER in line:
+                return self.DONE
+            i = line.find(self._VOLUME_MARKER)
+            if i >= 0:
+                try:
+                    self.volume = float(line[i + len(self._VOLUME_MARKER):].strip().rstrip(b"dB"))
+                except ValueError:
+                    continue
+                return self.VOLUME
+
+
+def stop_all(players, timeout=None):
+    """
+    Stops `players` concurrently, each as `OMXPlayer.stop` does, so tearing
+    down many takes about as long as the slowest one.
+
+    Returns a dict with the overall `latency` in seconds and the `stops`,
+    the result of each player's `stop` in order. If any raised, the first
+    error is raised once all are done.
+    """
+    players = list(players)
+    start = time.monotonic()
+    results = [None] * len(players)
+
+    def stop(index, player):
+        try:
+            results[index] = player.stop(timeout)
+        except Exception as e:
+            results[index] = e
+    threads = [Thread(target=stop, args=item, name="stop_all") for item in enumerate(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        raise errors[0]
+    return dict(latency=time.monotonic() - start, stops=results)
+
 
 class OMXPlayer(object):
 
-    _FILEPROP_REXP = re.compile(r".*audio streams (\d+) video streams (\d+) chapters (\d+) subtitles (\d+).*")
-    _VIDEOPROP_REXP = re.compile(r".*Video codec ([\w-]+) width (\d+) height (\d+) profile (-?\d+) fps ([\d.]+).*", flags=re.MULTILINE)
-    _AUDIOPROP_REXP = re.compile(r".*Audio codec (\w+) channels (\d+) samplerate (\d+) bitspersample (\d+).*", flags=re.MULTILINE)
-    _STATUS_REXP = re.compile(r"(M:|V :)\s*([\d.]+).*")
-    _DONE_REXP = re.compile(r"have a nice day.*")
+    _READ_SIZE = 4096
+    _STARTUP_TIMEOUT = 30.0 # seconds allowed for omxplayer to print its headers
 
-    _LAUNCH_CMD = _OMXPLAYER_EXECUTABLE + " -o hdmi -s %s %s"
+    # The player's args and the mediafile are appended to this argv.
+    _LAUNCH_ARGV = [_OMXPLAYER_EXECUTABLE, "-o", "hdmi", "-s"]
+    # Spawns omxplayer on a pty, see the transport module.
+    _PROCESS_CLASS = PtyProcess
 
     _PAUSE_CMD = 'p'
     _TOGGLE_SUB_CMD = 's'
@@ -42,9 +587,42 @@ class OMXPlayer(object):
     _SEEK_FORWARD_30_CMD = "\033[C" # key right
     _SEEK_BACKWARD_600_CMD = "\033[B" # key down
     _SEEK_FORWARD_600_CMD = "\033[A" # key up
+    _PREVIOUS_AUDIO_CMD = 'j'
+    _NEXT_AUDIO_CMD = 'k'
+    _PREVIOUS_CHAPTER_CMD = 'i'
+    _NEXT_CHAPTER_CMD = 'o'
+    _PREVIOUS_SUBTITLES_CMD = 'n'
+    _NEXT_SUBTITLES_CMD = 'm'
+
+    # Commands that cancel each other out while queued, see CommandQueue.
+    _OPPOSITE_CMDS = {
+        _DECREASE_VOLUME_CMD: _INCREASE_VOLUME_CMD,
+        _INCREASE_VOLUME_CMD: _DECREASE_VOLUME_CMD,
+        _DECREASE_SPEED_CMD: _INCREASE_SPEED_CMD,
+        _INCREASE_SPEED_CMD: _DECREASE_SPEED_CMD,
+    }
+    _COMMAND_TICK = 0.005 # seconds commands are held back to be coalesced
+
+    # omxplayer arguments that start with another than the first stream.
+    _AUDIO_INDEX_ARGS = ("-n", "--aidx")
+    _SUBTITLE_INDEX_ARGS = ("--sid",)
 
     _VOLUME_INCREMENT = 0.5 # Volume increment used by OMXPlayer in dB
 
+    # Seeking, see `seek`.
+    _SEEK_STEP_TIMEOUT = 2.0 # seconds to wait for a key seek to show up in the position
+    _SEEK_JUMP_THRESHOLD = 1.0 # seconds off the playback trajectory that count as a jump
+    _SEEK_MAX_STEPS = 50
+    _SEEK_COST_SMOOTHING = 0.3 # weight of the latest sample in the cost estimates
+    _KEY_SEEK_COST = 0.5 # initial estimate of one key seek in seconds
+
+    # Stopping, see `stop`.
+    _STOP_TIMEOUT = 2.0 # seconds for omxplayer to quit on its own
+    _TERMINATE_TIMEOUT = 0.5 # seconds for each of SIGTERM and SIGKILL to take
+
+    # Command acknowledgement, see `_expect`.
+    _ACK_TIMEOUT = 2.0 # seconds for a command's effect to show up in the output
+
     # Supported speeds.
     # OMXPlayer supports a small number of different speeds.
     SLOW_SPEED = -1
@@ -52,206 +630,860 @@ class OMXPlayer(object):
     FAST_SPEED = 1
     VFAST_SPEED = 2
 
-    def __init__(self, mediafile, args=None, start_playback=False, fullscreen=True):
+    # Media seconds played per second at each speed level.
+    _SPEED_RATES = {SLOW_SPEED: 0.5, NORMAL_SPEED: 1.0, FAST_SPEED: 2.0, VFAST_SPEED: 4.0}
+
+    # Position extrapolation, see `position`.
+    _POSITION_SAMPLES = 256 # status samples kept for `position_stats`
+    _EXTRAPOLATION_LIMIT = 1.0 # seconds to extrapolate past the last status line at most
+
+    # Events that can be subscribed to, see `subscribe`.
+    EVENTS = ('position', 'finished', 'headers')
+
+    # A metadata.MetadataCache that players store their parsed headers in.
+    metadata_cache = None
+
+    # A metrics.Metrics that players report to; None disables reporting.
+    metrics = None
+
+    # A keyframes.KeyframeCache; with one, restart seeks land on keyframes.
+    keyframe_cache = None
+
+    # A resolver.Resolver that page URLs are resolved to stream URLs with.
+    resolver = None
+
+    # A capture.CaptureDirectory that players keep a ring of their raw
+    # omxplayer output in, for diagnostics; None disables capturing.
+    output_capture = None
+
+    # The clock.Clock that positions are timed and waits are bounded with;
+    # tests swap in a clock.VirtualClock.
+    clock = Clock()
+
+    def __init__(self, mediafile, args=None, start_playback=False, fullscreen=True,
+                 startup_timeout=None):
         self.mediafile = mediafile
+        self.startup_timeout = startup_timeout or self._STARTUP_TIMEOUT
+        args = self._split_args(args, fullscreen)
+
+        self._args = args
+        self.last_seek = None
+        self.last_stop = None
+        self._keyframes = None # loaded on the first restart, False if unavailable
+        self._listeners = dict((event, []) for event in self.EVENTS)
+        self._output_condition = Condition()
+        self._position_serial = 0
+        self._generation = 0 # bumped whenever the omxplayer process is replaced
+        self._acks = [] # commands waiting for their effect, see `_expect`
+        self._ack_thread = None # enforces their deadlines, see `_watch_acks`
+        self.capture = None if self.output_capture is None else self.output_capture.open(mediafile)
+
+        with self._span('omxplayer.start', mediafile=mediafile):
+            try:
+                self._launch(args)
+            except Exception:
+                if self.capture is not None:
+                    self.capture.close()
+                raise
+
+            # Seek cost model, refined with every measured seek.
+            self._key_seek_cost = self._KEY_SEEK_COST
+            self._restart_cost = self.startup_time
+
+            if start_playback:
+                self.toggle_pause()
+            self.toggle_subtitles()
+
+    @staticmethod
+    def _split_args(args, fullscreen):
+        """
+        Returns omxplayer arguments, given as a list or a command line string,
+        as a list, with -r added for `fullscreen`.
+        """
         if not args:
-            args = ""
-        
+            args = []
+        elif isinstance(args, str):
+            args = shlex.split(args)
+        else:
+            args = list(args)
         if fullscreen:
-            args += " -r"
-            
-        cmd = self._LAUNCH_CMD % (args, mediafile)
-        
-        self._process = pexpect.spawn(cmd)
+            args.append("-r")
+        return args
+
+    def _launch(self, args):
+        """
+        Spawns omxplayer with `args`, parses its headers and starts the output reader.
+        """
+        # Resolved on every launch: stream URLs expire, see resolver.Resolver.
+        media = self.mediafile if self.resolver is None else self.resolver.resolve(self.mediafile)
+        argv = self._LAUNCH_ARGV + args + [media]
+
+        start = self.clock.monotonic()
+        if self.capture is not None and self.capture.closed:
+            # Restarted after it finished; the old capture was closed then.
+            self.capture = self.output_capture.open(self.mediafile)
+        if self.capture is not None:
+            self.capture.event("launching %s" % " ".join(argv))
+        self._process = self._PROCESS_CLASS(argv)
+        self._generation += 1
+        self._commands = CommandQueue(
+            self._write, self._COMMAND_TICK, self._OPPOSITE_CMDS,
+            self._observe_command_latency if self.metrics is not None else None,
+            self.clock)
 
         self._paused = False
         self._subtitles_visible = True
+        # Stream indexes; None where the args chose a stream, as which one is unknown.
+        self._audio_index = None if set(args) & set(self._AUDIO_INDEX_ARGS) else 0
+        self._subtitle_index = None if set(args) & set(self._SUBTITLE_INDEX_ARGS) else 0
         self._volume = 0 # dB
         self._speed = self.NORMAL_SPEED
-        self.position = 0.0
-        
-        self.video = dict()
-        self.audio = dict()
-
-        headers = b""
-        while b"Video" not in headers or b"Audio" not in headers:
-            headers += self._process.readline()
+        self._position_samples = PositionSamples(self._POSITION_SAMPLES)
+        self._last_sample = (self.clock.monotonic(), 0.0, 0.0)
+        self._last_status = None # (time, position) of the last status line
+        self._previous_status = None # and of the one before
+        self._echoed_volume = 0.0 # dB, as omxplayer last echoed it
 
-        # Get video properties
-        video_props = self._VIDEOPROP_REXP.search(headers).groups()
-        self.video['decoder'] = video_props[0]
-        self.video['dimensions'] = tuple(int(x) for x in video_props[1:3])
-        self.video['profile'] = int(video_props[3])
-        self.video['fps'] = float(video_props[4])
+        deadline = start + self.startup_timeout
+        parser = HeaderParser()
+        try:
+            while not parser.done:
+                remaining = deadline - self.clock.monotonic()
+                if remaining <= 0:
+                    raise StartupTimeoutError("omxplayer printed no headers within %ss"
+                                              % self.startup_timeout)
+                if not select.select([self._process.child_fd], [], [], remaining)[0]:
+                    continue
+                try:
+                    data = os.read(self._process.child_fd, self._READ_SIZE)
+                except OSError:
+                    data = b""
+                if not data:
+                    raise OMXPlayerError("omxplayer exited before printing its headers")
+                if self.capture is not None:
+                    self.capture.write(data)
+                parser.feed(data)
+        except Exception:
+            self._commands.close()
+            self._process.close(force=True)
+            raise
+        self.startup_time = self.clock.monotonic() - start
+        if self.metrics is not None:
+            self.metrics.observe('omxplayer_startup_seconds', self.startup_time)
 
-        # Get audio properties
-        audio_props = self._AUDIOPROP_REXP.search(headers).groups()
-        self.audio['decoder'] = audio_props[0]
-        (self.audio['channels'], self.audio['rate'],
-         self.audio['bps']) = [int(x) for x in audio_props[1:]]
-
-        # Get file properties
-        #file_props = self._FILEPROP_REXP.match(self._process.readline()).groups()
-        #(self.audio['streams'], self.video['streams'],
-        # self.chapters, self.subtitles) = [int(x) for x in file_props]
+        self.video = parser.video
+        self.audio = parser.audio
+        self.chapters = parser.chapters
+        self.subtitles = parser.subtitles
+        self.length = parser.length
 
         #if self.audio['streams'] > 0:
         #    self.current_audio_stream = 1
         #    self.current_volume = 0.0
 
         self.finished = False
-        self.position = 0
+        if self.metadata_cache is not None:
+            self.metadata_cache.store(self.mediafile, self.metadata())
+        self._emit('headers', self.video, self.audio)
 
-        self._position_thread = Thread(target=self._get_position)
+        self._position_thread = Thread(target=self._read_output,
+                                       args=(self._process, self._generation, parser.leftover))
+        self._position_thread.daemon = True
         self._position_thread.start()
 
-        if start_playback:
-            self.toggle_pause()
-        self.toggle_subtitles()
-        
-
-    def _get_position(self):
-        
-        while True:            
-            index = self._process.expect([
-                self._STATUS_REXP,
-                pexpect.TIMEOUT,
-                pexpect.EOF,
-                self._DONE_REXP
-            ])
-            
-            if index == 1: # on timeout, keep going
-                continue
-            elif index in (2, 3): # EOF or finished
-                self.finished = True
+    def metadata(self):
+        """
+        Returns the parsed headers as a dict of `video`, `audio`, `chapters`,
+        `subtitles` and `length`.
+        """
+        return dict(video=self.video, audio=self.audio, chapters=self.chapters,
+                    subtitles=self.subtitles, length=self.length)
+
+    def subscribe(self, event, callback):
+        """
+        Calls `callback` whenever `event` happens. Callbacks run on the output
+        reader thread, so they should return quickly.
+
+        - 'position': ``callback(position)`` for every status line.
+        - 'finished': ``callback()`` once omxplayer has exited.
+        - 'headers': ``callback(video, audio)`` after (re)starting omxplayer.
+        """
+        self._listeners[event].append(callback)
+
+    def unsubscribe(self, event, callback):
+        self._listeners[event].remove(callback)
+
+    def _emit(self, event, *args):
+        for callback in list(self._listeners[event]):
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("Error in %s callback %r" % (event, callback))
+
+    def _span(self, name, **attributes):
+        if self.metrics is None:
+            return _NO_SPAN
+        return self.metrics.span(name, **attributes)
+
+    def _observe_command_latency(self, latency):
+        self.metrics.observe('omxplayer_command_latency_seconds', latency)
+
+    @property
+    def position(self):
+        """
+        The media position in seconds, extrapolated from the last status line
+        with the monotonic clock, the current speed and the pause state.
+
+        Takes no lock, so it is cheap to poll at display rate.
+        """
+        t, position, rate = self._last_sample
+        if rate and not self.finished:
+            position += min(self.clock.monotonic() - t, self._EXTRAPOLATION_LIMIT) * rate
+        return position
+
+    def position_stats(self):
+        """
+        Returns statistics of the recent status lines, see `PositionSamples.stats`.
+        """
+        return self._position_samples.stats(self._SEEK_JUMP_THRESHOLD)
+
+    def _rebase_position(self):
+        """
+        Restarts extrapolation from the current position at the current
+        playback rate, after pausing or changing speed.
+        """
+        self._last_sample = (self.clock.monotonic(), self.position, self._playback_rate())
+
+    def wait_for_position(self, timeout=None):
+        """
+        Blocks until the next status line has been parsed and returns the
+        position, or None if omxplayer finished or `timeout` expired first.
+        """
+        with self._output_condition:
+            serial = self._position_serial
+            self.clock.wait_for(
+                self._output_condition, lambda: self._position_serial != serial or self.finished, timeout)
+            if self._position_serial == serial:
+                return None
+            return self._last_sample[1]
+
+    def wait_finished(self, timeout=None):
+        """
+        Blocks until omxplayer has exited. Returns whether it did within `timeout`.
+        """
+        with self._output_condition:
+            return self.clock.wait_for(self._output_condition, lambda: self.finished, timeout)
+
+    def _read_output(self, process, generation, pending=b""):
+        """
+        Reads `process`'s output as it arrives and handles it line by line.
+
+        Blocks on the pty only; exits once omxplayer closes it or once the
+        player has retired `generation` (see `_seek_restart`).
+        """
+        parser = StatusParser(self._READ_SIZE)
+        parser.feed(pending)
+        capture = self.capture
+        while generation == self._generation:
+            while True:
+                position = parser.next()
+                if position is None:
+                    break
+                if position is StatusParser.DONE:
+                    self._set_finished(generation)
+                    return
+                if position is StatusParser.VOLUME:
+                    self._handle_volume(parser.volume, generation)
+                    continue
+                self._handle_position(position, generation)
+            if self.finished:
+                return
+            try:
+                count = parser.read(process.child_fd)
+            except OSError:
+                break
+            if not count:
                 break
-            elif index == 0:
-                self.position = float(self._process.match.group(2).strip()) / 1000000
-        
-            sleep(0.1)
-            
-            # print "POS: %0.2f" % self.position
+            if capture is not None:
+                capture.write(parser.tail(count))
+        self._set_finished(generation)
+
+    def _handle_position(self, position, generation):
+        now = self.clock.monotonic()
+        rate = self._playback_rate()
+        if self.metrics is not None:
+            self.metrics.increment('omxplayer_status_lines_total')
+            if self._position_samples.count:
+                self.metrics.observe('omxplayer_position_staleness_seconds',
+                                     now - self._last_sample[0])
+        with self._output_condition:
+            if generation != self._generation:
+                return
+            self._previous_status = self._last_status
+            self._last_status = (now, position)
+            self._last_sample = (now, position, rate)
+            self._position_samples.add(now, position, rate)
+            self._position_serial += 1
+            if self._acks:
+                self._check_acks(now)
+            self.clock.notify(self._output_condition)
+        self._emit('position', position)
+
+    def _handle_volume(self, volume, generation):
+        with self._output_condition:
+            if generation != self._generation:
+                return
+            self._echoed_volume = volume
+            if self._acks:
+                self._check_acks(self.clock.monotonic())
+            if not any(ack['kind'] == 'volume' for ack in self._acks):
+                self._volume = volume
+            self.clock.notify(self._output_condition)
+
+    def _expect(self, kind, target):
+        """
+        Returns a Future of a command just queued, resolved with `target` once
+        omxplayer's output shows that its `kind` of state reached it:
+
+        - 'paused': the position stalls (True) or moves again (False) between
+          two status lines read after the command.
+        - 'speed': the position advances at the speed level's rate.
+        - 'volume': omxplayer echoes `target` dB.
+        - 'jump': the position leaves the playback trajectory from `target`,
+          a (position, rate) tuple, by more than `_SEEK_JUMP_THRESHOLD`; the
+          future resolves with the new position.
+
+        A command superseded by a later one of the same kind resolves with it.
+        After `_ACK_TIMEOUT` the future fails with CommandTimeoutError, and
+        the player's state is set to what the output shows instead; this
+        holds when omxplayer prints nothing at all. While paused, speed
+        changes are confirmed once playback resumes.
+
+        Futures resolve on the output reader thread, or on the thread
+        enforcing deadlines, so callbacks added to them should return quickly.
+        """
+        future = Future()
+        now = self.clock.monotonic()
+        with self._output_condition:
+            self._acks.append(dict(kind=kind, target=target, future=future,
+                                   since=now, deadline=now + self._ACK_TIMEOUT))
+            if self._ack_thread is None:
+                self._ack_thread = Thread(target=self._watch_acks)
+                self._ack_thread.daemon = True
+                self._ack_thread.start()
+            self.clock.notify(self._output_condition)
+        return future
+
+    def _watch_acks(self):
+        """
+        Fails the futures of commands past their deadline even while omxplayer
+        prints nothing, as when it stalls, until no command is pending.
+        """
+        with self._output_condition:
+            while self._acks:
+                now = self.clock.monotonic()
+                deadlines = [ack['deadline'] for ack in self._acks
+                             if not (ack['kind'] == 'speed' and self._paused)]
+                if deadlines and now >= min(deadlines):
+                    self._check_acks(now)
+                    continue
+                self.clock.wait(self._output_condition,
+                                min(deadlines) - now if deadlines else None)
+            self._ack_thread = None
+
+    def _settled(self, kind, value):
+        """
+        Returns the future of the latest pending `kind` command, or a resolved
+        one of `value` if none is pending.
+        """
+        with self._output_condition:
+            for ack in reversed(self._acks):
+                if ack['kind'] == kind:
+                    return ack['future']
+        return self._resolved(value)
+
+    @staticmethod
+    def _resolved(value):
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def _observed(self, ack):
+        """
+        Returns the state of `ack`'s kind that the output shows since it was
+        queued, or None if it shows none.
+        """
+        kind = ack['kind']
+        if kind == 'volume':
+            return self._echoed_volume
+        if self._last_status is None:
+            return None
+        t1, p1 = self._last_status
+        if kind == 'jump':
+            position, rate = ack['target']
+            expected = position + (t1 - ack['since']) * rate
+            if t1 >= ack['since'] and abs(p1 - expected) > self._SEEK_JUMP_THRESHOLD:
+                return ack['target']
+            return None
+        previous = self._previous_status
+        if previous is None or previous[0] < ack['since']:
+            return None
+        t0, p0 = previous
+        if kind == 'paused':
+            if p1 == p0:
+                return True
+            return False if p1 > p0 else None
+        if p1 > p0 and t1 > t0:
+            return int(round(math.log((p1 - p0) / (t1 - t0), 2)))
+        return None
+
+    def _check_acks(self, now):
+        """
+        Resolves the futures of the commands whose effect shows, and fails
+        those past their deadline, reconciling the state with the output.
+        Called by the output reader and by `_watch_acks` with
+        `_output_condition` held.
+        """
+        for ack in list(self._acks):
+            if ack not in self._acks:
+                continue # resolved as superseded
+            kind = ack['kind']
+            observed = self._observed(ack)
+            if observed is not None and observed == ack['target']:
+                result = self._last_status[1] if kind == 'jump' else observed
+                for earlier in [a for a in self._acks if a['kind'] == kind]:
+                    self._acks.remove(earlier)
+                    earlier['future'].set_result(result)
+                    if earlier is ack:
+                        break
+                self._reconcile(kind, observed)
+            elif now >= ack['deadline'] and not (kind == 'speed' and self._paused):
+                self._acks.remove(ack)
+                ack['future'].set_exception(CommandTimeoutError(
+                    "omxplayer did not show %s %r within %ss (it showed %r)"
+                    % (kind, ack['target'], self._ACK_TIMEOUT, observed)))
+                if observed is not None:
+                    self._reconcile(kind, observed)
+
+    def _reconcile(self, kind, observed):
+        """
+        Sets the state of `kind` to what the output showed, unless a later
+        command of that kind is still pending.
+        """
+        if kind == 'jump' or any(ack['kind'] == kind for ack in self._acks):
+            return
+        if kind == 'volume':
+            self._volume = observed
+            return
+        if kind == 'paused':
+            self._paused = observed
+        else:
+            self._speed = observed
+        t, position = self._last_status
+        self._last_sample = (t, position, self._playback_rate())
+
+    def _set_finished(self, generation):
+        with self._output_condition:
+            if self.finished or generation != self._generation:
+                return
+            self.finished = True
+            acks, self._acks = self._acks, []
+            for ack in acks:
+                ack['future'].set_exception(OMXPlayerError(
+                    "omxplayer finished before showing %s %r" % (ack['kind'], ack['target'])))
+            self.clock.notify(self._output_condition)
+        if self.capture is not None:
+            self.capture.event("omxplayer finished")
+            self.capture.close()
+        self._emit('finished')
 
     def pause(self):
+        """
+        Pauses playback. Returns a Future of the paused state, see `toggle_pause`.
+        """
         if not self._paused:
-            self.toggle_pause()
+            return self.toggle_pause()
+        return self._settled('paused', True)
 
     def play(self):
+        """
+        Resumes playback. Returns a Future of the paused state, see `toggle_pause`.
+        """
         if self._paused:
-            self.toggle_pause()
+            return self.toggle_pause()
+        return self._settled('paused', False)
 
     def toggle_pause(self):
-        if self._process.send(self._PAUSE_CMD):
-            self._paused = not self._paused
+        """
+        Toggles pause. Returns a Future that resolves to whether playback is
+        paused once the status lines show it, see `_expect`.
+        """
+        self._send(self._PAUSE_CMD)
+        self._paused = not self._paused
+        self._rebase_position()
+        return self._expect('paused', self._paused)
 
     def toggle_subtitles(self):
-        if self._process.send(self._TOGGLE_SUB_CMD):
-            self._subtitles_visible = not self._subtitles_visible
+        """
+        Toggles subtitles. omxplayer prints nothing to confirm it, so the
+        returned Future is resolved with the new visibility at once.
+        """
+        self._send(self._TOGGLE_SUB_CMD)
+        self._subtitles_visible = not self._subtitles_visible
+        return self._resolved(self._subtitles_visible)
 
-    def stop(self):
-        self._process.send(self._QUIT_CMD)
-        self._process.terminate(force=True)
+    def stop(self, timeout=None):
+        """
+        Asks omxplayer to quit and waits up to `timeout` seconds
+        (`_STOP_TIMEOUT` by default) for it to say "have a nice day" and
+        exit. If it does not, it is sent SIGTERM and then SIGKILL, each given
+        `_TERMINATE_TIMEOUT`. Either way the child is reaped, the output
+        reader joined and the pty closed. Stopping a stopped player does
+        nothing.
+
+        Returns, and stores in `last_stop`, a dict with the teardown
+        `latency` in seconds, whether omxplayer exited `clean`ly and the
+        last `signal` it had to be sent (None if none).
+        """
+        process = self._process
+        if process.closed:
+            return self.last_stop
+        if timeout is None:
+            timeout = self._STOP_TIMEOUT
+        with self._span('omxplayer.stop', mediafile=self.mediafile):
+            start = self.clock.monotonic()
+            deadline = start + timeout
+            self._send(self._QUIT_CMD, flush=True)
+            self._commands.close()
+            # The reader returns once it has read the goodbye line, or the end
+            # of the output; it may itself be stopping the player.
+            reader = self._position_thread
+            if reader is current_thread():
+                reader = None
+            if reader is not None:
+                reader.join(timeout)
+            clean = process.wait(max(deadline - self.clock.monotonic(), 0))
+            sent = None
+            if not clean:
+                logger.warning("omxplayer did not quit within %ss, terminating it" % timeout)
+                for sig in (signal.SIGTERM, signal.SIGKILL):
+                    process.kill(sig)
+                    sent = sig
+                    if process.wait(self._TERMINATE_TIMEOUT):
+                        break
+            if reader is not None:
+                reader.join(self._TERMINATE_TIMEOUT)
+            process.close(force=True)
+            self.last_stop = dict(latency=self.clock.monotonic() - start, clean=clean,
+                                  signal=sent)
+            if self.metrics is not None:
+                self.metrics.observe('omxplayer_stop_seconds', self.last_stop['latency'])
+            return self.last_stop
+
+    def _send(self, cmd, count=1, flush=False):
+        """
+        Queues `cmd` to be written to omxplayer, see CommandQueue. Whether it
+        took effect shows in the output only, see `_expect`.
+        """
+        self._commands.push(cmd, count)
+        if flush:
+            self._commands.flush()
+
+    def _write(self, data):
+        self._process.send(data)
 
     def decrease_speed(self):
         """
-        Decrease speed by one unit.
+        Decrease speed by one unit. Returns a Future of the speed level.
         """
-        self._process.send(self._DECREASE_SPEED_CMD)
+        self._speed -= 1
+        self._send(self._DECREASE_SPEED_CMD)
+        self._rebase_position()
+        return self._expect('speed', self._speed)
 
     def increase_speed(self):
         """
-        Increase speed by one unit.
+        Increase speed by one unit. Returns a Future of the speed level.
         """
-        self._process.send(self._INCREASE_SPEED_CMD)
+        self._speed += 1
+        self._send(self._INCREASE_SPEED_CMD)
+        self._rebase_position()
+        return self._expect('speed', self._speed)
 
     def set_speed(self, speed):
         """
         Set speed to one of the supported speed levels.
 
-        OMXPlayer does not support granular speed changes.
+        OMXPlayer does not support granular speed changes. Returns a Future
+        that resolves to the speed level once the positions advance at its
+        rate, see `_expect`.
         """
         logger.info("Setting speed = %s" % speed)
 
         assert speed in (self.SLOW_SPEED, self.NORMAL_SPEED, self.FAST_SPEED, self.VFAST_SPEED)
 
         changes = speed - self._speed
+        if changes == 0:
+            return self._settled('speed', speed)
         if changes > 0:
-            for i in range(1,changes):
-                self.increase_speed()
+            self._send(self._INCREASE_SPEED_CMD, changes)
         else:
-            for i in range(1,-changes):
-                self.decrease_speed()
+            self._send(self._DECREASE_SPEED_CMD, -changes)
         self._speed = speed
+        self._rebase_position()
+        return self._expect('speed', speed)
 
     def set_audiochannel(self, channel_idx):
-        raise NotImplementedError
+        """
+        Switches to audio stream `channel_idx`, counting from 0, with
+        omxplayer's previous and next stream keys, which takes milliseconds
+        where a restart takes seconds. Returns a Future of the index, resolved
+        at once as omxplayer prints nothing to confirm it.
+        """
+        logger.info("Setting audio stream = %s" % channel_idx)
+        self._press_towards(self._audio_index, channel_idx, self.audio['streams'],
+                            self._PREVIOUS_AUDIO_CMD, self._NEXT_AUDIO_CMD)
+        self._audio_index = channel_idx
+        return self._resolved(channel_idx)
 
     def set_subtitles(self, sub_idx):
-        raise NotImplementedError
+        """
+        Switches to subtitle stream `sub_idx`, counting from 0, like
+        `set_audiochannel`. Whether subtitles show is up to `toggle_subtitles`.
+        """
+        logger.info("Setting subtitle stream = %s" % sub_idx)
+        self._press_towards(self._subtitle_index, sub_idx, self.subtitles,
+                            self._PREVIOUS_SUBTITLES_CMD, self._NEXT_SUBTITLES_CMD)
+        self._subtitle_index = sub_idx
+        return self._resolved(sub_idx)
 
     def set_chapter(self, chapter_idx):
-        raise NotImplementedError
+        """
+        Seeks to the start of chapter `chapter_idx`, counting from 0, with
+        omxplayer's previous and next chapter keys. Playback moves from
+        chapter to chapter, so the keys go to the first or the last chapter
+        first, whichever is nearer, see `_calculate_stream_keys`. Returns a
+        Future of the index, resolved at once.
+        """
+        logger.info("Setting chapter = %s" % chapter_idx)
+        self._press_towards(None, chapter_idx, self.chapters,
+                            self._PREVIOUS_CHAPTER_CMD, self._NEXT_CHAPTER_CMD)
+        return self._resolved(chapter_idx)
+
+    def _press_towards(self, current, target, count, previous_cmd, next_cmd):
+        assert 0 <= target < (count or 0), "no stream or chapter %s of %s" % (target, count)
+        for step, presses in self._calculate_stream_keys(current, target, count):
+            self._send(next_cmd if step > 0 else previous_cmd, presses)
 
     def set_volume(self, volume):
         """
-        Set volume to `volume` dB.
+        Set volume to `volume` dB, rounded to a multiple of `_VOLUME_INCREMENT`.
+        Returns a Future that resolves to the volume once omxplayer echoes
+        it, see `_expect`.
         """
         logger.info("Setting volume = %s" % volume)
 
-        volume_change_db = volume - self._volume
-        if volume_change_db != 0:
-            changes = int( round( volume_change_db / self._VOLUME_INCREMENT ) )
-            if changes > 0:
-                for i in range(1,changes):
-                    self.increase_volume()
+        changes = int( round( (volume - self._volume) / self._VOLUME_INCREMENT ) )
+        if changes == 0:
+            return self._settled('volume', self._volume)
+        if changes > 0:
+            self._send(self._INCREASE_VOLUME_CMD, changes)
+        else:
+            self._send(self._DECREASE_VOLUME_CMD, -changes)
+        self._volume += changes * self._VOLUME_INCREMENT
+        return self._expect('volume', self._volume)
+
+    def seek(self, offset, tolerance=None, method=None):
+        """
+        Seek to `offset` seconds into the media.
+
+        OMXPlayer only seeks in steps of 30 and 600 seconds, so by default this
+        lands within 15 seconds of `offset`. The steps are sent one at a time,
+        each waiting for the position to actually jump, and the remaining
+        steps are recomputed from where playback really is.
+
+        When the cost model predicts that restarting omxplayer at `offset`
+        (using -l) is faster, or when the steps cannot get within `tolerance`
+        seconds, the player is restarted instead. So it is when the key seeks
+        give up without getting there. `method` forces 'keys' or 'restart'.
+
+        omxplayer restarts at the keyframe before -l. With a `keyframe_cache`,
+        restarts ask for the keyframe nearest `offset` instead, so they land
+        where `expected`.
+
+        Returns, and stores in `last_seek`, a dict with the `method` used
+        ('keys', 'restart' or 'none'), the measured `latency`, the final
+        `error` in seconds and the `expected` landing position of a restart
+        (None if unknown).
+        """
+        with self._span('omxplayer.seek', mediafile=self.mediafile, offset=offset):
+            logger.info("Seeking to target offset = %s" % offset)
+            start = self.clock.monotonic()
+            large_seeks, small_seeks = self._calculate_num_seeks(self.position, offset)
+            steps = abs(large_seeks) + abs(small_seeks)
+            residual = abs(self.position + large_seeks*600 + small_seeks*30 - offset)
+
+            if method is None:
+                if steps == 0 and (tolerance is None or residual <= tolerance):
+                    method = 'none'
+                elif ((tolerance is not None and residual > tolerance) or
+                      steps * self._key_seek_cost > self._restart_cost):
+                    method = 'restart'
+                else:
+                    method = 'keys'
+            assert method in ('none', 'keys', 'restart')
+
+            if method == 'keys':
+                steps, arrived = self._seek_keys(offset)
+                if not arrived:
+                    logger.info("Key seeks gave up, restarting at %s instead" % offset)
+                    method = 'restart'
+            expected = None
+            if method == 'restart':
+                steps = 0
+                keyframes = self._keyframe_index()
+                if keyframes is not None:
+                    expected = keyframes.nearest(offset)
+                restart_start = self.clock.monotonic()
+                self._seek_restart(offset if expected is None else expected)
+                self._restart_cost = self._update_cost(self._restart_cost,
+                                                       self.clock.monotonic() - restart_start)
+
+            self.last_seek = dict(method=method, steps=steps,
+                                  latency=self.clock.monotonic() - start,
+                                  error=self.position - offset, expected=expected)
+            logger.info("Seek to %s: %s" % (offset, self.last_seek))
+            if self.metrics is not None:
+                self.metrics.observe('omxplayer_seek_seconds', self.last_seek['latency'],
+                                     method=method)
+                self.metrics.observe('omxplayer_seek_error_seconds', abs(self.last_seek['error']))
+            return self.last_seek
+
+    def _keyframe_index(self):
+        """
+        Returns the keyframes.KeyframeIndex of the mediafile, or None if there
+        is no `keyframe_cache` or the file cannot be indexed.
+        """
+        if self.keyframe_cache is None:
+            return None
+        if self._keyframes is None:
+            self._keyframes = self.keyframe_cache.get(self.mediafile) or False
+        return self._keyframes or None
+
+    def _seek_keys(self, offset):
+        """
+        Steps towards `offset` with 600 and 30 second key seeks until no step
+        gets closer. Returns the number of steps taken and whether it got
+        there, rather than giving up.
+        """
+        steps = 0
+        while True:
+            large_seeks, small_seeks = self._calculate_num_seeks(self.position, offset)
+            if large_seeks:
+                step = 600 if large_seeks > 0 else -600
+            elif small_seeks:
+                step = 30 if small_seeks > 0 else -30
             else:
-                for i in range(1,-changes):
-                    self.decrease_volume()
-                    
-        self._volume = volume
+                return steps, True
+            if steps >= self._SEEK_MAX_STEPS:
+                logger.warning("Giving up seeking to %s after %s steps" % (offset, steps))
+                return steps, False
+
+            step_start = self.clock.monotonic()
+            if not self._seek_step(step):
+                logger.warning("No position feedback after a %ss seek, giving up" % step)
+                return steps, False
+            steps += 1
+            self._key_seek_cost = self._update_cost(self._key_seek_cost,
+                                                    self.clock.monotonic() - step_start)
+
+    def _seek_step(self, step):
+        """
+        Sends a single `step` second seek and waits until the position jumps.
+        Returns False if it did not within `_SEEK_STEP_TIMEOUT`.
+        """
+        future = {30: self.seek_forward_30, -30: self.seek_backward_30,
+                  600: self.seek_forward_600, -600: self.seek_backward_600}[step]()
+        with self._output_condition:
+            self.clock.wait_for(self._output_condition, lambda: future.done() or self.finished,
+                                self._SEEK_STEP_TIMEOUT)
+        return future.done() and future.exception() is None
+
+    def _playback_rate(self):
+        """
+        Returns the media seconds played per second right now.
+        """
+        if self._paused:
+            return 0.0
+        return self._SPEED_RATES.get(self._speed, 2.0 ** self._speed)
 
-    def seek(self, offset):
+    def _seek_restart(self, offset):
         """
         mountainpenguin's hack:
         stop player, and restart at a specific point using the -l flag (position)
+
+        Pause, stream, subtitle, volume and speed state carry over to the new
+        process.
         """
+        paused = self._paused
+        subtitles_visible = self._subtitles_visible
+        audio_index = self._audio_index
+        subtitle_index = self._subtitle_index
+        volume = self._volume
+        speed = self._speed
+        # Retire the old process first so its exit is not reported as finished.
+        with self._output_condition:
+            self._generation += 1
+        if self.metrics is not None:
+            self.metrics.increment('omxplayer_restarts_total')
         logger.info("Stopping omxplayer")
         self.stop()
         logger.info("Restarting at offset %s" % offset)
-        self.__init__(mediafile=self.mediafile, args="-l %s" % offset)
-        return
+        try:
+            self._launch(self._args + ["-l", str(offset)])
+        except Exception:
+            # No process is left to report the end, so waiters would hang.
+            self._set_finished(self._generation)
+            raise
+        self.wait_for_position(self._SEEK_STEP_TIMEOUT)
+        if paused:
+            self.toggle_pause()
+        if subtitles_visible != self._subtitles_visible:
+            self.toggle_subtitles()
+        if audio_index not in (None, self._audio_index):
+            self.set_audiochannel(audio_index)
+        if subtitle_index not in (None, self._subtitle_index):
+            self.set_subtitles(subtitle_index)
+        if volume != self._volume:
+            self.set_volume(volume)
+        if speed != self._speed:
+            self.set_speed(speed)
 
-        """
-        Seek to offset seconds into the video.
+    @classmethod
+    def _update_cost(cls, cost, sample):
+        return cost + cls._SEEK_COST_SMOOTHING * (sample - cost)
 
-        Greater granulity OMXPlayer provides is 30 seconds so will seek to nearest.
+    @classmethod
+    def _calculate_stream_keys(cls, current, target, count):
+        """
+        Returns the shortest list of (step, presses) that moves from stream
+        or chapter `current` to `target`, out of `count`; step 1 is the next
+        key and -1 the previous one.
 
-        Basic implementation, does not check duration when seeking forward.
+        omxplayer stops at the first and the last instead of wrapping
+        around, so from an unknown `current` (None) the keys first go to the
+        end nearer to `target`, pressing past the others.
         """
-        logger.info("Seeking to target offset = %s" % offset)
-        curr_offset = self.position / 1000 / 1000
-        large_seeks, small_seeks = self._calculate_num_seeks(curr_offset, offset)
-        logger.info("Seeking to actual offset = %s" % str(curr_offset + large_seeks*600 + small_seeks*30))
-        sleep_time = 0.7
-        if large_seeks != 0:
-            if large_seeks > 0:
-                for i in range(large_seeks):
-                    self.seek_forward_600()
-                    sleep(sleep_time)
-            else:
-                for i in range(-large_seeks):
-                    self.seek_backward_600()
-                    sleep(sleep_time)
-        if small_seeks != 0:
-            if small_seeks > 0:
-                for i in range(small_seeks):
-                    self.seek_forward_30()
-                    sleep(sleep_time)
-            else:
-                for i in range(-small_seeks):
-                    self.seek_backward_30()
-                    sleep(sleep_time)
-    
+        if current is not None:
+            change = target - current
+            return [(1 if change > 0 else -1, abs(change))] if change else []
+        last = count - 1
+        if target <= last - target:
+            keys = [(-1, last), (1, target)]
+        else:
+            keys = [(1, last), (-1, last - target)]
+        return [(step, presses) for step, presses in keys if presses]
+
     @classmethod
     def _calculate_num_seeks(cls, curr_offset, target_offset):
         """
@@ -269,53 +1501,59 @@ class OMXPlayer(object):
         # n = argmin | curr_offset + i*30 - target_offset |
         #        i
         #
-        # For some i,
+        #   = round( (target_offset - curr_offset) / 30 )
         #
-        # curr_offset + i*30 <= target_offset <= curr_offset + (i+1)*30
-        # i*30 <= target_offset - curr_offset <= (i+1)*30
-        # i <= (offset - curr_offset) / 30 <= (i+1)
-        # i = floor( (offset - curr_offset) / 30 )
-
-        diff = target_offset - curr_offset
-        large_seeks = int(math.floor(diff / 600.0))
-        diff -= large_seeks*600
-        small_seeks = int(math.floor(diff / 30.0))
+        # Every 20 of those 30s seeks can be replaced by one 600s seek, which
+        # is worth it as soon as more than 10 of them would be needed.
+
+        n = int(round((target_offset - curr_offset) / 30.0))
+        large_seeks = int(round(n / 20.0))
+        small_seeks = n - large_seeks*20
         return large_seeks, small_seeks
 
     def seek_forward_30(self):
         """
-        Seeks forward by 30 seconds.
+        Seeks forward by 30 seconds. Returns a Future of the position it lands at.
         """
-        self._process.send(self._SEEK_FORWARD_30_CMD)
+        return self._seek_key(self._SEEK_FORWARD_30_CMD)
 
     def seek_forward_600(self):
         """
-        Seeks forward by 600 seconds.
+        Seeks forward by 600 seconds. Returns a Future of the position it lands at.
         """
-        self._process.send(self._SEEK_FORWARD_600_CMD)
+        return self._seek_key(self._SEEK_FORWARD_600_CMD)
 
     def seek_backward_30(self):
         """
-        Seeks backward by 30 seconds.
+        Seeks backward by 30 seconds. Returns a Future of the position it lands at.
         """
-        self._process.send(self._SEEK_BACKWARD_30_CMD)
+        return self._seek_key(self._SEEK_BACKWARD_30_CMD)
 
     def seek_backward_600(self):
         """
-        Seeks backward by 600 seconds.
+        Seeks backward by 600 seconds. Returns a Future of the position it lands at.
         """
-        self._process.send(self._SEEK_BACKWARD_600_CMD)
+        return self._seek_key(self._SEEK_BACKWARD_600_CMD)
+
+    def _seek_key(self, cmd):
+        future = self._expect('jump', (self.position, self._playback_rate()))
+        self._send(cmd, flush=True)
+        return future
 
     def decrease_volume(self):
         """
-        Decrease volume by one unit. See `_VOLUME_INCREMENT`.
+        Decrease volume by one unit. See `_VOLUME_INCREMENT`. Returns a Future
+        of the volume.
         """
         self._volume -= self._VOLUME_INCREMENT
-        self._process.send(self._DECREASE_VOLUME_CMD)
+        self._send(self._DECREASE_VOLUME_CMD)
+        return self._expect('volume', self._volume)
 
     def increase_volume(self):
         """
-        Increase volume by one unit. See `_VOLUME_INCREMENT`.
+        Increase volume by one unit. See `_VOLUME_INCREMENT`. Returns a Future
+        of the volume.
         """
         self._volume += self._VOLUME_INCREMENT
-        self._process.send(self._INCREASE_VOLUME_CMD)
+        self._send(self._INCREASE_VOLUME_CMD)
+        return self._expect('volume', self._volume)
@@ -0,0 +1,222 @@
+"""
+Resolving page URLs to stream URLs.
+
+omxplayer plays stream URLs, not the pages of video sites. A Resolver runs an
+external resolver command such as youtube-dl to find the stream URL of a
+page, and caches the answer in memory and on disk until it expires, so
+playing the same page again, or restarting a player to seek, does not run
+the command again. Concurrent requests for the same page share one run, and
+`prefetch` resolves upcoming pages in the background::
+
+    resolver = Resolver()
+    OMXPlayer.resolver = resolver # players resolve non-file media themselves
+    resolver.prefetch(['https://www.youtube.com/watch?v=YE7VzlLtp-4'])
+    ...
+    player = OMXPlayer('https://www.youtube.com/watch?v=YE7VzlLtp-4')
+"""
+
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+from .pyomxplayer import OMXPlayerError
+
+logger = logging.getLogger(__name__)
+
+_RESOLVER_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "pyomxplayer",
+                               "resolved.json")
+
+
+class ResolverError(OMXPlayerError):
+    """
+    A resolver command failed to resolve a URL.
+    """
+
+
+class ResolverCommand(object):
+    """
+    An external command that prints the stream URL of a page URL.
+
+    `argv` may contain ``{url}`` and ``{format}``, which are replaced by the
+    page URL and the requested format. The command is used for the URLs that
+    `pattern` matches; the first line it prints is the stream URL.
+    """
+
+    _TIMEOUT = 30.0 # seconds allowed for the command to resolve a URL
+
+    def __init__(self, argv, pattern=r"^https?://", timeout=_TIMEOUT):
+        self.argv = list(argv)
+        self.pattern = re.compile(pattern)
+        self.timeout = timeout
+
+    def __repr__(self):
+        return "<ResolverCommand %r>" % (self.argv,)
+
+    def matches(self, url):
+        return self.pattern.search(url) is not None
+
+    def resolve(self, url, format):
+        argv = [arg.format(url=url, format=format) for arg in self.argv]
+        try:
+            result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    timeout=self.timeout)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ResolverError("Could not run %s: %s" % (argv[0], e))
+        lines = [line.strip() for line in result.stdout.decode(errors="replace").splitlines()
+                 if line.strip()]
+        if result.returncode != 0 or not lines:
+            raise ResolverError("%s could not resolve %s: %s"
+                                % (argv[0], url, result.stderr.decode(errors="replace").strip()))
+        return lines[0]
+
+
+YOUTUBE_DL = ResolverCommand(
+    ["youtube-dl", "--get-url", "--format", "{format}", "{url}"],
+    pattern=r"^https?://(www\.|m\.)?(youtube\.com|youtu\.be)/")
+
+
+class Resolver(object):
+    """
+    Resolves URLs with the first of `commands` whose pattern matches them.
+    URLs that no command matches, and local files, are played as they are.
+
+    Stream URLs are cached for `ttl` seconds, in memory and in the JSON file
+    at `cache_path` (None keeps them in memory only). `prefetch` resolves on
+    up to `workers` threads.
+    """
+
+    _TTL = 3600.0 # seconds stream URLs are reused for; video sites expire them
+
+    def __init__(self, commands=(YOUTUBE_DL,), ttl=_TTL, cache_path=_RESOLVER_CACHE,
+                 workers=4, format="best"):
+        self.commands = list(commands)
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.format = format
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0 # requests that waited for a resolution already running
+        self._lock = Lock()
+        self._cache = self._read_cache() # "format url" -> [stream URL, expiry time]
+        self._running = {} # "format url" -> Future
+        self._workers = workers
+        self._executor = None
+
+    def command_for(self, url):
+        """
+        Returns the ResolverCommand for `url`, or None if it is played as it is.
+        """
+        if os.path.exists(url):
+            return None
+        for command in self.commands:
+            if command.matches(url):
+                return command
+        return None
+
+    def resolve(self, url, format=None):
+        """
+        Returns the stream URL for `url`. Raises ResolverError if the
+        resolver command fails.
+        """
+        command = self.command_for(url)
+        if command is None:
+            return url
+        key = "%s %s" % (format or self.format, url)
+        owner = False
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[1] > time.time():
+                self.hits += 1
+                return cached[0]
+            future = self._running.get(key)
+            if future is not None:
+                self.shared += 1
+            else:
+                self.misses += 1
+                future = self._running[key] = Future()
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            stream = command.resolve(url, format or self.format)
+        except BaseException as e:
+            with self._lock:
+                del self._running[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._cache[key] = [stream, time.time() + self.ttl]
+            del self._running[key]
+            self._write_cache()
+        future.set_result(stream)
+        logger.info("Resolved %s to %s" % (url, stream))
+        return stream
+
+    def prefetch(self, urls, format=None):
+        """
+        Starts resolving `urls` in the background. Returns a list of futures
+        of their stream URLs.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers,
+                                                thread_name_prefix="Resolver")
+        return [self._executor.submit(self._prefetch_one, url, format) for url in urls]
+
+    def _prefetch_one(self, url, format):
+        try:
+            return self.resolve(url, format)
+        except ResolverError as e:
+            logger.warning("Could not prefetch %s: %s" % (url, e))
+            raise
+
+    def invalidate(self, url=None, format=None):
+        """
+        Forgets the stream URL of `url`, or of every URL.
+        """
+        with self._lock:
+            if url is None:
+                self._cache.clear()
+            else:
+                self._cache.pop("%s %s" % (format or self.format, url), None)
+            self._write_cache()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, shared=self.shared,
+                        entries=len(self._cache))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _read_cache(self):
+        if self.cache_path is None:
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return dict((key, value) for key, value in cache.items() if value[1] > now)
+
+    def _write_cache(self):
+        if self.cache_path is None:
+            return
+        now = time.time()
+        cache = dict((key, value) for key, value in self._cache.items() if value[1] > now)
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path + ".tmp", "w") as f:
+                json.dump(cache, f)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
+        except OSError as e:
+            logger.warning("Could not write %s: %s" % (self.cache_path, e))
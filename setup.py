@@ -3,5 +3,5 @@ import distutils.core
 distutils.core.setup(
     name="pyomxplayer",
     packages = ["."],
-    requires = ['pexpect (>= 2.4)'],
+    # pexpect (>= 2.4) is only needed for transport.PexpectProcess.
     )
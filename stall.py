@@ -0,0 +1,194 @@
+"""
+Stall recovery.
+
+On a bad network stream omxplayer can freeze: it stops printing status
+lines, or keeps printing the same position, but never exits, so the player
+never finishes and the screen stays frozen. A StallWatchdog notices when the
+position of a playing player stops moving, kills omxplayer and restarts it
+at the last position that played, with -l::
+
+    player = OMXPlayer('http://example.com/live.mp4')
+    watchdog = StallWatchdog(player, timeout=2.0)
+    watchdog.start()
+    ...
+    print(watchdog.stats())
+    watchdog.stop()
+"""
+
+import logging
+import signal
+import time
+
+from collections import deque
+from threading import Condition, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class StallWatchdog(object):
+    """
+    Restarts `player` at its last good position whenever it has been playing
+    for `timeout` seconds without the position moving.
+
+    The first restart of a series happens at once; each further restart
+    before playback has kept going for `timeout` seconds waits `backoff`
+    seconds, multiplied by `backoff_factor` every time up to `max_backoff`.
+    A restart that raises counts as one too. After `max_recoveries` restarts
+    in a row the watchdog gives up, kills omxplayer and marks the player
+    finished, so it does not hang.
+    """
+
+    _TIMEOUT = 2.0 # seconds without progress while playing that count as a stall
+    _BACKOFF = 0.5 # seconds before the second restart in a row
+    _BACKOFF_FACTOR = 2.0
+    _MAX_BACKOFF = 10.0
+    _PROGRESS_EPSILON = 0.001 # seconds of media a position must move to count as progress
+    _RECOVERY_SAMPLES = 100 # recoveries kept for `stats`
+
+    def __init__(self, player, timeout=_TIMEOUT, backoff=_BACKOFF,
+                 backoff_factor=_BACKOFF_FACTOR, max_backoff=_MAX_BACKOFF,
+                 max_recoveries=None):
+        self.player = player
+        self.timeout = timeout
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.max_recoveries = max_recoveries
+
+        self.recoveries = 0
+        self.failures = 0 # restarts that raised
+        self.gave_up = False
+        self._recent = deque(maxlen=self._RECOVERY_SAMPLES) # dicts, see `_recover`
+        self._consecutive = 0 # restarts since playback last kept going
+        self._condition = Condition()
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="StallWatchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops watching; does not stop the player.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        """
+        Returns the number of `recoveries` and of restarts that raised
+        (`failures`), whether the watchdog `gave_up`,
+        and the mean and max `recovery` time, from noticing a stall until
+        the new process printed a status line, and `downtime`, from the last
+        progress until then, in seconds.
+        """
+        with self._condition:
+            recent = list(self._recent)
+            stats = dict(recoveries=self.recoveries, failures=self.failures,
+                         gave_up=self.gave_up,
+                         consecutive=self._consecutive)
+        for name in ('recovery', 'downtime'):
+            values = [r[name] for r in recent]
+            stats[name] = dict(mean=sum(values) / len(values), max=max(values)) if values else None
+        stats['last'] = recent[-1] if recent else None
+        return stats
+
+    def _wait(self, timeout):
+        """
+        Sleeps for `timeout` seconds. Returns False if stopped meanwhile.
+        """
+        with self._condition:
+            return not self._condition.wait_for(lambda: self._closed, timeout)
+
+    def _run(self):
+        player = self.player
+        poll = self.timeout / 4
+        last_good = player._last_sample[1]
+        last_progress = time.monotonic()
+        resumed = None
+        while not self._closed and not player.finished:
+            player.wait_for_position(poll)
+            now = time.monotonic()
+            position = player._last_sample[1]
+            if abs(position - last_good) > self._PROGRESS_EPSILON:
+                last_good = position
+                last_progress = now
+                if resumed is not None and now - resumed >= self.timeout:
+                    # Playback kept going; the next stall starts a new series.
+                    self._consecutive = 0
+                    resumed = None
+                continue
+            if not player._playback_rate():
+                # Paused positions do not move.
+                last_progress = now
+                continue
+            if now - last_progress < self.timeout or self._closed:
+                continue
+            if not self._recover(last_good, last_progress, now):
+                return
+            resumed = last_progress = time.monotonic()
+            last_good = player._last_sample[1]
+
+    def _recover(self, position, last_progress, detected):
+        """
+        Kills the stalled omxplayer and restarts it at `position`, trying
+        again with backoff if the restart fails. Returns False if the
+        watchdog gave up or was stopped instead.
+        """
+        player = self.player
+        while True:
+            if self.max_recoveries is not None and self._consecutive >= self.max_recoveries:
+                logger.error("%s stalled %s times in a row, giving up"
+                             % (player.mediafile, self._consecutive))
+                self.gave_up = True
+                self._kill()
+                # Finish the player even when no process is left to exit.
+                player._set_finished(player._generation)
+                return False
+            if self._consecutive:
+                delay = min(self.backoff * self.backoff_factor ** (self._consecutive - 1),
+                            self.max_backoff)
+                logger.info("Waiting %ss before restarting %s again" % (delay, player.mediafile))
+                if not self._wait(delay):
+                    return False
+
+            logger.warning("%s stalled at %s, restarting" % (player.mediafile, position))
+            # A stalled omxplayer may not react to 'q' or SIGTERM. Retire it first,
+            # as _seek_restart does, so its exit is not reported as finished.
+            with player._output_condition:
+                player._generation += 1
+            self._kill()
+            try:
+                player.seek(position, method='restart')
+            except Exception as e:
+                logger.error("Could not restart %s: %s" % (player.mediafile, e))
+                with self._condition:
+                    self.failures += 1
+                    self._consecutive += 1
+                if player.metrics is not None:
+                    player.metrics.increment('omxplayer_stall_recovery_failures_total')
+                continue
+            break
+        resumed = time.monotonic()
+        recovery = dict(position=position, recovery=resumed - detected,
+                        downtime=resumed - last_progress)
+        with self._condition:
+            self.recoveries += 1
+            self._consecutive += 1
+            self._recent.append(recovery)
+        logger.info("%s resumed: %s" % (player.mediafile, recovery))
+        if player.metrics is not None:
+            player.metrics.increment('omxplayer_stall_recoveries_total')
+            player.metrics.observe('omxplayer_stall_recovery_seconds', recovery['recovery'])
+        return True
+
+    def _kill(self):
+        process = self.player._process
+        # After a failed restart the process is gone already, and its pid may be reused.
+        if process.isalive():
+            process.kill(signal.SIGKILL)
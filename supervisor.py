@@ -0,0 +1,364 @@
+"""
+Single-threaded supervisor for many omxplayer processes.
+
+Where every OMXPlayer runs its own reader thread, an OMXSupervisor owns any
+number of player processes and multiplexes all of their ptys through one
+`selectors` loop, which parses output, dispatches commands and tracks the
+lifecycle of every player::
+
+    supervisor = OMXSupervisor()
+    zone1 = supervisor.spawn('/media/zone1.mp3')
+    zone2 = supervisor.spawn('/media/zone2.mp3')
+    zone1.wait_ready()
+    zone1.set_volume(-6)
+    ...
+    supervisor.close()
+"""
+
+import errno
+import logging
+import os
+import selectors
+import signal
+import time
+
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from .pyomxplayer import HeaderParser, OMXPlayer, OMXPlayerError, StatusParser
+
+logger = logging.getLogger(__name__)
+
+
+class SupervisedPlayer(object):
+    """
+    Handle for one omxplayer process owned by an OMXSupervisor.
+
+    Commands are queued for the supervisor thread, so they never block.
+    """
+
+    def __init__(self, supervisor, mediafile, process):
+        self.supervisor = supervisor
+        self.mediafile = mediafile
+        self.pid = process.pid
+        self.video = dict()
+        self.audio = dict()
+        self.chapters = None
+        self.subtitles = None
+        self.position = 0.0
+        self.ready = False
+        self.finished = False
+        self.error = None
+        self.stats = dict(spawned=time.monotonic(), startup_time=None, bytes_read=0,
+                          status_lines=0, commands_sent=0, last_status=None)
+
+        self._process = process
+        self._parser = HeaderParser()
+        self._status_parser = StatusParser(OMXSupervisor._READ_SIZE)
+        self._paused = False
+        self._volume = 0 # dB
+        self._speed = OMXPlayer.NORMAL_SPEED
+        self._stop_deadline = None
+
+    def __repr__(self):
+        return "<SupervisedPlayer %s pid=%s>" % (self.mediafile, self.pid)
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until the headers were parsed. Returns whether they were.
+        """
+        with self.supervisor._condition:
+            self.supervisor._condition.wait_for(lambda: self.ready or self.finished, timeout)
+        return self.ready
+
+    def wait_finished(self, timeout=None):
+        """
+        Blocks until omxplayer has exited. Returns whether it did within `timeout`.
+        """
+        with self.supervisor._condition:
+            return self.supervisor._condition.wait_for(lambda: self.finished, timeout)
+
+    def _send(self, cmd, count=1):
+        self.supervisor._dispatch(self, cmd * count)
+
+    def pause(self):
+        if not self._paused:
+            self.toggle_pause()
+
+    def play(self):
+        if self._paused:
+            self.toggle_pause()
+
+    def toggle_pause(self):
+        self._paused = not self._paused
+        self._send(OMXPlayer._PAUSE_CMD)
+
+    def toggle_subtitles(self):
+        self._send(OMXPlayer._TOGGLE_SUB_CMD)
+
+    def set_volume(self, volume):
+        """
+        Set volume to `volume` dB, rounded to a multiple of `_VOLUME_INCREMENT`.
+        """
+        changes = int(round((volume - self._volume) / OMXPlayer._VOLUME_INCREMENT))
+        if changes > 0:
+            self._send(OMXPlayer._INCREASE_VOLUME_CMD, changes)
+        elif changes < 0:
+            self._send(OMXPlayer._DECREASE_VOLUME_CMD, -changes)
+        self._volume += changes * OMXPlayer._VOLUME_INCREMENT
+
+    def set_speed(self, speed):
+        """
+        Set speed to one of the supported speed levels.
+        """
+        assert speed in (OMXPlayer.SLOW_SPEED, OMXPlayer.NORMAL_SPEED,
+                         OMXPlayer.FAST_SPEED, OMXPlayer.VFAST_SPEED)
+        changes = speed - self._speed
+        if changes > 0:
+            self._send(OMXPlayer._INCREASE_SPEED_CMD, changes)
+        elif changes < 0:
+            self._send(OMXPlayer._DECREASE_SPEED_CMD, -changes)
+        self._speed = speed
+
+    def seek_forward_30(self):
+        self._send(OMXPlayer._SEEK_FORWARD_30_CMD)
+
+    def seek_backward_30(self):
+        self._send(OMXPlayer._SEEK_BACKWARD_30_CMD)
+
+    def seek_forward_600(self):
+        self._send(OMXPlayer._SEEK_FORWARD_600_CMD)
+
+    def seek_backward_600(self):
+        self._send(OMXPlayer._SEEK_BACKWARD_600_CMD)
+
+    def stop(self):
+        """
+        Asks omxplayer to quit; the supervisor kills it if it has not within
+        `OMXSupervisor._STOP_TIMEOUT`.
+        """
+        self.supervisor._dispatch(self, OMXPlayer._QUIT_CMD, stop=True)
+
+
+class OMXSupervisor(object):
+    """
+    Owns many omxplayer processes and serves all of them from one thread.
+
+    `player_class` only provides the launch argv and the transport, so a
+    simulated OMXPlayer subclass can be used for testing.
+    """
+
+    _READ_SIZE = OMXPlayer._READ_SIZE
+    _STARTUP_TIMEOUT = OMXPlayer._STARTUP_TIMEOUT
+    _STOP_TIMEOUT = 1.0 # seconds to wait for omxplayer to quit before killing it
+    _TIMER_INTERVAL = 0.1 # seconds between deadline and reaping checks
+
+    def __init__(self, player_class=OMXPlayer):
+        self.player_class = player_class
+        self.players = []
+
+        self._selector = selectors.DefaultSelector()
+        self._condition = Condition()
+        self._commands = deque() # (player, data, stop) for the loop thread
+        self._commands_lock = Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._zombies = [] # players whose process closed its pty but was not reaped yet
+        self.reaped = 0 # players dropped from `players` once their process was reaped
+        self._closed = False
+        self.loop_cpu_time = 0.0 # CPU seconds used by the supervisor thread
+
+        self._thread = Thread(target=self._run, name="OMXSupervisor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def spawn(self, mediafile, args=None, fullscreen=True):
+        """
+        Starts omxplayer for `mediafile` and returns its SupervisedPlayer
+        straight away; use `SupervisedPlayer.wait_ready` to wait for the headers.
+        """
+        argv = (self.player_class._LAUNCH_ARGV +
+                self.player_class._split_args(args, fullscreen) + [mediafile])
+        process = self.player_class._PROCESS_CLASS(argv)
+        player = SupervisedPlayer(self, mediafile, process)
+        with self._condition:
+            self.players.append(player)
+        # An empty command just gets the pty registered with the loop.
+        self._dispatch(player, "")
+        return player
+
+    def stats(self):
+        """
+        Returns supervisor-wide counters and a stats dict per player that
+        was not reaped yet.
+        """
+        with self._condition:
+            players = list(self.players)
+            reaped = self.reaped
+        return dict(
+            players=len(players),
+            running=sum(1 for p in players if not p.finished),
+            reaped=reaped,
+            loop_cpu_time=self.loop_cpu_time,
+            per_player=dict((p.pid, dict(p.stats, position=p.position,
+                                         finished=p.finished)) for p in players))
+
+    def stop_all(self):
+        for player in self._snapshot():
+            if not player.finished:
+                player.stop()
+
+    def close(self, timeout=None):
+        """
+        Stops every player, waits for them to exit and ends the loop thread.
+        """
+        self.stop_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for player in self._snapshot():
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            player.wait_finished(remaining)
+        self._closed = True
+        self._wakeup()
+        self._thread.join(timeout)
+        self._selector.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _snapshot(self):
+        with self._condition:
+            return list(self.players)
+
+    def _dispatch(self, player, data, stop=False):
+        with self._commands_lock:
+            self._commands.append((player, data, stop))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"x")
+        except (BlockingIOError, OSError):
+            pass # already pending, or closing
+
+    def _run(self):
+        cpu_start = time.thread_time()
+        while not self._closed:
+            for key, _ in self._selector.select(self._TIMER_INTERVAL):
+                if key.data is None:
+                    self._drain_wakeup()
+                else:
+                    self._on_readable(key.data)
+            self._run_commands()
+            self._check_timers()
+            self.loop_cpu_time = time.thread_time() - cpu_start
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run_commands(self):
+        with self._commands_lock:
+            commands, self._commands = self._commands, deque()
+        for player, data, stop in commands:
+            if player.finished:
+                continue
+            fd = player._process.child_fd
+            if fd not in self._selector.get_map():
+                self._selector.register(fd, selectors.EVENT_READ, player)
+            if not data:
+                continue
+            try:
+                os.write(player._process.child_fd, data.encode())
+                player.stats['commands_sent'] += 1
+            except OSError as e:
+                logger.warning("Could not send %r to %s: %s" % (data, player, e))
+            if stop and player._stop_deadline is None:
+                player._stop_deadline = time.monotonic() + self._STOP_TIMEOUT
+
+    def _on_readable(self, player):
+        fd = player._process.child_fd
+        try:
+            if player.ready:
+                count = player._status_parser.read(fd)
+            else:
+                data = os.read(fd, self._READ_SIZE)
+                count = len(data)
+        except OSError as e:
+            if e.errno not in (errno.EIO, errno.EBADF):
+                raise
+            count = 0
+        if not count:
+            self._finish(player)
+            return
+        player.stats['bytes_read'] += count
+
+        if not player.ready:
+            if not player._parser.feed(data):
+                return
+            parser = player._parser
+            with self._condition:
+                player.video, player.audio = parser.video, parser.audio
+                player.chapters, player.subtitles = parser.chapters, parser.subtitles
+                player.stats['startup_time'] = time.monotonic() - player.stats['spawned']
+                player.ready = True
+                self._condition.notify_all()
+            player._status_parser.feed(parser.leftover)
+            # Hide subtitles, as OMXPlayer does after startup.
+            player._send(OMXPlayer._TOGGLE_SUB_CMD)
+
+        while True:
+            position = player._status_parser.next()
+            if position is None:
+                break
+            if position is StatusParser.DONE:
+                self._finish(player)
+                return
+            if position is StatusParser.VOLUME:
+                continue
+            player.position = position
+            player.stats['status_lines'] += 1
+            player.stats['last_status'] = time.monotonic()
+
+    def _finish(self, player, error=None):
+        if player.finished:
+            return
+        fd = player._process.child_fd
+        if fd in self._selector.get_map():
+            self._selector.unregister(fd)
+        self._zombies.append(player)
+        with self._condition:
+            player.error = error
+            player.finished = True
+            self._condition.notify_all()
+
+    def _check_timers(self):
+        now = time.monotonic()
+        for player in self._snapshot():
+            if player.finished:
+                continue
+            if player._stop_deadline is not None and now > player._stop_deadline:
+                logger.info("%s did not quit, killing it" % player)
+                self._kill(player)
+                self._finish(player)
+            elif not player.ready and now - player.stats['spawned'] > self._STARTUP_TIMEOUT:
+                self._kill(player)
+                self._finish(player, OMXPlayerError("omxplayer printed no headers within %ss"
+                                                    % self._STARTUP_TIMEOUT))
+        # Reap exited children without blocking, and forget their players.
+        for player in list(self._zombies):
+            if not player._process.isalive():
+                player._process.close()
+                self._zombies.remove(player)
+                with self._condition:
+                    self.players.remove(player)
+                    self.reaped += 1
+
+    def _kill(self, player):
+        try:
+            os.kill(player.pid, signal.SIGKILL)
+        except OSError:
+            pass
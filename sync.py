@@ -0,0 +1,283 @@
+"""
+Synchronized playback across several players, for video walls.
+
+OMXPlayer has no clock to slave to, so a SyncGroup keeps its players aligned
+from the outside: it spawns them all paused, releases them together, and then
+compares their positions `interval` times a second. Players that run ahead
+are paused for as long as they lead; players that drifted off by more than
+`restart_threshold` are restarted where the others are::
+
+    wall = SyncGroup(['/media/left.mp4', '/media/right.mp4'])
+    wall.start()
+    ...
+    print(wall.drift_stats()) # spread between the players, in seconds
+    wall.stop()
+"""
+
+import logging
+import time
+
+from collections import deque
+from concurrent import futures
+from threading import Condition, Thread
+
+from .pyomxplayer import OMXPlayer, OMXPlayerError, stop_all
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(samples, fraction):
+    """
+    Returns the `fraction` percentile of the sorted `samples`.
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class SyncGroup(object):
+    """
+    Plays `mediafiles`, one player each, in step.
+
+    Drift is the spread between the furthest ahead and the furthest behind
+    player, sampled every `interval` seconds from their extrapolated
+    positions. A player more than `tolerance` seconds ahead of the slowest is
+    paused for the difference; one more than `restart_threshold` seconds off
+    the median is restarted at the median instead. A corrected player is
+    left alone for `_SETTLE` seconds, until its status lines reflect the
+    correction.
+    """
+
+    _INTERVAL = 0.1 # seconds between drift measurements
+    _TOLERANCE = 0.04 # seconds of drift left alone, about a frame
+    _RESTART_THRESHOLD = 1.0 # seconds of drift corrected by a restart rather than a pause
+    _SETTLE = 0.3 # seconds a corrected player is left alone
+    _DRIFT_SAMPLES = 3000 # drift measurements kept for `drift_stats`
+    _RELEASE_DELAY = 0.05 # seconds between deciding and releasing the players
+
+    def __init__(self, mediafiles, player_class=OMXPlayer, args=None, fullscreen=True,
+                 interval=_INTERVAL, tolerance=_TOLERANCE,
+                 restart_threshold=_RESTART_THRESHOLD):
+        self.mediafiles = list(mediafiles)
+        self.player_class = player_class
+        self.args = args
+        self.fullscreen = fullscreen
+        self.interval = interval
+        self.tolerance = tolerance
+        self.restart_threshold = restart_threshold
+
+        self.players = []
+        self.corrections = dict(pauses=0, restarts=0)
+        self._drift = deque(maxlen=self._DRIFT_SAMPLES)
+        self._resume_at = {} # player index -> when to end its micro-pause
+        self._settled_at = {} # player index -> when it may be corrected again
+        self._restarting = set() # indexes of players being restarted
+        self._paused = False
+        self._ticks = 0
+        self._cpu = 0.0 # control loop CPU seconds
+        self._condition = Condition()
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        """
+        Spawns all players, waits until each has paused, then releases them
+        so that their positions line up, and starts the control loop.
+        """
+        self.players = self._spawn_all()
+        pauses = [self._toggle_now(player) for player in self.players]
+        positions = [self._paused_position(player, paused)
+                     for player, paused in zip(self.players, pauses)]
+
+        # Release the players that are ahead later by as much as they lead.
+        base = min(positions)
+        release = time.monotonic() + self._RELEASE_DELAY
+        for lead, index in sorted((p - base, i) for i, p in enumerate(positions)):
+            delay = release + lead - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._toggle_now(self.players[index])
+        now = time.monotonic()
+        for index in range(len(self.players)):
+            self._settled_at[index] = now + self._SETTLE
+
+        self._thread = Thread(target=self._run, name="SyncGroup")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _spawn_all(self):
+        results = [None] * len(self.mediafiles)
+
+        def spawn(index, mediafile):
+            try:
+                results[index] = self.player_class(mediafile, args=self.args,
+                                                   fullscreen=self.fullscreen)
+            except Exception as e:
+                results[index] = e
+        threads = [Thread(target=spawn, args=item, name="SyncGroup spawn")
+                   for item in enumerate(self.mediafiles)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            stop_all(player for player in results if not isinstance(player, Exception))
+            raise errors[0]
+        return results
+
+    def _paused_position(self, player, paused):
+        """
+        Returns the position of a just paused player once the future
+        `paused` shows that the pause took effect.
+        """
+        try:
+            paused.result(self.player_class._ACK_TIMEOUT)
+        except (OMXPlayerError, futures.TimeoutError) as e:
+            raise OMXPlayerError("%s did not pause: %s" % (player.mediafile, str(e) or "timed out"))
+        return player.position
+
+    @staticmethod
+    def _toggle_now(player):
+        future = player.toggle_pause()
+        player._commands.flush()
+        return future
+
+    def pause(self):
+        """
+        Pauses all players; corrections stop until `play`.
+        """
+        with self._condition:
+            self._paused = True
+            for index in list(self._resume_at):
+                del self._resume_at[index]
+                self._toggle_now(self.players[index])
+            for player in self.players:
+                if not player._paused:
+                    self._toggle_now(player)
+
+    def play(self):
+        with self._condition:
+            now = time.monotonic()
+            for index, player in enumerate(self.players):
+                if player._paused:
+                    self._toggle_now(player)
+                self._settled_at[index] = now + self._SETTLE
+            self._paused = False
+
+    def stop(self):
+        """
+        Stops the control loop and all players.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        stop_all(self.players)
+
+    def drift(self):
+        """
+        Returns the current spread in seconds between the players that are
+        not being restarted, or None if there are fewer than two.
+        """
+        with self._condition:
+            positions = [p.position for i, p in enumerate(self.players)
+                         if i not in self._restarting and not p.finished]
+        if len(positions) < 2:
+            return None
+        return max(positions) - min(positions)
+
+    def drift_stats(self):
+        """
+        Returns percentiles of the measured drift in seconds, the corrections
+        made and the control loop's CPU time per measurement.
+        """
+        with self._condition:
+            samples = sorted(self._drift)
+            ticks, cpu = self._ticks, self._cpu
+            corrections = dict(self.corrections)
+        stats = dict(samples=len(samples), corrections=corrections,
+                     cpu_per_tick=cpu / ticks if ticks else None)
+        if samples:
+            stats.update(p50=_percentile(samples, 0.5), p90=_percentile(samples, 0.9),
+                         p99=_percentile(samples, 0.99), max=samples[-1])
+        return stats
+
+    def _run(self):
+        next_tick = time.monotonic()
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                for index, due in list(self._resume_at.items()):
+                    if due <= now:
+                        del self._resume_at[index]
+                        self._toggle_now(self.players[index])
+                        self._settled_at[index] = now + self._SETTLE
+                if now >= next_tick:
+                    start = time.thread_time()
+                    self._tick(now)
+                    self._cpu += time.thread_time() - start
+                    self._ticks += 1
+                    next_tick += self.interval
+                    if next_tick < now:
+                        next_tick = now + self.interval
+                wake = min([next_tick] + list(self._resume_at.values()))
+                self._condition.wait(max(wake - time.monotonic(), 0))
+
+    def _tick(self, now):
+        """
+        Measures the drift and corrects it. Called with the lock held.
+        """
+        if all(player.finished for player in self.players):
+            self._closed = True
+            return
+        live = [(i, p, p.position) for i, p in enumerate(self.players)
+                if i not in self._restarting and not p.finished]
+        if len(live) < 2:
+            return
+        positions = sorted(position for i, p, position in live)
+        self._drift.append(positions[-1] - positions[0])
+        if self._paused:
+            return
+
+        median = positions[len(positions) // 2]
+        settled = []
+        for index, player, position in live:
+            if index in self._resume_at or self._settled_at.get(index, 0) > now:
+                continue
+            if abs(position - median) > self.restart_threshold:
+                self._restart(index, player, median)
+            else:
+                settled.append((index, player, position))
+        if not settled:
+            return
+        slowest = min(position for i, p, position in live if i not in self._resume_at)
+        for index, player, position in settled:
+            lead = position - slowest
+            rate = player._playback_rate()
+            if lead > self.tolerance and rate:
+                self._toggle_now(player)
+                self._resume_at[index] = now + lead / rate
+                self.corrections['pauses'] += 1
+
+    def _restart(self, index, player, median):
+        """
+        Restarts `player` where the others will be once it is back, in a
+        thread of its own so the other players keep being measured.
+        """
+        target = median + player._restart_cost * player._playback_rate()
+        logger.info("%s drifted too far, restarting at %s" % (player.mediafile, target))
+        self._restarting.add(index)
+        self.corrections['restarts'] += 1
+
+        def restart():
+            try:
+                player.seek(target, method='restart')
+            except Exception:
+                logger.exception("Could not restart %s" % player.mediafile)
+            with self._condition:
+                self._restarting.discard(index)
+                self._settled_at[index] = time.monotonic() + self._SETTLE
+        thread = Thread(target=restart, name="SyncGroup restart")
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,678 @@
+"""
+Latency benchmarks for the pyomxplayer module, run against the fake omxplayer.
+
+Run from the directory containing the pyomxplayer checkout::
+
+    python -m pyomxplayer.test.benchmark [--runs N] [--output results.json]
+
+Results are printed (or written) as a single JSON document so they can be
+stored and compared between releases. All times are in milliseconds.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import re
+import select
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ..capture import OutputCapture
+from ..keyframes import KeyframeCache, build_index
+from ..playlist import Playlist
+from ..pool import PlayerPool, process_rss
+from ..pyomxplayer import OMXPlayer, StatusParser, stop_all
+from ..supervisor import OMXSupervisor
+from ..stall import StallWatchdog
+from ..sync import SyncGroup
+from ..transport import PexpectProcess, PtyProcess
+from . import util
+from .loadtest import load_test
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """
+    Registers `func` as a benchmark. It is called with the parsed options and
+    a scratch directory and returns a dict of results.
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def summarize(samples):
+    """
+    Returns summary statistics of a list of samples given in seconds.
+    """
+    samples = sorted(s * 1000.0 for s in samples)
+    if not samples:
+        return {"n": 0}
+    return {
+        "n": len(samples),
+        "mean": statistics.mean(samples),
+        "median": statistics.median(samples),
+        "p90": samples[min(len(samples) - 1, int(len(samples) * 0.9))],
+        "min": samples[0],
+        "max": samples[-1],
+    }
+
+
+def read_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def wait_until_dead(player, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while player._process.isalive() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+@benchmark
+def time_to_ready(options, scratch):
+    """
+    Time for OMXPlayer.__init__ to return a player with parsed headers.
+    """
+    player_class = util.simulated_player_class(status_rate=options.status_rate)
+    samples = []
+    for i in range(options.runs):
+        start = time.monotonic()
+        player = player_class("bbb.mp4")
+        samples.append(time.monotonic() - start)
+        player.stop()
+        wait_until_dead(player)
+    return summarize(samples)
+
+
+@benchmark
+def command_latency(options, scratch):
+    """
+    Time from calling a command method until the player process receives the
+    keystroke, measured with the fake's monotonic trace.
+    """
+    trace = os.path.join(scratch, "command_latency.trace")
+    player_class = util.simulated_player_class(trace=trace, status_rate=options.status_rate)
+    player = player_class("bbb.mp4")
+    calls = []
+    for i in range(options.runs):
+        for method in (player.increase_volume, player.decrease_volume):
+            calls.append(time.monotonic())
+            method()
+            time.sleep(0.02)
+    player.stop()
+    wait_until_dead(player)
+
+    received = [r["t"] for r in read_trace(trace)
+                if r["event"] == "key" and r["action"].endswith("_volume")]
+    return summarize([r - c for c, r in zip(calls, received)])
+
+
+@benchmark
+def volume_ramp(options, scratch):
+    """
+    Time from calling set_volume for a 20 dB ramp until omxplayer has
+    received its last keystroke, and the number of writes it took.
+    """
+    trace = os.path.join(scratch, "volume_ramp.trace")
+    player_class = util.simulated_player_class(trace=trace, status_rate=options.status_rate)
+    player = player_class("bbb.mp4")
+    calls = []
+    writes = []
+    for i in range(options.runs):
+        volume = 20 if i % 2 == 0 else 0
+        before = player._commands.writes
+        calls.append(time.monotonic())
+        player.set_volume(volume)
+        time.sleep(0.1)
+        writes.append(player._commands.writes - before)
+    player.stop()
+    wait_until_dead(player)
+
+    # Each ramp is 40 keystrokes; the last one marks its arrival.
+    keys = [r["t"] for r in read_trace(trace)
+            if r["event"] == "key" and r["action"].endswith("_volume")]
+    arrivals = keys[39::40]
+    return {
+        "latency": summarize([a - c for c, a in zip(calls, arrivals)]),
+        "writes": {"mean": statistics.mean(writes), "max": max(writes)},
+    }
+
+
+@benchmark
+def command_ack(options, scratch):
+    """
+    Time from calling a command method until its future resolves, i.e.
+    until omxplayer's output shows the effect: a volume echo, the position
+    standing still after a pause or moving again after a resume.
+    """
+    player = util.simulated_player_class(status_rate=options.status_rate)("bbb.mp4")
+    player.wait_for_position(2)
+    samples = dict(volume=[], pause=[], resume=[])
+    for i in range(options.runs):
+        for name, method in (("volume", player.increase_volume), ("pause", player.pause),
+                             ("resume", player.play)):
+            start = time.monotonic()
+            method().result(5)
+            samples[name].append(time.monotonic() - start)
+        player.set_volume(0).result(5)
+    player.stop()
+    wait_until_dead(player)
+    return dict((name, summarize(values)) for name, values in samples.items())
+
+
+@benchmark
+def position_staleness(options, scratch):
+    """
+    Difference between the true media position and `OMXPlayer.position`
+    when sampled at arbitrary times.
+    """
+    trace = os.path.join(scratch, "position_staleness.trace")
+    player_class = util.simulated_player_class(trace=trace, status_rate=options.status_rate)
+    player = player_class("bbb.mp4")
+    time.sleep(0.5)
+    reads = []
+    for i in range(options.runs * 10):
+        reads.append((time.monotonic(), player.position))
+        time.sleep(0.0137)
+    player.stop()
+    wait_until_dead(player)
+
+    records = [r for r in read_trace(trace) if r["event"] in ("start", "status")]
+    samples = []
+    index = 0
+    for t, position in reads:
+        while index + 1 < len(records) and records[index + 1]["t"] <= t:
+            index += 1
+        record = records[index]
+        samples.append(record["pos"] + (t - record["t"]) - position)
+    return summarize(samples)
+
+
+@benchmark
+def stop_teardown(options, scratch):
+    """
+    Time stop() takes to have omxplayer quit, reap it and join the output
+    reader, for one player and for eight, stopped one after another or with
+    stop_all.
+    """
+    player_class = util.simulated_player_class(status_rate=options.status_rate)
+    single = []
+    clean = 0
+    for i in range(options.runs):
+        player = player_class("bbb.mp4")
+        result = player.stop()
+        single.append(result['latency'])
+        clean += result['clean']
+    sequential = []
+    concurrent = []
+    for i in range(max(options.runs // 4, 1)):
+        players = [player_class("bbb.mp4") for j in range(8)]
+        start = time.monotonic()
+        for player in players:
+            player.stop()
+        sequential.append(time.monotonic() - start)
+        players = [player_class("bbb.mp4") for j in range(8)]
+        concurrent.append(stop_all(players)['latency'])
+    # Wedged players only go with SIGKILL, so their deadlines add up unless
+    # they run concurrently.
+    wedged_class = util.simulated_player_class(stall_after=0.01, ignore_sigterm=True)
+    wedged = {}
+    for name in ("sequential_4", "stop_all_4"):
+        players = [wedged_class("bbb.mp4") for j in range(4)]
+        time.sleep(0.1)
+        start = time.monotonic()
+        if name == "stop_all_4":
+            stop_all(players, timeout=0.2)
+        else:
+            for player in players:
+                player.stop(timeout=0.2)
+        wedged[name] = (time.monotonic() - start) * 1000.0
+    return {
+        "single": summarize(single),
+        "clean": clean,
+        "sequential_8": summarize(sequential),
+        "stop_all_8": summarize(concurrent),
+        "wedged": wedged,
+    }
+
+
+@benchmark
+def seek_latency(options, scratch):
+    """
+    Latency and final error of OMXPlayer.seek, for key seeks and restarts.
+    """
+    player_class = util.simulated_player_class(status_rate=options.status_rate, duration=36000)
+    player = player_class("bbb.mp4")
+    results = {}
+    try:
+        for method in ('keys', 'restart'):
+            latencies = []
+            errors = []
+            for i in range(options.runs):
+                result = player.seek(player.position + 30 * (1 + i % 3) + 7, method=method)
+                latencies.append(result['latency'])
+                errors.append(abs(result['error']))
+            results[method] = {"latency": summarize(latencies), "error": summarize(errors)}
+    finally:
+        player.stop()
+    return results
+
+
+@benchmark
+def stream_switching(options, scratch):
+    """
+    Time to switch the audio stream with omxplayer's keys, until the last
+    key arrives, against restarting omxplayer at the same position, which is
+    what switching with its -n option takes.
+    """
+    trace = os.path.join(scratch, "stream_switching.trace")
+    player = util.simulated_player_class(trace=trace, status_rate=options.status_rate,
+                                         audio_streams=4)("bbb.mp4")
+    calls = []
+    restarts = []
+    try:
+        for i in range(options.runs):
+            calls.append(time.monotonic())
+            player.set_audiochannel((i + 1) % 4)
+            time.sleep(0.05)
+        for i in range(options.runs):
+            restarts.append(player.seek(player.position, method='restart')['latency'])
+    finally:
+        player.stop()
+
+    # Switching from the last stream back to the first takes three keys.
+    keys = [r["t"] for r in read_trace(trace)
+            if r["event"] == "key" and r["action"].endswith("_audio")]
+    switches = []
+    for start, end in zip(calls, calls[1:] + [float("inf")]):
+        arrived = [t for t in keys if start <= t < end]
+        if arrived:
+            switches.append(arrived[-1] - start)
+    return {"keys": summarize(switches), "restart": summarize(restarts)}
+
+
+@benchmark
+def pool_acquire(options, scratch):
+    """
+    Time for PlayerPool.acquire to return a playing, pre-warmed player.
+    """
+    pool = PlayerPool(size=1,
+                      player_class=util.simulated_player_class(status_rate=options.status_rate))
+    samples = []
+    try:
+        for i in range(options.runs):
+            mediafile = "bbb-%d.mp4" % i
+            pool.prepare(mediafile)
+            while pool.stats()['ready'] < 1:
+                time.sleep(0.005)
+            start = time.monotonic()
+            player = pool.acquire(mediafile)
+            samples.append(time.monotonic() - start)
+            player.stop()
+    finally:
+        pool.close()
+    return summarize(samples)
+
+
+@benchmark
+def supervisor_scaling(options, scratch):
+    """
+    CPU and memory cost of one OMXSupervisor as the number of simulated
+    players grows, as CPU seconds per second of the supervisor thread.
+    """
+    results = {}
+    count = 1
+    while count <= options.max_players:
+        supervisor = OMXSupervisor(
+            player_class=util.simulated_player_class(status_rate=options.status_rate))
+        try:
+            players = [supervisor.spawn("zone%d.mp3" % i) for i in range(count)]
+            for player in players:
+                player.wait_ready(timeout=30)
+            cpu_before = supervisor.loop_cpu_time
+            lines_before = sum(p.stats['status_lines'] for p in players)
+            start = time.monotonic()
+            time.sleep(1.0)
+            elapsed = time.monotonic() - start
+            results[str(count)] = {
+                "loop_cpu": (supervisor.loop_cpu_time - cpu_before) / elapsed,
+                "status_lines_per_second":
+                    (sum(p.stats['status_lines'] for p in players) - lines_before) / elapsed,
+                "rss": process_rss(os.getpid()),
+                "threads": threading.active_count(),
+                "startup": summarize([p.stats['startup_time'] for p in players if p.ready]),
+            }
+        finally:
+            supervisor.close(timeout=10)
+        count *= 2
+    return results
+
+
+@benchmark
+def playlist_gap(options, scratch):
+    """
+    Gap between consecutive items of a Playlist, and without preloading:
+    spawning the next player once the previous one finished.
+    """
+    player_class = util.simulated_player_class(status_rate=options.status_rate, duration=2)
+    items = ["item%d.mp4" % i for i in range(options.runs + 1)]
+
+    playlist = Playlist(items, player_class=player_class, preroll=1.5)
+    playlist.play()
+    try:
+        playlist.wait_finished(timeout=5 * len(items))
+    finally:
+        playlist.stop()
+    gaps = [t['gap'] for t in playlist.transitions if t['gap'] is not None]
+
+    naive = []
+    player = player_class(items[0])
+    player.play()
+    for mediafile in items[1:]:
+        player.wait_finished()
+        end = time.monotonic()
+        player = player_class(mediafile)
+        player.play()
+        player.wait_for_position()
+        naive.append(time.monotonic() - end)
+    player.stop()
+    return {"playlist": summarize(gaps), "naive": summarize(naive)}
+
+
+@benchmark
+def sync_drift(options, scratch):
+    """
+    Drift between 16 players kept in step by a SyncGroup at 10 Hz, and the
+    control loop's CPU time per measurement.
+    """
+    group = SyncGroup(["wall-%d.mp4" % i for i in range(16)], interval=0.1,
+                      player_class=util.simulated_player_class(status_rate=options.status_rate,
+                                                               duration=3600))
+    group.start()
+    try:
+        time.sleep(0.5 * options.runs)
+        stats = group.drift_stats()
+    finally:
+        group.stop()
+    return {
+        "drift": {name: stats[name] * 1000.0 for name in ("p50", "p90", "p99", "max")},
+        "samples": stats['samples'],
+        "corrections": stats['corrections'],
+        "cpu_per_tick": stats['cpu_per_tick'] * 1000.0,
+    }
+
+
+@benchmark
+def stall_recovery(options, scratch):
+    """
+    Time for a StallWatchdog with a 0.5 second timeout to get a frozen
+    omxplayer playing again, from noticing the stall and from the last
+    position change.
+    """
+    player = util.simulated_player_class(status_rate=options.status_rate, duration=3600,
+                                         stall_after=0.5)("bbb.mp4")
+    watchdog = StallWatchdog(player, timeout=0.5)
+    watchdog.start()
+    try:
+        deadline = time.monotonic() + 5 * options.runs
+        while watchdog.recoveries < options.runs and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watchdog.stop()
+        player.stop()
+    recoveries = list(watchdog._recent)
+    return {
+        "recovery": summarize([r['recovery'] for r in recoveries]),
+        "downtime": summarize([r['downtime'] for r in recoveries]),
+    }
+
+
+@benchmark
+def keyframe_index(options, scratch):
+    """
+    Time to build the keyframe index of 4 GiB (sparse) MP4 and Matroska
+    files of a two hour movie with a keyframe every two seconds, time to
+    load it from a KeyframeCache, and its size in bytes.
+    """
+    results = {}
+    for name, write in (('mp4', util.write_mp4), ('mkv', util.write_mkv)):
+        path = os.path.join(scratch, "movie." + name)
+        if name == 'mp4':
+            write(path, 7200, keyframe_interval=2.0, mdat_size=4 << 30)
+        else:
+            write(path, 7200, keyframe_interval=2.0, cluster_size=4 << 30)
+        builds = []
+        loads = []
+        for i in range(options.runs):
+            start = time.perf_counter()
+            index = build_index(path)
+            builds.append(time.perf_counter() - start)
+            cache = KeyframeCache(os.path.join(scratch, "keyframes"))
+            cache.get(path)
+            start = time.perf_counter()
+            cache.get(path)
+            loads.append(time.perf_counter() - start)
+        os.remove(path)
+        results[name] = {"build": summarize(builds), "cached": summarize(loads),
+                         "keyframes": len(index), "bytes": index.size,
+                         "file_bytes": 4 << 30}
+    return results
+
+
+def _status_lines(count):
+    """
+    Returns `count` status lines as omxplayer prints them, then its goodbye.
+    """
+    return [b"M:%9d V: 6 Cv: 213k Ca: 4k                       \r" % (i * 40000)
+            for i in range(count)] + [b"\nhave a nice day ;)\n"]
+
+
+def _parse_cpu(lines, parse):
+    """
+    Writes `lines` to a pipe one at a time, as omxplayer does, each after
+    `parse(fd, parsed)` has called `parsed()` for the one before. Returns
+    the CPU time of the parsing thread and what `parse` returned.
+    """
+    r, w = os.pipe()
+    parsed = threading.Semaphore(0)
+
+    def write():
+        for line in lines:
+            os.write(w, line)
+            parsed.acquire(timeout=1)
+        os.close(w)
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        start = time.thread_time()
+        result = parse(r, parsed.release)
+        return time.thread_time() - start, result
+    finally:
+        writer.join()
+        os.close(r)
+
+
+def _parse_status_parser(fd, parsed, capture=None):
+    parser = StatusParser(OMXPlayer._READ_SIZE)
+    count = 0
+    while True:
+        read = parser.read(fd)
+        if not read:
+            break
+        if capture is not None:
+            capture.write(parser.tail(read))
+        while True:
+            position = parser.next()
+            if position is None:
+                break
+            if position is StatusParser.DONE:
+                return count
+            count += 1
+            parsed()
+    return count
+
+
+def _parse_pexpect(fd, parsed):
+    """
+    The expect() loop OMXPlayer used to read positions with, less its sleep.
+    """
+    from pexpect import fdpexpect, EOF, TIMEOUT
+    process = fdpexpect.fdspawn(fd)
+    patterns = [re.compile(br"(M:|V :)\s*([\d.]+).*"), TIMEOUT, EOF,
+                re.compile(br"have a nice day.*")]
+    count = 0
+    while True:
+        index = process.expect(patterns)
+        if index == 0:
+            float(process.match.group(2).strip()) / 1000000
+            count += 1
+            parsed()
+        elif index in (2, 3):
+            return count
+
+
+@benchmark
+def status_parsing_cpu(options, scratch):
+    """
+    CPU time to parse 10k status lines with StatusParser and with the
+    pexpect.expect loop it replaced, and how many positions each reported.
+    """
+    lines = _status_lines(10000)
+    results = {}
+    for name, parse in (('status_parser', _parse_status_parser), ('pexpect', _parse_pexpect)):
+        samples = []
+        for i in range(options.runs):
+            cpu, positions = _parse_cpu(lines, parse)
+            samples.append(cpu)
+        results[name] = {"cpu": summarize(samples), "positions": positions}
+    return results
+
+
+@benchmark
+def output_capture(options, scratch):
+    """
+    CPU time to read and parse 10k status lines, as OMXPlayer's output
+    reader does, without and with an OutputCapture ring.
+    """
+    lines = _status_lines(10000)
+    capture = OutputCapture(os.path.join(scratch, "capture.ring"))
+    results = {}
+    for name, parse in (('plain', _parse_status_parser),
+                        ('captured', functools.partial(_parse_status_parser, capture=capture))):
+        samples = []
+        for i in range(options.runs):
+            cpu, positions = _parse_cpu(lines, parse)
+            samples.append(cpu)
+        results[name] = {"cpu": summarize(samples), "positions": positions}
+    capture.close()
+    return results
+
+
+def _import_time(statement):
+    """
+    Wall time of a fresh interpreter running `statement`, from the
+    directory containing this checkout.
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start = time.monotonic()
+    subprocess.check_call([sys.executable, "-c", statement], cwd=os.path.dirname(package_dir))
+    return time.monotonic() - start
+
+
+@benchmark
+def import_time(options, scratch):
+    """
+    Time for a fresh interpreter to import the player module, compared with
+    a bare interpreter and with also importing pexpect, which it used to need.
+    """
+    package = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    statements = {
+        "baseline": "pass",
+        "pyomxplayer": "import %s.pyomxplayer" % package,
+        "pyomxplayer_pexpect": "import pexpect, %s.pyomxplayer" % package,
+    }
+    return {name: summarize([_import_time(statement) for i in range(options.runs)])
+            for name, statement in sorted(statements.items())}
+
+
+@benchmark
+def spawn_latency(options, scratch):
+    """
+    Time from spawning the fake omxplayer to its first byte of output, for
+    each transport.
+    """
+    argv = util.fake_launch_argv(status_rate=options.status_rate) + ["bbb.mp4"]
+    results = {}
+    for name, process_class in (('pty', PtyProcess), ('pexpect', PexpectProcess)):
+        samples = []
+        for i in range(options.runs):
+            start = time.monotonic()
+            process = process_class(argv)
+            select.select([process.child_fd], [], [], 5)
+            samples.append(time.monotonic() - start)
+            process.close(force=True)
+        results[name] = summarize(samples)
+    return results
+
+
+@benchmark
+def control_server(options, scratch):
+    """
+    Commands per second and latency through the control server, with one
+    request in flight per connection and with pipelining.
+    """
+    return {"depth_%d" % depth: asyncio.run(load_test(clients=4, depth=depth,
+                                                      duration=0.2 * options.runs))
+            for depth in (1, 16)}
+
+
+def run(options):
+    scratch = tempfile.mkdtemp(prefix="pyomxplayer-bench-")
+    try:
+        results = {}
+        for func in BENCHMARKS:
+            if options.only and func.__name__ not in options.only:
+                continue
+            results[func.__name__] = func(options, scratch)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "runs": options.runs,
+        "status_rate": options.status_rate,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyomxplayer latency benchmarks")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--status-rate", type=float, default=25.0)
+    parser.add_argument("--max-players", type=int, default=64,
+                        help="largest player count for supervisor_scaling")
+    parser.add_argument("--only", action="append",
+                        help="run only the named benchmark (repeatable)")
+    parser.add_argument("--output", help="write JSON results to this file")
+    options = parser.parse_args(argv)
+
+    report = json.dumps(run(options), indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
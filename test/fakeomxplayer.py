@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+"""
+Scriptable stand-in for /usr/bin/omxplayer.
+
+Prints the same header and status lines as omxplayer 0.3.x and reacts to the
+keystrokes OMXPlayer sends, so the wrapper can be exercised and benchmarked
+without a Raspberry Pi, a display or network access.
+
+Usage (options after the fake ones are the usual omxplayer arguments)::
+
+    fakeomxplayer.py [--status-rate HZ] [--duration S] ... -o hdmi -s movie.mp4
+
+With ``--trace FILE`` every key press and status line is appended to FILE as a
+JSON object carrying a ``time.monotonic()`` timestamp, which is what the
+benchmark suite uses to measure latency and staleness from the outside.
+"""
+
+import os
+import sys
+import tty
+import termios
+
+# Switch the terminal to cbreak mode before anything else, just like
+# omxplayer's keyboard thread does, so single keystrokes are delivered
+# immediately and not echoed back. Not when imported, see virtualomxplayer.
+if __name__ == "__main__" and os.isatty(sys.stdin.fileno()):
+    _STDIN_ATTRS = termios.tcgetattr(sys.stdin.fileno())
+    tty.setcbreak(sys.stdin.fileno())
+else:
+    _STDIN_ATTRS = None
+
+import argparse
+import json
+import select
+import signal
+import time
+
+FAKE_VERSION = "0.3.7"
+
+# Speed levels, see OMXPlayer.SLOW_SPEED and friends. Level n plays at 2**n.
+_MIN_SPEED = -3
+_MAX_SPEED = 3
+
+_ESCAPE_KEYS = {
+    b"\033[D": "seek_backward_30",
+    b"\033[C": "seek_forward_30",
+    b"\033[B": "seek_backward_600",
+    b"\033[A": "seek_forward_600",
+}
+
+_KEYS = {
+    b"p": "pause",
+    b" ": "pause",
+    b"s": "toggle_subtitles",
+    b"q": "quit",
+    b"-": "decrease_volume",
+    b"+": "increase_volume",
+    b"=": "increase_volume",
+    b"1": "decrease_speed",
+    b"2": "increase_speed",
+    b"j": "previous_audio",
+    b"k": "next_audio",
+    b"i": "previous_chapter",
+    b"o": "next_chapter",
+    b"n": "previous_subtitles",
+    b"m": "next_subtitles",
+}
+
+
+def parse_position(value):
+    """
+    Parses a ``-l`` position given either in seconds or as hh:mm:ss.
+    """
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--status-rate", type=float, default=25.0,
+                        help="status lines printed per second (default 25)")
+    parser.add_argument("--duration", type=float, default=600.0,
+                        help="media duration in seconds (default 600)")
+    parser.add_argument("--startup-delay", type=float, default=0.0,
+                        help="seconds to wait before printing the headers")
+    parser.add_argument("--seek-delay", type=float, default=0.0,
+                        help="seconds before a seek key takes effect")
+    parser.add_argument("--keyframe-interval", type=float, default=None,
+                        help="seconds between keyframes; -l starts at the one before")
+    parser.add_argument("--stall-after", type=float, default=None,
+                        help="freeze, as on a stalled stream, this many seconds "
+                             "after the headers: no more status lines or keystrokes")
+    parser.add_argument("--ignore-sigterm", action="store_true",
+                        help="ignore SIGTERM, as a player wedged in the driver does")
+    parser.add_argument("--audio-streams", type=int, default=1,
+                        help="audio streams in the file (default 1)")
+    parser.add_argument("--subtitle-streams", type=int, default=0,
+                        help="subtitle streams in the file (default 0)")
+    parser.add_argument("--chapters", type=int, default=0,
+                        help="chapters of equal length in the file (default 0)")
+    parser.add_argument("--no-video", action="store_true",
+                        help="simulate an audio-only file")
+    parser.add_argument("--no-audio", action="store_true",
+                        help="simulate a video-only file")
+    parser.add_argument("--trace", default=None,
+                        help="append JSON trace records to this file")
+    parser.add_argument("-l", "--pos", default="0")
+    parser.add_argument("-o", "--adev", default="local")
+    parser.add_argument("-s", "--stats", action="store_true")
+    parser.add_argument("-r", "--refresh", action="store_true")
+    parser.add_argument("-v", "--version", action="store_true",
+                        help="print the version and exit")
+    parser.add_argument("mediafile", nargs="?", default="")
+    options, _ = parser.parse_known_args(argv)
+    if options.version:
+        parser.exit(0, "omxplayer - Commandline multimedia player for the Raspberry Pi\n"
+                       "        Version   : %s [fake]\n" % FAKE_VERSION)
+    if not options.mediafile:
+        # Like omxplayer, print the usage when there is nothing to play.
+        parser.exit(1, parser.format_help())
+    return options
+
+
+class FakeOMXPlayer(object):
+
+    _VOLUME_INCREMENT = 0.5
+
+    def __init__(self, options, out=None, clock=time.monotonic):
+        self.options = options
+        self.out = out or sys.stdout
+        self.clock = clock
+        self.position = parse_position(options.pos) # seconds
+        if options.keyframe_interval:
+            self.position -= self.position % options.keyframe_interval
+        self.paused = False
+        self.speed = 0
+        self.volume = 0.0 # dB
+        self.subtitles_visible = True
+        self.audio_index = 0
+        self.subtitle_index = 0
+        self.running = True
+        self._trace = open(options.trace, "a") if options.trace else None
+        self._last_tick = None
+        self._delayed_seeks = [] # (due time, step)
+
+    def trace(self, event, **fields):
+        if self._trace is None:
+            return
+        fields["event"] = event
+        fields["t"] = self.clock()
+        fields["pos"] = self.position
+        self._trace.write(json.dumps(fields) + "\n")
+        self._trace.flush()
+
+    def write(self, text):
+        self.out.write(text)
+        self.out.flush()
+
+    def print_headers(self):
+        options = self.options
+        audio_streams = 0 if options.no_audio else options.audio_streams
+        video_streams = 0 if options.no_video else 1
+        self.write("file : %s result 0 format mov,mp4 audio streams %d video streams %d "
+                   "chapters %d subtitles %d length %d\n"
+                   % (options.mediafile, audio_streams, video_streams, options.chapters,
+                      options.subtitle_streams, options.duration))
+        if video_streams:
+            self.write("Video codec omx-h264 width 640 height 360 profile 100 fps 24.000000\n")
+        if audio_streams:
+            self.write("Audio codec aac channels 2 samplerate 48000 bitspersample 16\n")
+        self.write("Subtitle count: %d, state: off, index: 1, delay: 0\n"
+                   % options.subtitle_streams)
+        self.trace("start", speed=self.speed, paused=self.paused)
+
+    def advance(self, now):
+        if self._last_tick is not None and not self.paused:
+            self.position += (now - self._last_tick) * 2.0 ** self.speed
+        self._last_tick = now
+        if self.position >= self.options.duration:
+            self.position = self.options.duration
+            self.quit()
+
+    def print_status(self):
+        self.write("M:%9d V: 6 Cv: 213k Ca: 4k                       \r"
+                   % int(self.position * 1000000))
+        self.trace("status")
+
+    def quit(self):
+        if self.running:
+            self.running = False
+            self.write("\nhave a nice day ;)\n")
+            self.trace("quit")
+
+    def handle_key(self, action):
+        self.trace("key", action=action)
+        if action == "pause":
+            self.paused = not self.paused
+        elif action == "toggle_subtitles":
+            self.subtitles_visible = not self.subtitles_visible
+        elif action == "quit":
+            self.quit()
+        elif action in ("decrease_volume", "increase_volume"):
+            sign = 1 if action == "increase_volume" else -1
+            self.volume += sign * self._VOLUME_INCREMENT
+            self.write("Current Volume: %.2fdB\n" % self.volume)
+        elif action in ("decrease_speed", "increase_speed"):
+            sign = 1 if action == "increase_speed" else -1
+            self.speed = max(_MIN_SPEED, min(_MAX_SPEED, self.speed + sign))
+            self.write("Playspeed %.3f\n" % 2.0 ** self.speed)
+        elif action.endswith("_audio"):
+            # Like omxplayer, stop at the first and last stream.
+            step = 1 if action.startswith("next") else -1
+            streams = 0 if self.options.no_audio else self.options.audio_streams
+            self.audio_index = max(0, min(streams - 1, self.audio_index + step))
+        elif action.endswith("_subtitles"):
+            step = 1 if action.startswith("next") else -1
+            self.subtitle_index = max(0, min(self.options.subtitle_streams - 1,
+                                             self.subtitle_index + step))
+        elif action.endswith("_chapter"):
+            self.seek_chapter(1 if action.startswith("next") else -1)
+        elif action.startswith("seek_"):
+            step = int(action.rsplit("_", 1)[1])
+            if action.startswith("seek_backward"):
+                step = -step
+            if self.options.seek_delay:
+                self._delayed_seeks.append((self.clock() + self.options.seek_delay, step))
+            else:
+                self.seek(step)
+
+    def seek(self, step):
+        self.position = max(0.0, min(self.options.duration, self.position + step))
+        self.trace("seek", step=step)
+
+    @property
+    def chapter(self):
+        if not self.options.chapters:
+            return None
+        length = self.options.duration / self.options.chapters
+        return min(int(self.position // length), self.options.chapters - 1)
+
+    def seek_chapter(self, step):
+        """
+        Seeks to the start of the next or previous chapter like omxplayer:
+        to the start of the first at most, nowhere past the last, and by 600
+        seconds without chapters.
+        """
+        if not self.options.chapters:
+            self.seek(600 * step)
+            return
+        chapter = max(self.chapter + step, 0)
+        if chapter < self.options.chapters:
+            self.position = chapter * self.options.duration / self.options.chapters
+            self.trace("chapter", chapter=chapter)
+
+    def apply_delayed_seeks(self, now):
+        while self._delayed_seeks and self._delayed_seeks[0][0] <= now:
+            self.advance(now)
+            self.seek(self._delayed_seeks.pop(0)[1])
+
+    def handle_input(self, data):
+        """
+        Dispatches every complete keystroke in `data`, returning what is left.
+        """
+        while data:
+            if data[:1] == b"\033":
+                if len(data) < 3:
+                    break
+                action = _ESCAPE_KEYS.get(data[:3])
+                data = data[3:]
+            else:
+                action = _KEYS.get(data[:1])
+                data = data[1:]
+            if action:
+                self.handle_key(action)
+        return data
+
+    def run(self, stdin_fd):
+        if self.options.startup_delay:
+            time.sleep(self.options.startup_delay)
+        self.print_headers()
+
+        period = 1.0 / self.options.status_rate
+        pending = b""
+        next_tick = time.monotonic()
+        stall = None
+        if self.options.stall_after is not None:
+            stall = next_tick + self.options.stall_after
+        self.advance(next_tick)
+        while self.running:
+            if stall is not None and time.monotonic() >= stall:
+                self.trace("stall")
+                while True:
+                    time.sleep(3600)
+            due = next_tick
+            if self._delayed_seeks:
+                due = min(due, self._delayed_seeks[0][0])
+            timeout = max(0.0, due - time.monotonic())
+            readable, _, _ = select.select([stdin_fd], [], [], timeout)
+            if readable:
+                data = os.read(stdin_fd, 1024)
+                if not data:
+                    break
+                self.advance(time.monotonic())
+                pending = self.handle_input(pending + data)
+            now = time.monotonic()
+            self.apply_delayed_seeks(now)
+            if now >= next_tick and self.running:
+                self.advance(now)
+                if self.running and self.options.stats:
+                    self.print_status()
+                next_tick += period
+                if next_tick < now:
+                    next_tick = now + period
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    stdin_fd = sys.stdin.fileno()
+    if options.ignore_sigterm:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        FakeOMXPlayer(options).run(stdin_fd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if _STDIN_ATTRS is not None:
+            termios.tcsetattr(stdin_fd, termios.TCSADRAIN, _STDIN_ATTRS)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Stand-in for youtube-dl --get-url.
+
+Prints a made-up stream URL for the page URL it is given, so the resolver
+can be tested without network access::
+
+    fakeresolver.py [--delay S] [--log FILE] [--format F] URL
+
+Every run is appended to `--log`, so tests can count them. Page URLs
+containing "private" fail like an unavailable video.
+"""
+
+import argparse
+import hashlib
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds to take, like a slow extractor")
+    parser.add_argument("--log", default=None, help="append the URL to this file")
+    parser.add_argument("--format", default="best")
+    parser.add_argument("url")
+    options = parser.parse_args(argv)
+
+    if options.log:
+        with open(options.log, "a") as f:
+            f.write(options.url + "\n")
+    time.sleep(options.delay)
+    if "private" in options.url:
+        sys.stderr.write("ERROR: This video is private\n")
+        return 1
+    digest = hashlib.sha1(options.url.encode()).hexdigest()[:12]
+    print("https://cdn.example.com/%s/%s.mp4" % (digest, options.format))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
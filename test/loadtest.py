@@ -0,0 +1,126 @@
+"""
+Load-test client for the control server.
+
+Opens `--clients` connections, each driving its own player with cheap
+commands (volume steps and status requests), keeping up to `--depth`
+requests in flight per connection, and reports commands per second and the
+latency distribution as JSON, in milliseconds::
+
+    python -m pyomxplayer.test.loadtest --clients 8 --depth 16 --duration 5
+
+Without `--port` a ControlServer is started in-process against the fake
+omxplayer; with it, the server at `--host`:`--port` is tested.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from ..asyncomxplayer import AsyncOMXPlayer
+from ..control import ControlClient, ControlServer
+from . import util
+
+
+SimulatedAsyncOMXPlayer = util.simulated_player_class(AsyncOMXPlayer, status_rate=25)
+
+
+def percentile(samples, fraction):
+    """
+    Returns the `fraction` percentile of the sorted `samples`.
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def _drive(client, player, depth, deadline, latencies):
+    """
+    Sends commands to `player` on `client`, `depth` at a time, until `deadline`.
+    """
+    in_flight = set()
+    loop = asyncio.get_running_loop()
+    count = 0
+
+    def sent(op, **params):
+        start = loop.time()
+        future = client.send(op, player=player, **params)
+        future.add_done_callback(lambda f: latencies.append(loop.time() - start))
+        return future
+
+    while loop.time() < deadline:
+        while len(in_flight) < depth:
+            if count % 4 == 3:
+                in_flight.add(sent('status'))
+            else:
+                in_flight.add(sent('set_volume', volume=-3 * (count % 2)))
+            count += 1
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            future.result()
+    if in_flight:
+        await asyncio.wait(in_flight)
+
+
+async def load_test(host="127.0.0.1", port=None, clients=4, depth=8, duration=2.0):
+    """
+    Runs the load test and returns its results. Starts a server against the
+    fake omxplayer if `port` is None.
+    """
+    server = None
+    if port is None:
+        server = ControlServer(player_class=SimulatedAsyncOMXPlayer, host=host)
+        port = await server.start()
+    connections = []
+    try:
+        for i in range(clients):
+            client = await ControlClient.connect(host, port)
+            connections.append(client)
+        players = await asyncio.gather(*[client.call('open', mediafile="bbb.mp4")
+                                         for client in connections])
+        latencies = []
+        start = time.monotonic()
+        deadline = asyncio.get_running_loop().time() + duration
+        await asyncio.gather(*[_drive(client, opened['player'], depth, deadline, latencies)
+                               for client, opened in zip(connections, players)])
+        elapsed = time.monotonic() - start
+        await asyncio.gather(*[client.call('stop', player=opened['player'])
+                               for client, opened in zip(connections, players)])
+    finally:
+        for client in connections:
+            await client.close()
+        if server is not None:
+            await server.close()
+
+    latencies = sorted(l * 1000.0 for l in latencies)
+    return {
+        "clients": clients,
+        "depth": depth,
+        "commands": len(latencies),
+        "commands_per_second": len(latencies) / elapsed,
+        "latency": {
+            "median": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1],
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyomxplayer control server load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int,
+                        help="server to test; default: start one against the fake omxplayer")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=8,
+                        help="requests in flight per connection")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds")
+    options = parser.parse_args(argv)
+
+    results = asyncio.run(load_test(options.host, options.port, options.clients,
+                                    options.depth, options.duration))
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+"""
+Tests of AsyncOMXPlayer against the fake omxplayer.
+"""
+
+import asyncio
+import unittest
+
+from ..asyncomxplayer import AsyncOMXPlayer
+from . import util
+
+
+SimulatedAsyncOMXPlayer = util.simulated_player_class(AsyncOMXPlayer, status_rate=50)
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+
+    async def test_start_stop(self):
+        p = await SimulatedAsyncOMXPlayer.start("bbb.mp4")
+        self.assertEqual(p.video['dimensions'], (640, 360))
+        self.assertEqual(p.audio['decoder'], "aac")
+        await p.stop()
+        self.assertTrue(p.finished)
+        self.assertTrue(await p.wait_finished(timeout=0))
+
+    async def test_statuses(self):
+        p = await SimulatedAsyncOMXPlayer.start("bbb.mp4")
+        positions = []
+        async for position in p:
+            positions.append(position)
+            if len(positions) == 5:
+                break
+        await p.stop()
+        self.assertEqual(positions, sorted(positions))
+        self.assertGreater(positions[-1], positions[0])
+
+    async def test_many_players(self):
+        players = await asyncio.gather(*[SimulatedAsyncOMXPlayer.start("bbb.mp4") for i in range(8)])
+        await asyncio.sleep(0.3)
+        for p in players:
+            self.assertGreater(p.position, 0)
+        await asyncio.gather(*[p.stop() for p in players])
+        self.assertTrue(all(p.finished for p in players))
+
+    async def test_seek(self):
+        p = await SimulatedAsyncOMXPlayer.start("bbb.mp4")
+        await p.seek(120)
+        async for position in p:
+            break
+        self.assertGreaterEqual(position, 120)
+        await p.stop()
+
+    async def test_seek_while_iterating(self):
+        p = await SimulatedAsyncOMXPlayer.start("bbb.mp4")
+        positions = []
+
+        async def consume():
+            async for position in p:
+                positions.append(position)
+                if position > 120.5:
+                    break
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)
+        waiter = asyncio.ensure_future(p.wait_finished())
+        await p.seek(120)
+        await asyncio.wait_for(consumer, 3)
+        self.assertFalse(p.finished)
+        self.assertFalse(waiter.done())
+        self.assertGreater(positions[-1], 120)
+        await p.stop()
+        self.assertTrue(await waiter)
+
+    async def test_seek_keeps_state(self):
+        p = await SimulatedAsyncOMXPlayer.start("bbb.mp4")
+        await p.pause()
+        await p.set_volume(-6)
+        await p.set_speed(p.FAST_SPEED)
+        await p.seek(120)
+        self.assertTrue(p._paused)
+        self.assertFalse(p._subtitles_visible)
+        self.assertEqual(p._volume, -6)
+        self.assertEqual(p._speed, p.FAST_SPEED)
+        # Paused, so the position stays put at the new offset.
+        position = p.position
+        await asyncio.sleep(0.3)
+        self.assertAlmostEqual(p.position, position, delta=0.1)
+        await p.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
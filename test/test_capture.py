@@ -0,0 +1,187 @@
+"""
+Tests of the output capture ring and of players capturing into it.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from contextlib import redirect_stdout
+
+from ..capture import (EVENT, OUTPUT, CaptureDirectory, CaptureError, OutputCapture, dump,
+                       main, read_capture)
+from ..pyomxplayer import StartupTimeoutError
+from . import util
+
+
+class TestRing(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, "a.ring")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_round_trip(self):
+        capture = OutputCapture(self.path, 4096)
+        capture.event("launching omxplayer")
+        capture.write(b"M: 1000 V: 6\r")
+        capture.write(bytearray(b"M: 2000 V: 6\r"))
+        records = read_capture(self.path)
+        self.assertEqual([(kind, data) for t, kind, data in records],
+                         [(EVENT, b"launching omxplayer"), (OUTPUT, b"M: 1000 V: 6\r"),
+                          (OUTPUT, b"M: 2000 V: 6\r")])
+        self.assertLess(abs(records[-1][0] - time.time()), 5)
+
+    def test_wraps_around(self):
+        capture = OutputCapture(self.path, 1024)
+        for i in range(1000):
+            capture.write(b"line %d\r" % i)
+        records = read_capture(self.path)
+        lines = [data for t, kind, data in records]
+        self.assertEqual(lines[-1], b"line 999\r")
+        first = int(lines[0][5:-1])
+        self.assertEqual(lines, [b"line %d\r" % i for i in range(first, 1000)])
+        self.assertGreater(len(lines), 20)
+        self.assertEqual(os.path.getsize(self.path), 1024 + 24)
+
+    def test_splits_large_writes(self):
+        capture = OutputCapture(self.path, 1024)
+        capture.write(b"x" * 600)
+        self.assertEqual(b"".join(data for t, kind, data in read_capture(self.path)), b"x" * 600)
+
+    def test_last_seconds(self):
+        capture = OutputCapture(self.path, 4096)
+        capture.write(b"old\n")
+        time.sleep(0.2)
+        capture.write(b"new\n")
+        self.assertEqual([data for t, kind, data in read_capture(self.path, seconds=0.1)],
+                         [b"new\n"])
+
+    def test_not_a_capture(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 100)
+        with self.assertRaises(CaptureError):
+            read_capture(self.path)
+        with self.assertRaises(CaptureError):
+            read_capture(os.path.join(self.scratch, "missing.ring"))
+
+    def test_closed_drops_writes(self):
+        capture = OutputCapture(self.path, 4096)
+        capture.write(b"M: 1000\r")
+        capture.close()
+        self.assertTrue(capture.closed)
+        capture.write(b"M: 2000\r")
+        capture.close()
+        self.assertEqual([data for t, kind, data in read_capture(self.path)], [b"M: 1000\r"])
+
+    def test_dump(self):
+        capture = OutputCapture(self.path, 4096)
+        capture.event("launching")
+        capture.write(b"M: 1000\rM: 2000\r\nhave a nice day ;)\n")
+        out = io.StringIO()
+        dump(read_capture(self.path), out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split(" ", 1)[1] for line in lines],
+                         ["event: launching", "M: 1000", "M: 2000", "have a nice day ;)"])
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(main([self.path, "--seconds", "60"]), 0)
+        self.assertEqual(out.getvalue().splitlines(), lines)
+
+
+class TestDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def rings(self):
+        return sorted(name for name in os.listdir(self.scratch) if name.endswith(".ring"))
+
+    def test_keeps_max_files(self):
+        directory = CaptureDirectory(self.scratch, 4096, max_files=3)
+        captures = []
+        for i in range(5):
+            capture = directory.open("bbb.mp4")
+            os.utime(capture.path, (i, i))
+            capture.close()
+            captures.append(os.path.basename(capture.path))
+        self.assertEqual(self.rings(), sorted(captures[2:]))
+
+    def test_keeps_open_captures(self):
+        directory = CaptureDirectory(self.scratch, 4096, max_files=2)
+        first = directory.open("bbb.mp4")
+        os.utime(first.path, (0, 0))
+        second = directory.open("bbb.mp4")
+        second.close()
+        third = directory.open("bbb.mp4")
+        self.assertEqual(self.rings(), sorted(os.path.basename(c.path) for c in (first, third)))
+        first.close()
+        third.close()
+
+    def test_drops_old_files(self):
+        directory = CaptureDirectory(self.scratch, 4096, max_files=None, max_age=60)
+        old = directory.open("bbb.mp4")
+        old.close()
+        os.utime(old.path, (time.time() - 120,) * 2)
+        recent = directory.open("bbb.mp4")
+        recent.close()
+        directory.open("bbb.mp4").close()
+        self.assertNotIn(os.path.basename(old.path), self.rings())
+        self.assertIn(os.path.basename(recent.path), self.rings())
+
+
+class TestPlayer(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_player_captures_output(self):
+        Player = util.simulated_player_class(status_rate=50)
+        Player.output_capture = CaptureDirectory(self.scratch, 1 << 16)
+        player = Player("bbb.mp4")
+        try:
+            player.wait_for_position(1)
+            player.seek(0, method='restart')
+            player.wait_for_position(1)
+        finally:
+            player.stop()
+        player.wait_finished(2)
+
+        records = read_capture(player.capture.path)
+        events = [data for t, kind, data in records if kind == EVENT]
+        self.assertEqual(events[0], b"capturing bbb.mp4")
+        self.assertEqual(len([e for e in events if e.startswith(b"launching")]), 2)
+        self.assertEqual(events[-1], b"omxplayer finished")
+        output = b"".join(data for t, kind, data in records if kind == OUTPUT)
+        self.assertIn(b"Video codec omx-h264", output)
+        self.assertIn(b"M:", output)
+        self.assertIn(b"have a nice day", output)
+        self.assertTrue(player.capture.closed)
+
+    def test_failed_launch_closes_capture(self):
+        Player = util.simulated_player_class(startup_delay=5)
+        opened = []
+        class Directory(CaptureDirectory):
+            def open(self, mediafile):
+                opened.append(super().open(mediafile))
+                return opened[-1]
+        Player.output_capture = Directory(self.scratch, 1 << 16)
+        with self.assertRaises(StartupTimeoutError):
+            Player("bbb.mp4", startup_timeout=0.1)
+        capture, = opened
+        self.assertTrue(capture.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
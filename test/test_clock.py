@@ -0,0 +1,92 @@
+"""
+Tests of the clocks, and of CommandQueue on a virtual clock.
+"""
+
+import time
+import unittest
+
+from threading import Condition, Thread
+
+from ..clock import Clock, VirtualClock
+from ..pyomxplayer import CommandQueue
+
+
+class TestVirtualClock(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(100.0)
+
+    def wait_for_timers(self, count=1):
+        # The threads are not known to the clock before their first wait.
+        while len([t for t in self.clock._timers if t[2] is not None]) < count:
+            time.sleep(0.001)
+        self.clock.settle()
+
+    def sleeper(self, seconds, woke):
+        def run():
+            self.clock.sleep(seconds)
+            woke.append((seconds, self.clock.monotonic()))
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_stands_still(self):
+        self.assertEqual(self.clock.monotonic(), 100.0)
+        self.clock.advance(2.5)
+        self.assertEqual(self.clock.monotonic(), 102.5)
+
+    def test_sleepers_wake_in_order_at_their_time(self):
+        woke = []
+        threads = [self.sleeper(seconds, woke) for seconds in (3, 1, 2)]
+        self.wait_for_timers(3)
+        self.clock.advance(1.5)
+        self.assertEqual(woke, [(1, 101.0)])
+        self.clock.advance(10)
+        for thread in threads:
+            thread.join(1)
+        self.assertEqual(woke, [(1, 101.0), (2, 102.0), (3, 103.0)])
+        self.assertEqual(self.clock.monotonic(), 111.5)
+
+    def test_wait_for(self):
+        condition = Condition()
+        state = []
+        with condition:
+            self.assertFalse(self.clock.wait_for(condition, lambda: state, 0))
+        results = []
+
+        def run():
+            with condition:
+                results.append(self.clock.wait_for(condition, lambda: state, 5))
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.wait_for_timers()
+        with condition:
+            state.append(1)
+            self.clock.notify(condition)
+        thread.join(1)
+        self.assertEqual(results, [[1]])
+        self.assertEqual(self.clock.monotonic(), 100.0)
+
+    def test_command_queue_writes_after_a_virtual_tick(self):
+        writes = []
+        queue = CommandQueue(lambda data: writes.append((data, self.clock.monotonic())),
+                             0.005, {}, clock=self.clock)
+        self.addCleanup(queue.close)
+        queue.push('+', 3)
+        self.wait_for_timers()
+        self.clock.advance(0.004)
+        self.assertEqual(writes, [])
+        self.clock.advance(0.001)
+        self.assertEqual(writes, [(b"+++", 100.005)])
+
+    def test_real_clock(self):
+        condition = Condition()
+        with condition:
+            self.assertFalse(Clock().wait(condition, 0.001))
+            self.assertTrue(Clock().wait_for(condition, lambda: True, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
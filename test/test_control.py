@@ -0,0 +1,103 @@
+"""
+Tests of ControlServer and ControlClient against the fake omxplayer.
+"""
+
+import asyncio
+import json
+import unittest
+
+from ..asyncomxplayer import AsyncOMXPlayer
+from ..control import ControlClient, ControlError, ControlServer
+from . import util
+
+
+SimulatedAsyncOMXPlayer = util.simulated_player_class(AsyncOMXPlayer, status_rate=50)
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = ControlServer(player_class=SimulatedAsyncOMXPlayer)
+        port = await self.server.start()
+        self.client = await ControlClient.connect(port=port)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    async def test_commands(self):
+        call = self.client.call
+        opened = await call('open', mediafile="bbb.mp4")
+        self.assertEqual(opened['video']['dimensions'], [640, 360])
+        player = opened['player']
+        self.assertEqual(await call('players'), [player])
+        await call('set_volume', player=player, volume=-6)
+        await call('set_speed', player=player, speed=2)
+        await call('pause', player=player)
+        status = await call('status', player=player)
+        self.assertEqual((status['volume'], status['speed'], status['paused']), (-6, 2, True))
+        await call('seek', player=player, offset=120)
+        self.assertGreaterEqual((await call('status', player=player))['position'], 120)
+        await call('stop', player=player)
+        self.assertEqual(await call('players'), [])
+
+    async def test_pipelined(self):
+        player = (await self.client.call('open', mediafile="bbb.mp4"))['player']
+        futures = [self.client.send('set_volume', player=player, volume=-3 * (i % 2))
+                   for i in range(50)]
+        futures.append(self.client.send('status', player=player))
+        results = await asyncio.gather(*futures)
+        self.assertEqual(results[-1]['volume'], -3)
+
+    async def test_errors(self):
+        with self.assertRaisesRegex(ControlError, "unknown op"):
+            await self.client.call('rewind')
+        with self.assertRaisesRegex(ControlError, "unknown player"):
+            await self.client.call('play', player="nope")
+        player = (await self.client.call('open', mediafile="bbb.mp4"))['player']
+        with self.assertRaisesRegex(ControlError, "unsupported speed"):
+            await self.client.call('set_speed', player=player, speed=7)
+        # The connection survives errors.
+        self.assertEqual(await self.client.call('players'), [player])
+
+    async def test_malformed_line(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        writer.write(b"not json\n[]\n")
+        for i in range(2):
+            response = json.loads(await reader.readline())
+            self.assertIsNone(response['id'])
+            self.assertIn('error', response)
+        writer.close()
+
+    async def test_subscribe(self):
+        player = (await self.client.call('open', mediafile="bbb.mp4"))['player']
+        positions = []
+        async for event in self.client.subscribe(player):
+            positions.append(event['position'])
+            if len(positions) == 5:
+                break
+        self.assertEqual(positions, sorted(positions))
+        self.assertGreater(positions[-1], positions[0])
+
+    async def test_subscribe_until_finished(self):
+        player = (await self.client.call('open', mediafile="bbb.mp4"))['player']
+        events = []
+
+        async def consume():
+            async for event in self.client.subscribe(player):
+                events.append(event)
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)
+        await self.client.call('stop', player=player)
+        await asyncio.wait_for(consumer, 5)
+        self.assertTrue(events)
+
+    async def test_players_outlive_connection(self):
+        player = (await self.client.call('open', mediafile="bbb.mp4"))['player']
+        await self.client.close()
+        self.client = await ControlClient.connect(port=self.server.port)
+        self.assertEqual(await self.client.call('players'), [player])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Tests of the keyframe index and of keyframe-aware restart seeks.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..keyframes import KeyframeCache, KeyframeIndex, build_index
+from . import util
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def path(self, name):
+        return os.path.join(self.scratch, name)
+
+    def test_mp4(self):
+        util.write_mp4(self.path("a.mp4"), 60, keyframe_interval=2.0, mdat_size=1 << 20)
+        index = build_index(self.path("a.mp4"))
+        self.assertEqual(list(index.times), [2.0 * i for i in range(30)])
+
+    def test_mkv(self):
+        util.write_mkv(self.path("a.mkv"), 60, keyframe_interval=2.5, cluster_size=1 << 20)
+        index = build_index(self.path("a.mkv"))
+        self.assertEqual(list(index.times), [2.5 * i for i in range(24)])
+
+    def test_unsupported(self):
+        with open(self.path("a.txt"), "wb") as f:
+            f.write(b"not a media file")
+        self.assertIsNone(build_index(self.path("a.txt")))
+        with open(self.path("b.mp4"), "wb") as f:
+            f.write(b"\0\0\0\x20moov" + b"\0" * 8)
+        self.assertIsNone(build_index(self.path("b.mp4")))
+
+    def test_nearest_and_before(self):
+        index = KeyframeIndex([4.0, 0.0, 2.0])
+        self.assertEqual(index.nearest(2.9), 2.0)
+        self.assertEqual(index.nearest(3.1), 4.0)
+        self.assertEqual(index.nearest(-1), 0.0)
+        self.assertEqual(index.nearest(100), 4.0)
+        self.assertEqual(index.before(3.9), 2.0)
+        self.assertIsNone(index.before(-1))
+        self.assertEqual(index.size, 24)
+
+    def test_cache(self):
+        util.write_mp4(self.path("a.mp4"), 60)
+        cache = KeyframeCache(self.path("cache"))
+        index = cache.get(self.path("a.mp4"))
+        self.assertEqual(list(KeyframeCache(cache.directory).get(self.path("a.mp4")).times),
+                         list(index.times))
+        self.assertEqual(cache.stats(), dict(hits=0, misses=1))
+
+        util.write_mp4(self.path("a.mp4"), 30)
+        self.assertEqual(len(cache.get(self.path("a.mp4"))), 15)
+        self.assertEqual(cache.stats(), dict(hits=0, misses=2))
+        self.assertIsNone(cache.get("http://example.com/a.mp4"))
+
+
+class TestKeyframeSeek(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.mediafile = os.path.join(self.scratch, "bbb.mp4")
+        util.write_mp4(self.mediafile, 600, keyframe_interval=2.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def player(self, keyframe_cache):
+        Player = util.simulated_player_class(status_rate=50, keyframe_interval=2.0)
+        Player.keyframe_cache = keyframe_cache
+        player = Player(self.mediafile)
+        self.addCleanup(player.stop)
+        return player
+
+    def test_lands_on_expected_keyframe(self):
+        player = self.player(KeyframeCache(os.path.join(self.scratch, "cache")))
+        result = player.seek(95.7, method='restart')
+        self.assertEqual(result['expected'], 96.0)
+        self.assertLess(abs(player.position - result['expected']), 0.1)
+
+    def test_without_index(self):
+        player = self.player(None)
+        result = player.seek(95.7, method='restart')
+        self.assertIsNone(result['expected'])
+        self.assertLess(player.position, 95)
+
+
+if __name__ == "__main__":
+    unittest.main()
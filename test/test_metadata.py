@@ -0,0 +1,102 @@
+"""
+Tests of MetadataCache and probe against the fake omxplayer.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..metadata import MetadataCache, probe
+from ..pyomxplayer import OMXPlayer
+from . import util
+
+
+SimulatedOMXPlayer = util.simulated_player_class(status_rate=50)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.cache = MetadataCache(os.path.join(self.scratch, "metadata.sqlite"))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.scratch)
+
+    def media(self, name, content=b"x"):
+        path = os.path.join(self.scratch, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_probe_caches(self):
+        path = self.media("bbb.mp4")
+        launched = []
+        class Probed(SimulatedOMXPlayer):
+            def _launch(self, args):
+                launched.append(args)
+                super()._launch(args)
+        info = probe(path, cache=self.cache, player_class=Probed)
+        # Invisible, muted and without switching the display mode.
+        self.assertEqual(launched, [["--alpha=0", "--vol=-6000", "--no-osd"]])
+        self.assertEqual(info['video']['dimensions'], (640, 360))
+        self.assertEqual(info['audio']['channels'], 2)
+
+        class Unplayable(OMXPlayer):
+            def __init__(self, *args, **kwargs):
+                raise AssertionError("probe spawned omxplayer for a cached file")
+        self.assertEqual(probe(path, cache=self.cache, player_class=Unplayable), info)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_persistent(self):
+        path = self.media("bbb.mp4")
+        probe(path, cache=self.cache, player_class=SimulatedOMXPlayer)
+        self.cache.close()
+        self.cache = MetadataCache(self.cache.path)
+        self.assertEqual(self.cache.get(path)['video']['decoder'], "omx-h264")
+
+    def test_changed_file_is_stale(self):
+        path = self.media("bbb.mp4")
+        self.cache.store(path, dict(video={}, audio={}, chapters=0, subtitles=0))
+        self.media("bbb.mp4", b"longer")
+        self.assertIsNone(self.cache.get(path))
+
+    def test_url_ttl(self):
+        url = "http://example.com/bbb.mp4"
+        self.cache.store(url, dict(video={}, audio={}, chapters=0, subtitles=0))
+        self.assertIsNotNone(self.cache.get(url))
+        self.cache.url_ttl = 0
+        self.assertIsNone(self.cache.get(url))
+
+    def test_lru_eviction(self):
+        self.cache.max_entries = 2
+        paths = [self.media("%d.mp4" % i) for i in range(3)]
+        info = dict(video={}, audio={}, chapters=0, subtitles=0)
+        self.cache.store(paths[0], info)
+        self.cache.store(paths[1], info)
+        self.cache.get(paths[0])
+        self.cache.store(paths[2], info)
+        self.assertIsNotNone(self.cache.get(paths[0]))
+        self.assertIsNone(self.cache.get(paths[1]))
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+    def test_player_fills_cache(self):
+        path = self.media("bbb.mp4")
+
+        class CachingPlayer(SimulatedOMXPlayer):
+            metadata_cache = self.cache
+        CachingPlayer(path).stop()
+        self.assertEqual(self.cache.get(path)['audio']['decoder'], "aac")
+
+    def test_warm(self):
+        paths = [self.media("%d.mp4" % i) for i in range(4)]
+        self.media("notes.txt")
+        results = self.cache.warm(self.scratch, workers=4, player_class=SimulatedOMXPlayer)
+        self.assertEqual(sorted(results), paths)
+        self.assertEqual(self.cache.stats()['entries'], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests of the metrics module and of what players report to it.
+"""
+
+import time
+import unittest
+
+from contextlib import contextmanager
+from urllib.request import urlopen
+
+from ..metrics import Metrics, PrometheusExporter
+from ..pyomxplayer import OMXPlayer
+from . import util
+
+
+class TestPrometheusExporter(unittest.TestCase):
+
+    def test_render(self):
+        exporter = PrometheusExporter(buckets=(0.1, 1.0))
+        metrics = Metrics(exporter)
+        metrics.increment('omxplayer_restarts_total')
+        metrics.increment('omxplayer_restarts_total', 2)
+        metrics.observe('omxplayer_seek_seconds', 0.5, method='keys')
+        metrics.observe('omxplayer_seek_seconds', 2.0, method='keys')
+        text = exporter.render()
+        self.assertIn("# TYPE omxplayer_restarts_total counter\n"
+                      "omxplayer_restarts_total 3\n", text)
+        self.assertIn("# TYPE omxplayer_seek_seconds histogram\n", text)
+        self.assertIn('omxplayer_seek_seconds_bucket{method="keys",le="0.1"} 0\n'
+                      'omxplayer_seek_seconds_bucket{method="keys",le="1.0"} 1\n'
+                      'omxplayer_seek_seconds_bucket{method="keys",le="+Inf"} 2\n'
+                      'omxplayer_seek_seconds_count{method="keys"} 2\n'
+                      'omxplayer_seek_seconds_sum{method="keys"} 2.5\n', text)
+        self.assertEqual(exporter.value('omxplayer_seek_seconds', method='keys'), (2, 2.5))
+
+    def test_serve(self):
+        exporter = PrometheusExporter()
+        Metrics(exporter).increment('omxplayer_status_lines_total', 7)
+        port = exporter.serve(0, "127.0.0.1")
+        try:
+            body = urlopen("http://127.0.0.1:%d/metrics" % port, timeout=5).read().decode()
+        finally:
+            exporter.close()
+        self.assertIn("omxplayer_status_lines_total 7\n", body)
+
+
+class TestPlayerMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.exporter = PrometheusExporter()
+        self.spans = []
+
+        @contextmanager
+        def span_hook(name, attributes):
+            self.spans.append((name, attributes))
+            yield
+
+        Player = util.simulated_player_class(status_rate=50, duration=3600)
+        Player.metrics = Metrics(self.exporter, span_hook=span_hook)
+        self.player = Player("bbb.mp4")
+
+    def tearDown(self):
+        self.player.stop()
+
+    def test_reported(self):
+        p = self.player
+        self.assertEqual(p.set_volume(-3).result(2), -3)
+        for i in range(12):
+            p.wait_for_position(1)
+        p.seek(95, method='restart')
+        p.stop()
+        value = self.exporter.value
+        self.assertEqual(value('omxplayer_startup_seconds')[0], 2)
+        self.assertGreaterEqual(value('omxplayer_command_latency_seconds')[0], 2)
+        self.assertGreater(value('omxplayer_status_lines_total'), 10)
+        self.assertGreater(value('omxplayer_position_staleness_seconds')[0], 10)
+        self.assertEqual(value('omxplayer_seek_seconds', method='restart')[0], 1)
+        self.assertLess(value('omxplayer_seek_error_seconds')[1], 1)
+        self.assertEqual(value('omxplayer_restarts_total'), 1)
+        self.assertEqual(value('omxplayer_stop_seconds')[0], 2)
+        self.assertEqual([name for name, _ in self.spans],
+                         ['omxplayer.start', 'omxplayer.seek', 'omxplayer.stop',
+                          'omxplayer.stop'])
+        self.assertEqual(self.spans[1][1], dict(mediafile="bbb.mp4", offset=95))
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(OMXPlayer.metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
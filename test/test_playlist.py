@@ -0,0 +1,74 @@
+"""
+Tests of Playlist against the fake omxplayer.
+"""
+
+import time
+import unittest
+
+from ..playlist import Playlist
+from . import util
+
+
+ShortOMXPlayer = util.simulated_player_class(status_rate=50, duration=2)
+
+
+class Test(unittest.TestCase):
+
+    def wait_preloaded(self, playlist, timeout=5):
+        deadline = time.monotonic() + timeout
+        while playlist._next is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_gapless(self):
+        playlist = Playlist(["a.mp4", "b.mp4", "c.mp4"], player_class=ShortOMXPlayer,
+                            preroll=1.5)
+        playlist.play()
+        try:
+            self.assertTrue(playlist.wait_finished(timeout=15))
+        finally:
+            playlist.stop()
+        self.assertEqual([t['mediafile'] for t in playlist.transitions], ["b.mp4", "c.mp4"])
+        for transition in playlist.transitions:
+            self.assertTrue(transition['preloaded'])
+            self.assertLess(abs(transition['gap']), 0.2)
+
+    def test_insert_next_keeps_preloaded(self):
+        playlist = Playlist(["a.mp4", "b.mp4", "c.mp4"], player_class=ShortOMXPlayer,
+                            preroll=1.9)
+        playlist.play()
+        try:
+            self.wait_preloaded(playlist)
+            preloaded = playlist._next
+            playlist.insert_next("x.mp4")
+            self.assertEqual(playlist.upcoming(), ["b.mp4", "x.mp4", "c.mp4"])
+            self.assertIs(playlist._next, preloaded)
+        finally:
+            playlist.stop()
+
+    def test_loop(self):
+        playlist = Playlist(["a.mp4"], player_class=ShortOMXPlayer, preroll=1.5, loop=True)
+        playlist.play()
+        try:
+            deadline = time.monotonic() + 5
+            while not playlist.transitions and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(playlist.finished)
+            self.assertEqual([t['mediafile'] for t in playlist.transitions], ["a.mp4"])
+        finally:
+            playlist.stop()
+        self.assertTrue(playlist.finished)
+
+    def test_shuffle(self):
+        items = ["%d.mp4" % i for i in range(20)]
+        playlist = Playlist(items, player_class=ShortOMXPlayer, shuffle=True)
+        playlist.play()
+        try:
+            order = [playlist.current.mediafile] + playlist.upcoming()
+        finally:
+            playlist.stop()
+        self.assertEqual(sorted(order), sorted(items))
+        self.assertNotEqual(order, items)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests of PlayerPool against the fake omxplayer.
+"""
+
+import time
+import unittest
+
+from ..pool import PlayerPool
+from . import util
+
+
+SimulatedOMXPlayer = util.simulated_player_class(status_rate=50)
+
+
+class Test(unittest.TestCase):
+
+    def wait_stat(self, pool, name, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while pool.stats()[name] < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def wait_ready(self, pool, count, timeout=5):
+        self.wait_stat(pool, 'ready', count, timeout)
+
+    def test_hit_and_miss(self):
+        pool = PlayerPool(size=2, player_class=SimulatedOMXPlayer)
+        try:
+            pool.prepare("a.mp4", "b.mp4")
+            self.wait_ready(pool, 2)
+            player = pool.acquire("a.mp4")
+            self.assertFalse(player._paused)
+            player.stop()
+            pool.acquire("c.mp4").stop()
+            stats = pool.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+            self.assertEqual(stats['hit_rate'], 0.5)
+        finally:
+            pool.close()
+
+    def test_ready_players_are_paused(self):
+        pool = PlayerPool(size=1, player_class=SimulatedOMXPlayer)
+        try:
+            pool.prepare("a.mp4")
+            self.wait_ready(pool, 1)
+            time.sleep(0.2)
+            player = pool.acquire("a.mp4")
+            self.assertLess(player.position, 0.2)
+            player.stop()
+        finally:
+            pool.close()
+
+    def test_idle_eviction(self):
+        pool = PlayerPool(size=1, player_class=SimulatedOMXPlayer, idle_timeout=0.1)
+        pool._CHECK_INTERVAL = 0.05
+        try:
+            pool.prepare("a.mp4")
+            self.wait_ready(pool, 1)
+            self.wait_stat(pool, 'evicted', 1)
+            stats = pool.stats()
+            self.assertEqual(stats['ready'], 0)
+            self.assertEqual(stats['evicted'], 1)
+        finally:
+            pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
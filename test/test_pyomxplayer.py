@@ -1,68 +1,100 @@
 """
 Unit tests for the pyomxplayer module.
 
-Tests can be run with unittest or nosetests,
+They run against the in-process simulation on a virtual clock (see
+virtualomxplayer), so minutes of playback take a fraction of a second and
+timings are exact. Tests can be run with unittest or nosetests,
 
-- `python -m unittest --verbose --failfast pyomxplayer.test.pyomxplayer`
+- `python -m unittest --verbose --failfast pyomxplayer.test.test_pyomxplayer`
 - `nosetests pyomxplayer.test.test_pyomxplayer:Test.test_play_stop_local_video`
 """
 
 import unittest
-from unittest import skip
-import time
 import logging
 
-from ..pyomxplayer import OMXPlayer
-import util
+from ..pyomxplayer import CommandTimeoutError, OMXPlayer
+from . import util
+from .virtualomxplayer import Simulation
 
 logging.basicConfig(format="%(asctime)s - %(message)s",datefmt="%H:%M:%S",level=logging.INFO)
 log = logging.getLogger(__name__)
 
 class Test(unittest.TestCase):
 
-    # Timings
-    
+    # Timings, in virtual seconds.
+
     very_short_sleep = 1
     short_sleep = 5
     long_sleep = 30
 
-    stop_treshold = 2 # Maximum time allowed between calling stop and the OMXPlayer process being terminated. 
+    startup_delay = 1.5 # How long the simulated omxplayer takes to print its headers.
+    seek_delay = 0.2 # How long a simulated key seek takes to show up.
 
-    # YouTube Video web urls.
+    # Stream urls, as youtube-dl would resolve them.
     web_urls = [
-        util.BBB_YOUTUBE_WEB_URL,
-        util.ED_YOUTUBE_WEB_URL,
-        util.S_YOUTUBE_WEB_URL,
-        util.TOS_YOUTUBE_WEB_URL
+        "https://cdn.example.com/bbb/best.mp4",
+        "https://cdn.example.com/ed/best.mp4",
+        "https://cdn.example.com/s/best.mp4",
+        "https://cdn.example.com/tos/best.mp4",
     ]
 
-    @skip("")
+    def setUp(self):
+        self.simulation = Simulation()
+        self.Player = self.simulation.player_class(
+            duration=3600, status_rate=25, startup_delay=self.startup_delay,
+            seek_delay=self.seek_delay)
+        self.players = []
+
+    def start(self, mediafile):
+        p = self.simulation.call(self.Player, mediafile)
+        self.players.append(p)
+        return p
+
+    def sleep(self, seconds):
+        self.simulation.advance(seconds)
+
+    def acknowledge(self, future, limit=5):
+        """
+        Runs the simulation until `future` is done and returns how long that
+        took, in virtual seconds.
+        """
+        start = self.simulation.clock.monotonic()
+        while not future.done():
+            self.assertLess(self.simulation.clock.monotonic() - start, limit)
+            self.sleep(0.01)
+        return self.simulation.clock.monotonic() - start
+
+    def assertRunning(self, p):
+        self.assertTrue(p._process.isalive(), "OMXPlayer should be running.")
+        self.assertFalse(p.finished)
+
+    def assertStopped(self, p):
+        self.assertTrue(self.simulation.call(p.wait_finished, self.very_short_sleep))
+        self.assertFalse(p._process.isalive(), "OMXPlayer should not be running.")
+
     def test_play_stop_local_video(self):
         log.info("> test_play_stop_local_video")
-        p = OMXPlayer(util.BBB_FILE)
-        time.sleep(self.short_sleep)
-        self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+        p = self.start(util.BBB_FILE)
+        self.assertEqual(p.startup_time, self.startup_delay)
+        self.sleep(self.short_sleep)
+        self.assertRunning(p)
         p.stop()
-        time.sleep(self.stop_treshold)
-        self.assertFalse(util.is_omxplayer_running(),"OMXPlayer should not be running.")
+        self.assertStopped(p)
         log.info("< test_play_stop_local_video")
 
     def test_play_stop_youtube_video(self):
         """
         Tests playing and stopping YouTube videos.
-
-        Checks that video is stopped within acceptable theshold.
         """
 
         log.info("> test_play_stop_youtube_video")
 
         for video_web_url in self.web_urls:
-            p = OMXPlayer(util.get_best_youtube_streaming_url(video_web_url))
-            time.sleep(5)
-            self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+            p = self.start(video_web_url)
+            self.sleep(self.short_sleep)
+            self.assertRunning(p)
             p.stop()
-            time.sleep(self.stop_treshold)
-            self.assertFalse(util.is_omxplayer_running(),"OMXPlayer should not be running.")
+            self.assertStopped(p)
 
         log.info("< test_play_stop_youtube_video")
 
@@ -74,173 +106,211 @@ class Test(unittest.TestCase):
         log.info("> test_pause_youtube_video")
 
         for video_web_url in self.web_urls:
-            p = OMXPlayer(util.get_best_youtube_streaming_url(video_web_url))
-            time.sleep(self.short_sleep)
+            p = self.start(video_web_url)
+            self.sleep(self.short_sleep)
             p.toggle_pause()
-            time.sleep(self.very_short_sleep)
+            self.sleep(self.very_short_sleep)
+            self.assertTrue(p._process.model.paused)
+            paused_at = p.position
+            self.assertAlmostEqual(paused_at, self.short_sleep, delta=0.05)
+            self.sleep(self.very_short_sleep)
+            self.assertEqual(p.position, paused_at)
             p.toggle_pause()
-            time.sleep(self.short_sleep)
-            self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+            self.sleep(self.short_sleep)
+            self.assertRunning(p)
+            self.assertAlmostEqual(p.position, paused_at + self.short_sleep, delta=0.05)
 
         log.info("< test_pause_youtube_video")
 
-    @skip("")
+    def test_pause_is_acknowledged(self):
+        p = self.start(util.BBB_FILE)
+        self.sleep(self.short_sleep)
+
+        paused = p.pause()
+        # The key goes out after a tick; two status lines later the position
+        # has stood still.
+        self.assertLessEqual(self.acknowledge(paused), 0.1)
+        self.assertTrue(paused.result())
+        self.assertTrue(p._process.model.paused)
+        self.assertIs(p.pause().result(), True)
+
+        resumed = p.play()
+        self.assertLessEqual(self.acknowledge(resumed), 0.1)
+        self.assertFalse(resumed.result())
+        self.assertFalse(p._paused)
+
+    def test_superseded_pause_resolves_with_the_later_one(self):
+        p = self.start(util.BBB_FILE)
+        self.sleep(self.short_sleep)
+        paused = p.toggle_pause()
+        resumed = p.toggle_pause()
+        self.acknowledge(resumed)
+        self.assertTrue(paused.done())
+        self.assertFalse(paused.result())
+        self.assertFalse(p._process.model.paused)
+
+    def test_volume_is_acknowledged_by_the_echo(self):
+        p = self.start(util.BBB_FILE)
+        self.sleep(self.short_sleep)
+        volume = p.set_volume(-6)
+        self.acknowledge(volume)
+        self.assertEqual(volume.result(), -6)
+        self.assertEqual(p._volume, -6)
+        self.assertEqual(p.set_volume(-6).result(), -6)
+
+    def test_speed_is_acknowledged_and_reconciled(self):
+        p = self.start(util.BBB_FILE)
+        self.sleep(self.short_sleep)
+        speed = p.set_speed(OMXPlayer.FAST_SPEED)
+        self.acknowledge(speed)
+        self.assertEqual(speed.result(), OMXPlayer.FAST_SPEED)
+
+        # The simulated omxplayer goes no faster than 8x, so this speed never shows.
+        p.set_speed(OMXPlayer.VFAST_SPEED)
+        p.increase_speed()
+        too_fast = p.increase_speed()
+        self.assertGreaterEqual(self.acknowledge(too_fast), OMXPlayer._ACK_TIMEOUT)
+        with self.assertRaises(CommandTimeoutError):
+            too_fast.result()
+        self.assertEqual(p._speed, 3)
+        before = p.position
+        self.sleep(1)
+        self.assertAlmostEqual(p.position - before, 8, delta=0.05)
+
+    def test_command_times_out_without_output(self):
+        Player = self.simulation.player_class(duration=3600, status_rate=25,
+                                              startup_delay=self.startup_delay,
+                                              stall_after=self.short_sleep)
+        p = self.simulation.call(Player, util.BBB_FILE)
+        self.players.append(p)
+        self.sleep(self.short_sleep + self.startup_delay + 1)
+        # omxplayer prints nothing anymore; the deadline holds all the same.
+        paused = p.pause()
+        self.assertAlmostEqual(self.acknowledge(paused), OMXPlayer._ACK_TIMEOUT, delta=0.05)
+        with self.assertRaises(CommandTimeoutError):
+            paused.result()
+
     def test_interleaving_youtube_video(self):
         log.info("> test_interleaving_youtube_video")
-        
+
         for i in range(0,2):
-        
-            p1 = OMXPlayer(util.get_best_youtube_streaming_url(util.S_YOUTUBE_WER_URL))
-            time.sleep(self.short_sleep)
+
+            p1 = self.start(self.web_urls[2])
+            self.sleep(self.short_sleep)
             p1.stop()
-            p2 = OMXPlayer(util.get_best_youtube_streaming_url(util.TOS_YOUTUBE_WEB_URL))
-            time.sleep(self.short_sleep)
+            p2 = self.start(self.web_urls[3])
+            self.sleep(self.short_sleep)
             p2.stop()
-        
-        time.sleep(self.stop_treshold)
-        self.assertFalse(util.is_omxplayer_running(),"OMXPlayer should not be running.")
-        
+            self.assertStopped(p1)
+            self.assertStopped(p2)
+
         log.info("< test_interleaving_youtube_video")
 
     def test_change_volume(self):
 
-        p = OMXPlayer(util.get_best_youtube_streaming_url(util.BBB_YOUTUBE_WEB_URL))
+        p = self.start(self.web_urls[0])
 
-        time.sleep(5)
+        self.sleep(self.short_sleep)
 
         for i in range(0,24):
             log.info("increasing volume")
             p.increase_volume()
 
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, 12)
 
         for i in range(0,49):
             log.info("decreasing volume")
             p.decrease_volume()
 
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, -12.5)
 
         for i in range(0,74):
             log.info("increasing volume")
             p.increase_volume()
 
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, 24.5)
 
-        self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+        self.assertRunning(p)
 
     def test_set_volume(self):
 
-        p = OMXPlayer(util.get_best_youtube_streaming_url(util.BBB_YOUTUBE_WEB_URL))
+        p = self.start(self.web_urls[0])
 
-        time.sleep(5)
+        self.sleep(self.short_sleep)
 
         # Test increase
         log.info("20 dB")
         p.set_volume(20)
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, 20)
 
         # Test decrease
         log.info("-20 dB")
         p.set_volume(-20)
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, -20)
 
         # Test extreme case - setting to 0
         log.info("0 dB")
         p.set_volume(0)
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, 0)
 
         # Test extreme case - no change
         log.info("0 dB")
         p.set_volume(0)
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, 0)
 
         # Test extreme case - not a multiple of 0.5
         log.info("20.125 dB")
         p.set_volume(20.125)
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(p._process.model.volume, 20)
 
-        self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+        self.assertRunning(p)
 
     def test_change_speed(self):
 
-        p = OMXPlayer(util.get_best_youtube_streaming_url(util.BBB_YOUTUBE_WEB_URL))
+        p = self.start(self.web_urls[0])
 
-        time.sleep(5)
+        self.sleep(self.short_sleep)
 
-        # Test increase
-        log.info("increase by one")
-        p.increase_speed()
-        time.sleep(5)
+        # Four increases, then six decreases.
+        for change, speed in [(p.increase_speed, 1), (p.increase_speed, 2),
+                              (p.increase_speed, 3), (p.increase_speed, 3),
+                              (p.decrease_speed, 2), (p.decrease_speed, 1),
+                              (p.decrease_speed, 0), (p.decrease_speed, -1),
+                              (p.decrease_speed, -2), (p.decrease_speed, -3)]:
+            log.info("%s" % change.__name__)
+            before = p._process.model.position
+            change()
+            self.sleep(self.short_sleep)
+            self.assertEqual(p._process.model.speed, speed)
+            self.assertAlmostEqual(p._process.model.position - before,
+                                   self.short_sleep * 2.0 ** speed, delta=0.05)
 
-        # Test increase
-        log.info("increase by one")
-        p.increase_speed()
-        time.sleep(5)
-
-        # Test increase
-        log.info("increase by one")
-        p.increase_speed()
-        time.sleep(5)
-
-        # Test increase
-        log.info("increase by one")
-        p.increase_speed()
-        time.sleep(5)
-
-        # Test decrease
-        log.info("decrease by one")
-        p.decrease_speed()
-        time.sleep(5)
-
-        # Test decrease
-        log.info("decrease by one")
-        p.decrease_speed()
-        time.sleep(5)
-
-        # Test decrease
-        log.info("decrease by one")
-        p.decrease_speed()
-        time.sleep(5)
-
-        # Test decrease
-        log.info("decrease by one")
-        p.decrease_speed()
-        time.sleep(5)
-
-        # Test decrease
-        log.info("decrease by one")
-        p.decrease_speed()
-        time.sleep(5)
-
-        # Test decrease
-        log.info("decrease by one")
-        p.decrease_speed()
-        time.sleep(5)
-
-        self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+        self.assertRunning(p)
 
     def test_set_speed(self):
 
-        p = OMXPlayer(util.get_best_youtube_streaming_url(util.BBB_YOUTUBE_WEB_URL))
-
-        time.sleep(10)
+        p = self.start(self.web_urls[0])
 
-        log.info("fast")
-        p.set_speed(OMXPlayer.FAST_SPEED)
-        time.sleep(5)
+        self.sleep(self.short_sleep)
 
-        log.info("slow")
-        p.set_speed(OMXPlayer.SLOW_SPEED)
-        time.sleep(5)
-
-        log.info("normal")
-        p.set_speed(OMXPlayer.NORMAL_SPEED)
-        time.sleep(5)
-
-        # Extreme - making no change
-        log.info("normal")
-        p.set_speed(OMXPlayer.NORMAL_SPEED)
-        time.sleep(5)
+        for name, speed, rate in [("fast", OMXPlayer.FAST_SPEED, 2.0),
+                                  ("slow", OMXPlayer.SLOW_SPEED, 0.5),
+                                  ("normal", OMXPlayer.NORMAL_SPEED, 1.0),
+                                  # Extreme - making no change
+                                  ("normal", OMXPlayer.NORMAL_SPEED, 1.0)]:
+            log.info(name)
+            before = p.position
+            p.set_speed(speed)
+            self.sleep(self.short_sleep)
+            self.assertAlmostEqual(p.position - before, self.short_sleep * rate, delta=0.05)
 
         # Erroneous
         log.info("0.5")
@@ -252,113 +322,164 @@ class Test(unittest.TestCase):
         with self.assertRaises(AssertionError):
             p.set_speed("half")
 
-        time.sleep(5)
+        self.sleep(self.very_short_sleep)
 
-        self.assertTrue(util.is_omxplayer_running(),"OMXPlayer should be running.")
+        self.assertRunning(p)
 
     def test_seek_forward_backward(self):
 
-        p = OMXPlayer(util.BBB_FILE)
+        p = self.start(util.BBB_FILE)
 
-        time.sleep(10)
+        self.sleep(self.long_sleep)
+        self.assertAlmostEqual(p.position, 30, delta=0.05)
 
         log.info("forward 30s")
         p.seek_forward_30()
-        time.sleep(10)
+        self.sleep(self.long_sleep)
+        self.assertAlmostEqual(p.position, 90, delta=0.05)
 
         log.info("backward 30s")
         p.seek_backward_30()
-        time.sleep(10)
+        self.sleep(self.long_sleep)
+        self.assertAlmostEqual(p.position, 90, delta=0.05)
 
-    def test_calculate_num_30_seeks(self):
+    def test_calculate_num_seeks(self):
 
         # Going up from 10
 
-        seeks = OMXPlayer._calculate_num_30_seeks(10, 10)
-        self.assertEqual(seeks, 0)
-
-        seeks = OMXPlayer._calculate_num_30_seeks(10, 20)
-        self.assertEqual(seeks, 0)
-
-        seeks = OMXPlayer._calculate_num_30_seeks(10, 30)
-        self.assertEqual(seeks, 1)
-
-        seeks = OMXPlayer._calculate_num_30_seeks(10, 50)
-        self.assertEqual(seeks, 1)
-
-        seeks = OMXPlayer._calculate_num_30_seeks(10, 60)
-        self.assertEqual(seeks, 2)
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 10), (0, 0))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 20), (0, 0))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 30), (0, 1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 50), (0, 1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 60), (0, 2))
 
         # Going down from 70
 
-        seeks = OMXPlayer._calculate_num_30_seeks(70, 70)
-        self.assertEqual(seeks, 0)
+        self.assertEqual(OMXPlayer._calculate_num_seeks(70, 70), (0, 0))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(70, 60), (0, 0))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(70, 50), (0, -1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(70, 30), (0, -1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(70, 20), (0, -2))
+
+        # Far away, in 600s steps
+
+        self.assertEqual(OMXPlayer._calculate_num_seeks(0, 1230), (2, 1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(1230, 0), (-2, -1))
+
+    def test_calculate_stream_keys(self):
+        keys = OMXPlayer._calculate_stream_keys
+        self.assertEqual(keys(1, 1, 4), [])
+        self.assertEqual(keys(0, 3, 4), [(1, 3)])
+        self.assertEqual(keys(3, 1, 4), [(-1, 2)])
+
+        # From an unknown stream, via the nearer end.
+        self.assertEqual(keys(None, 0, 4), [(-1, 3)])
+        self.assertEqual(keys(None, 1, 4), [(-1, 3), (1, 1)])
+        self.assertEqual(keys(None, 2, 4), [(1, 3), (-1, 1)])
+        self.assertEqual(keys(None, 3, 4), [(1, 3)])
+        self.assertEqual(keys(None, 0, 1), [])
+
+    def test_switch_streams_and_chapters(self):
+        Player = self.simulation.player_class(
+            duration=600, status_rate=25, audio_streams=3, subtitle_streams=2, chapters=6)
+        p = self.simulation.call(Player, util.BBB_FILE)
+        self.players.append(p)
+        self.assertEqual((p.audio['streams'], p.subtitles, p.chapters), (3, 2, 6))
+        model = p._process.model
+
+        self.assertEqual(p.set_audiochannel(2).result(), 2)
+        p.set_subtitles(1)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual((model.audio_index, model.subtitle_index), (2, 1))
+        p.set_audiochannel(1)
+        self.sleep(self.very_short_sleep)
+        self.assertEqual(model.audio_index, 1)
+
+        # Chapters are 100s long here.
+        p.set_chapter(4)
+        self.sleep(self.very_short_sleep)
+        self.assertAlmostEqual(p.position, 401, delta=0.05)
+        p.set_chapter(1)
+        self.sleep(self.very_short_sleep)
+        self.assertAlmostEqual(p.position, 101, delta=0.05)
 
-        seeks = OMXPlayer._calculate_num_30_seeks(70, 60)
-        self.assertEqual(seeks, 0)
-
-        seeks = OMXPlayer._calculate_num_30_seeks(70, 50)
-        self.assertEqual(seeks, -1)
-
-        seeks = OMXPlayer._calculate_num_30_seeks(70, 30)
-        self.assertEqual(seeks, -1)
+        with self.assertRaises(AssertionError):
+            p.set_audiochannel(3)
 
-        seeks = OMXPlayer._calculate_num_30_seeks(70, 20)
-        self.assertEqual(seeks, -2)
+        # A restart starts at the first streams; the player switches back.
+        self.simulation.call(p.seek, 300, method='restart')
+        self.sleep(self.very_short_sleep)
+        model = p._process.model
+        self.assertEqual((model.audio_index, model.subtitle_index), (1, 1))
 
     def test_position(self):
 
-        p = OMXPlayer(util.BBB_FILE)
+        p = self.start(util.BBB_FILE)
 
-        time.sleep(10)
+        self.sleep(10)
 
         p1 = p.position
-        self.assertGreater(p1, 10)
-        self.assertLess(p1, 10+5)
+        self.assertAlmostEqual(p1, 10, delta=0.001)
 
-        time.sleep(5)
+        self.sleep(5)
 
         p2 = p.position
-        self.assertGreater(p2, 15)
-        self.assertLess(p2, 15+5)
+        self.assertAlmostEqual(p2, 15, delta=0.001)
 
-        self.assertGreater(p2, p1+4)
+        # Between status lines, the position is extrapolated.
+        self.sleep(0.02)
+        self.assertAlmostEqual(p.position, 15.02, delta=0.001)
 
     def test_seek(self):
 
-        p = OMXPlayer(util.BBB_FILE)
+        p = self.start(util.BBB_FILE)
 
-        time.sleep(10)
+        self.sleep(10)
 
         log.info("seek to 40, expect seek")
-        p.seek(40)
+        result = self.simulation.call(p.seek, 40)
+        self.assertEqual(result['method'], 'keys')
+        self.assertEqual(result['steps'], 1)
+        # One key seek: a tick in the command queue, the seek delay and the
+        # status line that shows it.
+        self.assertAlmostEqual(result['latency'], 0.24, delta=0.001)
+        self.assertLess(abs(result['error']), 1)
 
-        time.sleep(10)
+        self.sleep(10)
 
         log.info("seek to 60, expect no seek")
-        p.seek(60)
+        self.assertEqual(self.simulation.call(p.seek, 60)['method'], 'none')
 
-        time.sleep(10)
+        self.sleep(10)
 
         log.info("seek to 60, expect no seek")
-        p.seek(60)
+        self.assertEqual(self.simulation.call(p.seek, 60)['method'], 'none')
 
-        time.sleep(10)
+        self.sleep(10)
 
         log.info("seek to 50, expect seek")
-        p.seek(50)
-        
+        result = self.simulation.call(p.seek, 50)
+        self.assertEqual((result['method'], result['steps']), ('keys', 1))
+        # Key seeks move in 30s steps, so that is as close as they get.
+        self.assertAlmostEqual(p.position, 40.48, delta=0.001)
+
+        log.info("seek to 1900, expect restart")
+        result = self.simulation.call(p.seek, 1900)
+        self.assertEqual(result['method'], 'restart')
+        self.assertAlmostEqual(result['latency'], self.startup_delay, delta=0.1)
+        self.assertAlmostEqual(p.position, 1900, delta=0.1)
+
     def tearDown(self):
         """
-        Terminates any running OMXPlayer processes that are still running.
+        Stops the players that are still running.
 
         This is run after every test function.
         """
         log.info("> tearDown")
-        util.killOMXPlayer()
-        time.sleep(1)
+        for p in self.players:
+            p.stop()
         log.info("< tearDown")
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Tests of Resolver against the fake resolver and the fake omxplayer.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ..playlist import Playlist
+from ..resolver import Resolver, ResolverError
+from . import util
+
+PAGE_URL = "https://video.example.com/watch?v=bbb"
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.log = os.path.join(self.scratch, "resolver.log")
+        self.cache_path = os.path.join(self.scratch, "resolved.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def resolver(self, ttl=3600, **options):
+        command = util.fake_resolver_command(pattern=r"^https://video\.example\.com/",
+                                             log=self.log, **options)
+        resolver = Resolver([command], ttl=ttl, cache_path=self.cache_path)
+        self.addCleanup(resolver.close)
+        return resolver
+
+    def runs(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def test_resolve_and_cache(self):
+        resolver = self.resolver()
+        stream = resolver.resolve(PAGE_URL)
+        self.assertTrue(stream.startswith("https://cdn.example.com/"))
+        self.assertTrue(stream.endswith("/best.mp4"))
+        self.assertEqual(resolver.resolve(PAGE_URL), stream)
+        self.assertTrue(resolver.resolve(PAGE_URL, "18").endswith("/18.mp4"))
+        self.assertEqual(self.runs(), 2)
+        self.assertEqual(resolver.stats()['hits'], 1)
+
+    def test_persistent(self):
+        stream = self.resolver().resolve(PAGE_URL)
+        self.assertEqual(self.resolver().resolve(PAGE_URL), stream)
+        self.assertEqual(self.runs(), 1)
+
+    def test_ttl(self):
+        resolver = self.resolver(ttl=0.2)
+        resolver.resolve(PAGE_URL)
+        time.sleep(0.3)
+        resolver.resolve(PAGE_URL)
+        self.assertEqual(self.runs(), 2)
+        self.assertEqual(self.resolver(ttl=0.2).stats()['entries'], 1)
+
+    def test_passthrough(self):
+        resolver = self.resolver()
+        self.assertEqual(resolver.resolve("http://cdn.example.com/a.mp4"),
+                         "http://cdn.example.com/a.mp4")
+        self.assertEqual(resolver.resolve(self.log), self.log)
+        self.assertEqual(self.runs(), 0)
+
+    def test_deduplicated(self):
+        resolver = self.resolver(delay=0.3)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            streams = list(executor.map(lambda i: resolver.resolve(PAGE_URL), range(8)))
+        self.assertEqual(len(set(streams)), 1)
+        self.assertEqual(self.runs(), 1)
+        self.assertEqual(resolver.stats()['shared'], 7)
+
+    def test_error(self):
+        resolver = self.resolver()
+        with self.assertRaisesRegex(ResolverError, "private"):
+            resolver.resolve(PAGE_URL + "&private")
+        with self.assertRaises(ResolverError):
+            resolver.resolve(PAGE_URL + "&private")
+        # Failures are not cached.
+        self.assertEqual(self.runs(), 2)
+
+    def test_prefetch(self):
+        resolver = self.resolver(delay=0.2)
+        urls = [PAGE_URL + str(i) for i in range(4)]
+        start = time.monotonic()
+        futures = resolver.prefetch(urls)
+        streams = [future.result() for future in futures]
+        self.assertLess(time.monotonic() - start, 0.7)
+        self.assertEqual([resolver.resolve(url) for url in urls], streams)
+        self.assertEqual(self.runs(), 4)
+
+    def test_player(self):
+        resolver = self.resolver()
+
+        Player = util.simulated_player_class(status_rate=50)
+        Player.resolver = resolver
+        player = Player(PAGE_URL)
+        try:
+            player.seek(60, method='restart')
+            self.assertEqual(player.mediafile, PAGE_URL)
+            self.assertTrue(player._process.argv[-1].startswith("https://cdn.example.com/"))
+        finally:
+            player.stop()
+        self.assertEqual(self.runs(), 1)
+
+    def test_playlist_prefetch(self):
+        resolver = self.resolver()
+
+        Player = util.simulated_player_class(status_rate=50)
+        Player.resolver = resolver
+        urls = [PAGE_URL + str(i) for i in range(3)]
+        playlist = Playlist(urls, player_class=Player)
+        playlist.play()
+        try:
+            deadline = time.monotonic() + 5
+            while self.runs() < 3 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            playlist.stop()
+        self.assertEqual(self.runs(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
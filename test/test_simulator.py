@@ -0,0 +1,426 @@
+"""
+Tests of the pyomxplayer module against the fake omxplayer.
+
+These need no Raspberry Pi or network access,
+
+- `python -m unittest --verbose pyomxplayer.test.test_simulator`
+"""
+
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+from concurrent.futures import Future
+
+from ..pyomxplayer import (Capabilities, CommandQueue, HeaderParser, OMXPlayer,
+                           PositionSamples, StartupTimeoutError, StatusParser, stop_all)
+from . import util
+
+
+SimulatedOMXPlayer = util.simulated_player_class(status_rate=50, duration=3600)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.player = SimulatedOMXPlayer("bbb.mp4")
+
+    def tearDown(self):
+        self.player.stop()
+
+    def test_headers(self):
+        p = self.player
+        self.assertEqual(p.video['decoder'], "omx-h264")
+        self.assertEqual(p.video['dimensions'], (640, 360))
+        self.assertEqual(p.video['fps'], 24.0)
+        self.assertEqual(p.audio['decoder'], "aac")
+        self.assertEqual((p.audio['channels'], p.audio['rate'], p.audio['bps']), (2, 48000, 16))
+
+    def test_position(self):
+        time.sleep(0.5)
+        p1 = self.player.position
+        self.assertGreater(p1, 0.2)
+        time.sleep(0.5)
+        self.assertGreater(self.player.position, p1 + 0.3)
+
+    def test_wait_for_position(self):
+        p1 = self.player.wait_for_position(timeout=1)
+        p2 = self.player.wait_for_position(timeout=1)
+        self.assertIsNotNone(p1)
+        self.assertGreater(p2, p1)
+
+    def test_subscribe(self):
+        positions = []
+        finished = []
+        self.player.subscribe('position', positions.append)
+        self.player.subscribe('finished', lambda: finished.append(True))
+        for i in range(6):
+            self.player.wait_for_position(1)
+        self.player.stop()
+        self.assertTrue(self.player.wait_finished(timeout=2))
+        self.assertGreater(len(positions), 5)
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(finished, [True])
+
+    def test_seek_keys(self):
+        p = self.player
+        p._restart_cost = 100
+        pid = p._process.pid
+        result = p.seek(95)
+        self.assertEqual(result['method'], 'keys')
+        self.assertEqual(result['steps'], 3)
+        self.assertLess(abs(result['error']), 15)
+        self.assertEqual(p._process.pid, pid)
+
+    def test_seek_large(self):
+        p = self.player
+        p._restart_cost = 100
+        result = p.seek(570)
+        self.assertEqual(result['steps'], 2) # +600 -30
+        self.assertLess(abs(result['error']), 15)
+
+    def test_seek_restart(self):
+        p = self.player
+        p._key_seek_cost = 100
+        result = p.seek(95)
+        self.assertEqual(result['method'], 'restart')
+        self.assertLess(abs(result['error']), 1)
+        self.assertGreater(p.wait_for_position(timeout=1), 95)
+
+    def test_seek_tolerance(self):
+        p = self.player
+        p._restart_cost = 100
+        result = p.seek(80, tolerance=1)
+        self.assertEqual(result['method'], 'restart')
+        self.assertLess(abs(result['error']), 1)
+
+    def test_seek_restart_is_not_finished(self):
+        p = self.player
+        finished = []
+        p.subscribe('finished', lambda: finished.append(True))
+        result = p.seek(95, method='restart')
+        self.assertEqual(result['steps'], 0)
+        self.assertFalse(p.wait_finished(timeout=0.3))
+        self.assertEqual(finished, [])
+        p.stop()
+        self.assertTrue(p.wait_finished(timeout=2))
+        self.assertEqual(finished, [True])
+
+    def test_failed_seek_restart_finishes(self):
+        p = self.player
+        def launch(args):
+            raise StartupTimeoutError("no headers")
+        p._launch = launch
+        self.assertRaises(StartupTimeoutError, p.seek, 95, method='restart')
+        self.assertTrue(p.wait_finished(timeout=0))
+
+    def test_seek_restart_restores_state(self):
+        p = self.player
+        p.set_volume(-6)
+        p.set_speed(OMXPlayer.FAST_SPEED)
+        p.pause()
+        p.seek(95, method='restart')
+        self.assertEqual(p._volume, -6)
+        self.assertEqual(p._speed, OMXPlayer.FAST_SPEED)
+        self.assertTrue(p._paused)
+        self.assertFalse(p._subtitles_visible)
+
+    def test_seek_keys_fast_speed(self):
+        SlowSeekingPlayer = util.simulated_player_class(status_rate=10, seek_delay=0.5,
+                                                        duration=3600)
+        self.player.stop()
+        self.player = p = SlowSeekingPlayer("bbb.mp4")
+        # Make the fake play at 4x, which is what VFAST_SPEED stands for.
+        p._process.send(OMXPlayer._INCREASE_SPEED_CMD * 2)
+        p._speed = OMXPlayer.VFAST_SPEED
+        for i in range(2):
+            p.wait_for_position(1)
+        result = p.seek(p.position + 90, method='keys')
+        self.assertEqual(result['method'], 'keys')
+        self.assertEqual(result['steps'], 3)
+        self.assertLess(abs(result['error']), 15)
+
+    def test_seek_keys_fall_back_to_restart(self):
+        p = self.player
+        p._SEEK_STEP_TIMEOUT = 0.2
+        p.seek_forward_30 = Future # omxplayer ignores the key
+        result = p.seek(35, method='keys')
+        self.assertEqual(result['method'], 'restart')
+        self.assertEqual(result['steps'], 0)
+        self.assertLess(abs(result['error']), 1)
+
+    def test_calculate_num_seeks(self):
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 10), (0, 0))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(10, 30), (0, 1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(70, 30), (0, -1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(0, 570), (1, -1))
+        self.assertEqual(OMXPlayer._calculate_num_seeks(700, 0), (-1, -3))
+
+    def test_stop(self):
+        p = self.player
+        process, reader = p._process, p._position_thread
+        result = p.stop()
+        self.assertEqual((result['clean'], result['signal']), (True, None))
+        self.assertLess(result['latency'], 0.5)
+        self.assertEqual(process.exitstatus, 0)
+        self.assertFalse(reader.is_alive())
+        self.assertTrue(p.finished)
+        self.assertTrue(process.closed)
+        self.assertIs(p.stop(), result)
+
+    def test_stop_escalates(self):
+        Player = util.simulated_player_class(stall_after=0.01, ignore_sigterm=True)
+        Player._TERMINATE_TIMEOUT = 0.2
+        p = Player("bbb.mp4")
+        while p.wait_for_position(0.1) is not None:
+            pass # wedged from here on
+        start = time.monotonic()
+        result = p.stop(timeout=0.3)
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual((result['clean'], result['signal']), (False, signal.SIGKILL))
+        self.assertEqual(p._process.signalstatus, signal.SIGKILL)
+        self.assertFalse(p._position_thread.is_alive())
+
+    def test_stop_all(self):
+        players = [self.player] + [SimulatedOMXPlayer("bbb.mp4") for i in range(3)]
+        result = stop_all(players)
+        self.assertEqual(len(result['stops']), 4)
+        self.assertTrue(all(stop['clean'] for stop in result['stops']))
+        self.assertLess(result['latency'], 0.5)
+        self.assertFalse(any(p._process.isalive() for p in players))
+
+
+class TestHeaders(unittest.TestCase):
+
+    def launch(self, **options):
+        Player = util.simulated_player_class(**options)
+        return Player("bbb.mp4", startup_timeout=2)
+
+    def test_file_properties(self):
+        p = self.launch()
+        self.assertEqual((p.audio['streams'], p.video['streams']), (1, 1))
+        self.assertEqual((p.chapters, p.subtitles), (0, 0))
+        self.assertLess(p.startup_time, 2)
+        p.stop()
+
+    def test_audio_only(self):
+        p = self.launch(no_video=True)
+        self.assertEqual(p.video, {'streams': 0})
+        self.assertEqual(p.audio['decoder'], "aac")
+        self.assertIsNotNone(p.wait_for_position(timeout=1))
+        p.stop()
+
+    def test_video_only(self):
+        p = self.launch(no_audio=True)
+        self.assertEqual(p.audio, {'streams': 0})
+        self.assertEqual(p.video['decoder'], "omx-h264")
+        p.stop()
+
+    def test_startup_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(StartupTimeoutError):
+            self.launch(startup_delay=5)
+        self.assertLess(time.monotonic() - start, 3)
+
+    def test_parser_leftover(self):
+        parser = HeaderParser()
+        self.assertFalse(parser.feed(b"Video codec omx-h264 width 640 height 360 profile 100 fps 24.0\nAud"))
+        self.assertTrue(parser.feed(b"io codec aac channels 2 samplerate 48000 bitspersample 16\rM: 12"))
+        self.assertEqual(parser.audio['rate'], 48000)
+        self.assertEqual(parser.leftover, b"M: 12")
+
+
+class TestStatusParser(unittest.TestCase):
+
+    def parse(self, parser):
+        events = []
+        while True:
+            event = parser.next()
+            if event is None:
+                return events
+            events.append(event)
+
+    def test_split_lines(self):
+        parser = StatusParser(16)
+        parser.feed(b"Current Volume: -0.50dB\nM:  1500000 V: 6 Cv: 213k\rM:  25")
+        self.assertEqual(self.parse(parser), [StatusParser.VOLUME, 1.5])
+        self.assertEqual(parser.volume, -0.5)
+        parser.feed(b"00000 V: 6\r\nV :   3000000\r")
+        self.assertEqual(self.parse(parser), [2.5, 3.0])
+        self.assertEqual(parser.lines, 4)
+
+    def test_done(self):
+        parser = StatusParser()
+        parser.feed(b"M:  1000000 V: 6\r\nhave a nice day ;)\n")
+        self.assertEqual(self.parse(parser), [1.0, StatusParser.DONE])
+
+    def test_read(self):
+        r, w = os.pipe()
+        try:
+            parser = StatusParser(8)
+            os.write(w, b"M: 42000000 V: 6 Cv: 213k Ca: 4k                       \r")
+            while not parser.lines:
+                parser.read(r)
+                events = self.parse(parser)
+            self.assertEqual(events, [42.0])
+            os.close(w)
+            self.assertEqual(parser.read(r), 0)
+        finally:
+            os.close(r)
+
+
+class TestCommandQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.written = []
+        self.queue = CommandQueue(self.written.append, 0.05, OMXPlayer._OPPOSITE_CMDS)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_ramp_is_one_write(self):
+        self.queue.push('+', 40)
+        time.sleep(0.2)
+        self.assertEqual(self.queue.writes, 1)
+        self.assertEqual(self.written, [b'+' * 40])
+
+    def test_opposites_cancel(self):
+        self.queue.push('+')
+        self.queue.push('-')
+        time.sleep(0.2)
+        self.assertEqual(self.queue.writes, 0)
+        self.assertEqual(self.written, [])
+
+    def test_partial_cancel_keeps_order(self):
+        self.queue.push('+', 3)
+        self.queue.push('p')
+        self.queue.push('-', 2)
+        self.queue.flush()
+        self.assertEqual(self.written, [b'+p'])
+
+
+class TestKeystrokes(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.trace = os.path.join(self.scratch, "trace")
+
+        Player = util.simulated_player_class(status_rate=50, trace=self.trace)
+        self.player = Player("bbb.mp4")
+
+    def tearDown(self):
+        self.player.stop()
+        shutil.rmtree(self.scratch)
+
+    def received(self, action):
+        with open(self.trace) as f:
+            return sum(1 for line in f if '"action": "%s"' % action in line)
+
+    def test_set_volume_sends_every_step(self):
+        self.assertEqual(self.player.set_volume(-20).result(2), -20)
+        self.assertEqual(self.received("decrease_volume"), 40)
+        self.assertEqual(self.received("increase_volume"), 0)
+
+    def test_set_speed_sends_every_step(self):
+        self.assertEqual(self.player.set_speed(OMXPlayer.VFAST_SPEED).result(2),
+                         OMXPlayer.VFAST_SPEED)
+        self.assertEqual(self.received("increase_speed"), 2)
+
+
+class TestPositionExtrapolation(unittest.TestCase):
+
+    def setUp(self):
+        Player = util.simulated_player_class(status_rate=5)
+        self.player = Player("bbb.mp4")
+        self.player.wait_for_position(timeout=1)
+
+    def tearDown(self):
+        self.player.stop()
+
+    def test_no_stair_steps(self):
+        reads = []
+        for i in range(30):
+            reads.append(self.player.position)
+            time.sleep(0.01)
+        # Status lines come every 200ms, but every read moves on.
+        self.assertEqual(len(set(reads)), len(reads))
+        self.assertEqual(reads, sorted(reads))
+
+    def test_paused_does_not_advance(self):
+        self.assertTrue(self.player.pause().result(2))
+        p1 = self.player.position
+        time.sleep(0.1)
+        self.assertEqual(self.player.position, p1)
+
+    def test_tracks_media_clock(self):
+        time.sleep(0.3)
+        truth = self.player.wait_for_position(timeout=1)
+        self.assertLess(abs(self.player.position - truth), 0.05)
+
+    def test_stats(self):
+        time.sleep(1.1)
+        stats = self.player.position_stats()
+        self.assertGreaterEqual(stats['samples'], 5)
+        self.assertAlmostEqual(stats['interval']['mean'], 0.2, delta=0.05)
+        self.assertLess(abs(stats['jitter']['mean']), 0.05)
+        self.assertLess(abs(stats['drift']), 0.1)
+
+    def test_ring_buffer(self):
+        samples = PositionSamples(3)
+        for i in range(5):
+            samples.add(i, i * 2.0, 1.0)
+        self.assertEqual(samples.samples(), [(2, 4, 1), (3, 6, 1), (4, 8, 1)])
+        stats = samples.stats(jump_threshold=5)
+        self.assertAlmostEqual(stats['drift'], 1.0)
+        self.assertAlmostEqual(stats['jitter']['stdev'], 0.0)
+
+
+class TestCapabilities(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.scratch, "capabilities.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def capabilities(self):
+        return Capabilities(util.FAKE_OMXPLAYER, self.cache_path)
+
+    def test_probe(self):
+        c = self.capabilities()
+        self.assertTrue(c.available)
+        self.assertEqual(c.version, "0.3.7")
+        self.assertTrue(c.supports("-l"))
+        self.assertTrue(c.supports(" --status-rate "))
+        self.assertFalse(c.supports("--no-such-option"))
+
+    def test_cached_on_disk(self):
+        self.assertIn("-l", self.capabilities().options)
+        c = self.capabilities()
+        c._probe = None # a cache hit must not run omxplayer
+        self.assertIn("-l", c.options)
+
+    def test_invalidate(self):
+        c = self.capabilities()
+        self.assertIn("-l", c.options)
+        c.invalidate()
+        self.assertEqual(c._read_cache(), {})
+        self.assertIn("-l", c.options)
+
+    def test_stale_entry(self):
+        c = self.capabilities()
+        c._write_cache({util.FAKE_OMXPLAYER: dict(key=[0, 0], options=[], version="0.1")})
+        self.assertEqual(c.version, "0.3.7")
+
+    def test_missing_executable(self):
+        c = Capabilities(os.path.join(self.scratch, "omxplayer"), self.cache_path)
+        self.assertFalse(c.available)
+        self.assertFalse(c.supports("-l"))
+
+
+if __name__ == "__main__":
+    unittest.main()
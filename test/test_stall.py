@@ -0,0 +1,79 @@
+"""
+Tests of StallWatchdog against the fake omxplayer.
+"""
+
+import time
+import unittest
+
+from ..pyomxplayer import OMXPlayerError
+from ..stall import StallWatchdog
+from . import util
+
+
+def stalling_player(stall_after):
+    return util.simulated_player_class(status_rate=50, duration=3600, stall_after=stall_after)
+
+
+class Test(unittest.TestCase):
+
+    def start(self, stall_after, **options):
+        player = stalling_player(stall_after)("bbb.mp4")
+        self.addCleanup(player.stop)
+        watchdog = StallWatchdog(player, **options)
+        watchdog.start()
+        self.addCleanup(watchdog.stop)
+        return player, watchdog
+
+    def wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return predicate()
+
+    def test_resumes_at_last_position(self):
+        player, watchdog = self.start(0.5, timeout=0.3)
+        self.assertTrue(self.wait_for(lambda: watchdog.recoveries >= 1))
+        stats = watchdog.stats()
+        self.assertLess(stats['recovery']['max'], 1.0)
+        self.assertAlmostEqual(stats['last']['position'], 0.5, delta=0.1)
+        self.assertEqual(player.last_seek['method'], 'restart')
+        self.assertLess(abs(player.last_seek['error']), 0.1)
+        position = player.wait_for_position(2)
+        self.assertGreaterEqual(position, stats['last']['position'])
+        self.assertFalse(player.finished)
+
+    def test_paused_is_not_stalled(self):
+        player, watchdog = self.start(None, timeout=0.2)
+        self.assertTrue(player.pause().result(2))
+        self.assertFalse(self.wait_for(lambda: watchdog.recoveries, timeout=0.6))
+
+    def test_backoff_and_give_up(self):
+        player, watchdog = self.start(0.1, timeout=0.3, backoff=0.1, max_recoveries=3)
+        self.assertTrue(self.wait_for(lambda: player.finished, timeout=10))
+        stats = watchdog.stats()
+        self.assertTrue(stats['gave_up'])
+        self.assertEqual(stats['recoveries'], 3)
+        # The second and third restart waited 0.1 and 0.2 seconds first.
+        self.assertGreater(stats['recovery']['max'], 0.2)
+
+    def test_failed_restarts_give_up(self):
+        class FailingOMXPlayer(stalling_player(0.1)):
+            def _launch(self, args):
+                if "-l" in args:
+                    raise OMXPlayerError("cannot restart")
+                super()._launch(args)
+
+        player = FailingOMXPlayer("bbb.mp4")
+        self.addCleanup(player.stop)
+        watchdog = StallWatchdog(player, timeout=0.3, backoff=0.05, max_recoveries=3)
+        watchdog.start()
+        self.addCleanup(watchdog.stop)
+        self.assertTrue(self.wait_for(lambda: watchdog.gave_up, timeout=10))
+        self.assertTrue(player.finished)
+        stats = watchdog.stats()
+        self.assertEqual(stats['failures'], 3)
+        self.assertEqual(stats['recoveries'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
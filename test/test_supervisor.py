@@ -0,0 +1,72 @@
+"""
+Tests of OMXSupervisor against the fake omxplayer.
+"""
+
+import threading
+import time
+import unittest
+
+from ..supervisor import OMXSupervisor
+from . import util
+
+
+SimulatedOMXPlayer = util.simulated_player_class(status_rate=50)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = OMXSupervisor(player_class=SimulatedOMXPlayer)
+
+    def tearDown(self):
+        self.supervisor.close(timeout=5)
+
+    def test_many_players_one_thread(self):
+        threads = threading.active_count()
+        players = [self.supervisor.spawn("zone%d.mp3" % i) for i in range(8)]
+        for p in players:
+            self.assertTrue(p.wait_ready(timeout=5))
+        self.assertEqual(threading.active_count(), threads)
+        deadline = time.monotonic() + 2
+        while (not all(p.stats['status_lines'] for p in players) and
+               time.monotonic() < deadline):
+            time.sleep(0.01)
+        for p in players:
+            self.assertEqual(p.audio['decoder'], "aac")
+            self.assertGreater(p.position, 0)
+            self.assertGreater(p.stats['status_lines'], 0)
+
+    def test_commands_and_stop(self):
+        p = self.supervisor.spawn("zone.mp3")
+        self.assertTrue(p.wait_ready(timeout=5))
+        p.pause()
+        time.sleep(0.1)
+        position = p.position
+        time.sleep(0.2)
+        self.assertAlmostEqual(p.position, position, delta=0.05)
+        p.stop()
+        self.assertTrue(p.wait_finished(timeout=2))
+        self.assertEqual(self.supervisor.stats()['running'], 0)
+        # Once reaped, the player is dropped.
+        deadline = time.monotonic() + 2
+        while self.supervisor.players and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = self.supervisor.stats()
+        self.assertEqual(stats['per_player'], {})
+        self.assertEqual(stats['reaped'], 1)
+
+    def test_startup_timeout(self):
+        SlowPlayer = util.simulated_player_class(startup_delay=5)
+        supervisor = OMXSupervisor(player_class=SlowPlayer)
+        supervisor._STARTUP_TIMEOUT = 0.3
+        try:
+            p = supervisor.spawn("zone.mp3")
+            self.assertFalse(p.wait_ready(timeout=2))
+            self.assertTrue(p.finished)
+            self.assertIsNotNone(p.error)
+        finally:
+            supervisor.close(timeout=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Tests of SyncGroup against the fake omxplayer.
+"""
+
+import time
+import unittest
+
+from ..sync import SyncGroup
+from . import util
+
+
+SimulatedOMXPlayer = util.simulated_player_class(status_rate=50, duration=3600)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.group = SyncGroup(["a.mp4", "b.mp4", "c.mp4"], player_class=SimulatedOMXPlayer)
+        self.group.start()
+
+    def tearDown(self):
+        self.group.stop()
+
+    def wait_aligned(self, timeout=3):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            drift = self.group.drift()
+            if drift is not None and drift <= self.group.tolerance:
+                return drift
+            time.sleep(0.05)
+        return self.group.drift()
+
+    def test_released_together(self):
+        for player in self.group.players:
+            self.assertIsNotNone(player.wait_for_position(1))
+        self.assertLess(self.group.drift(), 0.05)
+        positions = [p.position for p in self.group.players]
+        self.assertGreater(min(positions), 0)
+
+    def test_micro_pause(self):
+        player = self.group.players[0]
+        player.seek(player.position + 0.4, method='restart')
+        self.assertLessEqual(self.wait_aligned(), self.group.tolerance)
+        self.assertGreaterEqual(self.group.corrections['pauses'], 1)
+        self.assertEqual(self.group.corrections['restarts'], 0)
+
+    def test_restart(self):
+        player = self.group.players[1]
+        player.seek(player.position + 30, method='restart')
+        self.assertLessEqual(self.wait_aligned(5), self.group.tolerance)
+        self.assertGreaterEqual(self.group.corrections['restarts'], 1)
+
+    def test_pause_play(self):
+        self.group.pause()
+        for player in self.group.players:
+            self.assertTrue(player.pause().result(2))
+        positions = [p.position for p in self.group.players]
+        time.sleep(0.2)
+        self.assertEqual([p.position for p in self.group.players], positions)
+        self.group.play()
+        self.assertLessEqual(self.wait_aligned(), self.group.tolerance)
+
+    def test_drift_stats(self):
+        time.sleep(0.5)
+        stats = self.group.drift_stats()
+        self.assertGreaterEqual(stats['samples'], 3)
+        self.assertLessEqual(stats['p50'], stats['p99'])
+        self.assertLess(stats['p50'], 0.05)
+        self.assertIsNotNone(stats['cpu_per_tick'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Tests of the process transports against the fake omxplayer.
+"""
+
+import os
+import select
+import subprocess
+import sys
+import time
+import unittest
+
+from ..pyomxplayer import OMXPlayer
+from ..transport import PexpectProcess, PtyProcess
+from . import util
+
+
+def read_until(process, marker, timeout=5):
+    output = b""
+    deadline = time.monotonic() + timeout
+    while marker not in output and time.monotonic() < deadline:
+        if select.select([process.child_fd], [], [], 0.1)[0]:
+            try:
+                output += os.read(process.child_fd, 4096)
+            except OSError:
+                break
+    return output
+
+
+class TransportTests(object):
+
+    process_class = None
+
+    def spawn(self, mediafile="bbb.mp4"):
+        process = self.process_class(util.fake_launch_argv(status_rate=50) + [mediafile])
+        self.addCleanup(process.close)
+        return process
+
+    def test_argv_with_spaces(self):
+        process = self.spawn("my movie (2).mp4")
+        self.assertIn(b"file : my movie (2).mp4", read_until(process, b"M:"))
+
+    def test_send_and_exit(self):
+        process = self.spawn()
+        read_until(process, b"M:")
+        process.send("q")
+        self.assertIn(b"have a nice day", read_until(process, b"have a nice day"))
+        self.assertTrue(process.wait(5))
+        self.assertFalse(process.isalive())
+        self.assertEqual(process.exitstatus, 0)
+
+    def test_terminate(self):
+        process = self.spawn()
+        self.assertTrue(process.isalive())
+        self.assertTrue(process.terminate(force=True))
+        self.assertFalse(process.isalive())
+        process.close()
+        self.assertTrue(process.closed)
+
+
+class TestPtyProcess(TransportTests, unittest.TestCase):
+    process_class = PtyProcess
+
+
+class TestPexpectProcess(TransportTests, unittest.TestCase):
+    process_class = PexpectProcess
+
+    def setUp(self):
+        try:
+            import pexpect
+        except ImportError:
+            self.skipTest("pexpect is not installed")
+
+
+class TestLaunch(unittest.TestCase):
+
+    def test_no_pexpect_import(self):
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        package = os.path.basename(package_dir)
+        code = ("import sys, %s.pyomxplayer; "
+                "sys.exit('pexpect' in sys.modules)" % package)
+        self.assertEqual(subprocess.call([sys.executable, "-c", code],
+                                         cwd=os.path.dirname(package_dir)), 0)
+
+    def test_split_args(self):
+        self.assertEqual(OMXPlayer._split_args("--vol -600 --win '0 0 640 480'", True),
+                         ["--vol", "-600", "--win", "0 0 640 480", "-r"])
+        self.assertEqual(OMXPlayer._split_args(["--vol", "-600"], False), ["--vol", "-600"])
+        self.assertEqual(OMXPlayer._split_args(None, False), [])
+
+    def test_mediafile_with_spaces(self):
+        Player = util.simulated_player_class(status_rate=50)
+        player = Player("my movie.mp4")
+        try:
+            self.assertEqual(player.video['decoder'], "omx-h264")
+            self.assertIsNotNone(player.wait_for_position(5))
+        finally:
+            player.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
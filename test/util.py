@@ -3,8 +3,13 @@ Utilities.
 """
 
 import os
+import struct
+import sys
 import subprocess
 
+from ..pyomxplayer import OMXPlayer
+from ..resolver import YOUTUBE_DL, Resolver, ResolverCommand
+
 BBB_FILE = "/opt/diss/videos/BigBuckBunny_320x180.mp4" # Big Buck Bunny
 BBB_YOUTUBE_WEB_URL = "http://www.youtube.com/watch?v=YE7VzlLtp-4" # Big Buck Bunny
 ED_YOUTUBE_WEB_URL = "http://www.youtube.com/watch?v=TLkA0RELQ1g" # Elephants Dream - Blender Foundation's first short Open Movie
@@ -12,6 +17,12 @@ S_YOUTUBE_WEB_URL = "http://www.youtube.com/watch?v=eRsGyueVLvQ" # Sintel - Thir
 TOS_YOUTUBE_WEB_URL = "http://www.youtube.com/watch?v=R6MlUcmOul8" # Tears of Steel - Blender Foundation's fourth short Open Movie
 GANGNAM_YOUTUBE_WEB_URL = "http://www.youtube.com/watch?v=9bZkp7q19f0" # PSY - GANGNAM STYLE
 
+FAKE_OMXPLAYER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakeomxplayer.py")
+FAKE_RESOLVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakeresolver.py")
+
+# youtube-dl, with its answers cached between test runs.
+RESOLVER = Resolver([YOUTUBE_DL])
+
 YOUTUBE_FORMATS = {
     "5" : "flv [240x400]",
     "17" : "mp4 [144x176]",
@@ -26,19 +37,11 @@ YOUTUBE_FORMATS = {
     "46" : "webm [1080x1920]",
     }
 
-def killOMXPlayer():
-    """
-    Kill all running instances of OMXPlayer.
-    """
-    for i in range(0,3):
-        os.system("kill `ps ax | grep omxplayer.bin | head -n 1 | awk '{print $1}'`")
-        
 def get_youtube_streaming_url(web_url,fmt):
     """
     Returns the url to stream a YouTube video using specified format.
     """
-    output = subprocess.check_output(["youtube-dl","--get-url","--format",fmt,web_url])
-    return output[:-1] # Remove new line character.
+    return RESOLVER.resolve(web_url, fmt)
 
 def get_best_youtube_streaming_url(web_url):
     """
@@ -56,4 +59,114 @@ def is_omxplayer_running():
     """
     Returns whether there is an running instance of OMXPlayer.
     """
-    return len(subprocess.check_output("ps ax | grep omxplayer.bin",shell=True).splitlines()) > 2
\ No newline at end of file
+    return len(subprocess.check_output("ps ax | grep omxplayer.bin",shell=True).splitlines()) > 2
+
+def fake_launch_argv(**options):
+    """
+    Returns an `OMXPlayer._LAUNCH_ARGV` that runs the fake omxplayer instead.
+
+    Keyword arguments become fake options, e.g. ``status_rate=50`` is passed
+    as ``--status-rate 50`` and ``no_audio=True`` as ``--no-audio``.
+    """
+    fake_args = []
+    for name, value in sorted(options.items()):
+        flag = "--" + name.replace("_", "-")
+        if value is True:
+            fake_args.append(flag)
+        elif value not in (None, False):
+            fake_args.extend([flag, str(value)])
+    return [sys.executable, FAKE_OMXPLAYER] + fake_args + ["-o", "hdmi", "-s"]
+
+def simulated_player_class(base=OMXPlayer, **options):
+    """
+    Returns a subclass of `base` that runs the fake omxplayer. Keyword
+    arguments are fake omxplayer options, see `fake_launch_argv`.
+    """
+    return type("Simulated" + base.__name__, (base,),
+                dict(_LAUNCH_ARGV=fake_launch_argv(**options)))
+
+def fake_resolver_command(pattern=r"^https?://", **options):
+    """
+    Returns a ResolverCommand that runs the fake resolver. Keyword arguments
+    become its options, like for `fake_launch_argv`.
+    """
+    fake_args = []
+    for name, value in sorted(options.items()):
+        fake_args.extend(["--" + name.replace("_", "-"), str(value)])
+    return ResolverCommand([sys.executable, FAKE_RESOLVER] + fake_args +
+                           ["--format", "{format}", "{url}"], pattern=pattern)
+
+def _mp4_box(kind, payload):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+def _mp4_track(handler, timescale, runs, syncs=None):
+    mdhd = struct.pack(">4xIIII4x", 0, 0, timescale, sum(n * d for n, d in runs))
+    hdlr = struct.pack(">4x4x4s12x", handler) + b"\0"
+    stts = struct.pack(">4xI", len(runs)) + b"".join(struct.pack(">II", n, d) for n, d in runs)
+    stbl = _mp4_box(b"stts", stts)
+    if syncs is not None:
+        stbl += _mp4_box(b"stss", struct.pack(">4xI", len(syncs)) +
+                         b"".join(struct.pack(">I", s) for s in syncs))
+    minf = _mp4_box(b"minf", _mp4_box(b"stbl", stbl))
+    return _mp4_box(b"trak", _mp4_box(b"mdia", _mp4_box(b"mdhd", mdhd) +
+                                      _mp4_box(b"hdlr", hdlr) + minf))
+
+def write_mp4(path, duration, fps=25, keyframe_interval=2.0, mdat_size=0):
+    """
+    Writes an MP4 file with only the boxes a keyframe index needs: an audio
+    track and a video track with a keyframe every `keyframe_interval`
+    seconds, after `mdat_size` bytes of (sparse) media data.
+    """
+    timescale = 12800
+    samples = int(duration * fps)
+    half = samples // 2
+    video_runs = [(half, timescale // fps), (samples - half, timescale // fps)]
+    step = int(keyframe_interval * fps)
+    moov = _mp4_box(b"moov",
+                    _mp4_track(b"soun", 48000, [(int(duration * 47), 1024)]) +
+                    _mp4_track(b"vide", timescale, video_runs, range(1, samples + 1, step)))
+    with open(path, "wb") as f:
+        f.write(_mp4_box(b"ftyp", b"isom\0\0\2\0isomiso2avc1mp41"))
+        f.write(struct.pack(">I4sQ", 1, b"mdat", 16 + mdat_size))
+        f.seek(mdat_size, os.SEEK_CUR)
+        f.write(moov)
+
+def _ebml(element_id, payload):
+    length = (element_id.bit_length() + 7) // 8
+    return element_id.to_bytes(length, "big") + (0x01 << 56 | len(payload)).to_bytes(8, "big") + payload
+
+def _ebml_uint(element_id, value, length=None):
+    return _ebml(element_id, value.to_bytes(length or max(1, (value.bit_length() + 7) // 8), "big"))
+
+def write_mkv(path, duration, keyframe_interval=2.0, cluster_size=0):
+    """
+    Writes a Matroska file with only the elements a keyframe index needs:
+    cues for an audio track and for a video track every `keyframe_interval`
+    seconds, after a (sparse) cluster of `cluster_size` bytes.
+    """
+    info = _ebml(0x1549A966, _ebml_uint(0x2AD7B1, 1000000))
+    tracks = _ebml(0x1654AE6B,
+                   _ebml(0xAE, _ebml_uint(0xD7, 1) + _ebml_uint(0x83, 2)) +
+                   _ebml(0xAE, _ebml_uint(0xD7, 2) + _ebml_uint(0x83, 1)))
+    cue_points = []
+    t = 0.0
+    while t < duration:
+        for track in (1, 2):
+            cue_points.append(_ebml(0xBB, _ebml_uint(0xB3, int(round(t * 1000))) +
+                                    _ebml(0xB7, _ebml_uint(0xF7, track) + _ebml_uint(0xF1, 0))))
+        t += keyframe_interval
+    cues = _ebml(0x1C53BB6B, b"".join(cue_points))
+
+    def seek_head(cues_position):
+        return _ebml(0x114D9B74, _ebml(0x4DBB, _ebml_uint(0x53AB, 0x1C53BB6B) +
+                                       _ebml_uint(0x53AC, cues_position, 8)))
+    cluster_header = (0x1F43B675).to_bytes(4, "big") + (0x01 << 56 | cluster_size).to_bytes(8, "big")
+    cues_position = len(seek_head(0)) + len(info) + len(tracks) + len(cluster_header) + cluster_size
+    head = seek_head(cues_position) + info + tracks
+    segment_size = cues_position + len(cues)
+    with open(path, "wb") as f:
+        f.write(_ebml(0x1A45DFA3, _ebml(0x4282, b"matroska")))
+        f.write((0x18538067).to_bytes(4, "big") + (0x01 << 56 | segment_size).to_bytes(8, "big"))
+        f.write(head + cluster_header)
+        f.seek(cluster_size, os.SEEK_CUR)
+        f.write(cues)
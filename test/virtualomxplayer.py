@@ -0,0 +1,322 @@
+"""
+Deterministic, in-process omxplayer simulation on a virtual clock.
+
+A Simulation runs the fakeomxplayer model inside the test process instead of
+in a child process, and advances its media time with a clock.VirtualClock
+instead of wall time. Players made by `player_class` read and wait on that
+clock, so minutes of playback take milliseconds and positions are exact::
+
+    simulation = Simulation()
+    Player = simulation.player_class(duration=3600)
+    player = Player("bbb.mp4")
+    simulation.advance(10)
+    player.position # 10.0
+    simulation.call(player.seek, 95) # blocks while the clock runs
+"""
+
+import signal
+import socket
+import time
+
+from threading import Lock, Thread, get_ident
+
+from ..clock import VirtualClock
+from ..pyomxplayer import OMXPlayer
+from . import util
+from .fakeomxplayer import FakeOMXPlayer, parse_args
+
+
+class VirtualProcess(object):
+    """
+    A simulated omxplayer with the interface of transport.PtyProcess.
+
+    Keystrokes sent to it are handled by its FakeOMXPlayer `model` at once,
+    at the current virtual time, and what the model prints goes to
+    `child_fd`, one end of a socket pair, as if it came from a pty.
+    """
+
+    _SYNC_TIMEOUT = 1.0 # real seconds to wait for the player to read a status line
+
+    def __init__(self, simulation, argv, player):
+        self.argv = list(argv)
+        self.pid = None
+        self.exitstatus = None
+        self.signalstatus = None
+        self.closed = False
+        self.simulation = simulation
+        self.player = player
+        self.generation = player._generation + 1 # see OMXPlayer._launch
+        self.launcher = get_ident()
+        self._ends = socket.socketpair()
+        self.child_fd = self._ends[0].fileno()
+        self._pending = b""
+        self._status_lines = 0 # status lines printed
+        self._serial = player._position_serial # the player's count when spawned
+
+        # argv is the fake omxplayer's: the interpreter and the script come first.
+        clock = simulation.clock
+        self.model = FakeOMXPlayer(parse_args(self.argv[2:]), out=self, clock=clock.monotonic)
+        options = self.model.options
+        self.started = None # when the headers were printed
+        self._headers_due = clock.monotonic() + options.startup_delay
+        self._next_status = None
+        self._stall = None
+        if not options.startup_delay:
+            with simulation._lock:
+                self._start()
+
+    def __repr__(self):
+        return "<VirtualProcess %r>" % (self.argv,)
+
+    # The model's output file.
+
+    def write(self, text):
+        try:
+            self._ends[1].sendall(text.encode())
+        except OSError:
+            pass
+
+    def flush(self):
+        pass
+
+    # The simulation's side.
+
+    def due(self):
+        """
+        Returns the virtual time of this process's next event, or None.
+        """
+        if not self.isalive():
+            return None
+        if self.started is None:
+            return self._headers_due
+        if self.stalled:
+            return None
+        due = self._next_status
+        if self.model._delayed_seeks:
+            due = min(due, self.model._delayed_seeks[0][0])
+        if self._stall is not None:
+            due = min(due, self._stall)
+        return due
+
+    @property
+    def stalled(self):
+        return self._stall is not None and self.simulation.clock.monotonic() >= self._stall
+
+    def tick(self):
+        """
+        Handles the events due now. Returns whether a status line was printed.
+        """
+        now = self.simulation.clock.monotonic()
+        if not self.isalive():
+            return False
+        if self.started is None:
+            if now < self._headers_due:
+                return False
+            self._start()
+        if self.stalled:
+            return False
+        model = self.model
+        model.apply_delayed_seeks(now)
+        printed = False
+        if now >= self._next_status:
+            model.advance(now)
+            if model.running and model.options.stats:
+                model.print_status()
+                self._status_lines += 1
+                printed = True
+            self._next_status += 1.0 / model.options.status_rate
+        if not model.running:
+            self._exit()
+        return printed
+
+    def sync(self):
+        """
+        Waits until the player has handled every status line printed so far,
+        and, once omxplayer has exited, its exit.
+        """
+        player = self.player
+        target = self._serial + self._status_lines
+        exited = not self.isalive()
+        with player._output_condition:
+            player._output_condition.wait_for(
+                lambda: ((player._position_serial >= target and not exited)
+                         or getattr(player, 'finished', False)
+                         or player._generation != self.generation),
+                self._SYNC_TIMEOUT)
+
+    def _start(self):
+        model = self.model
+        now = self.simulation.clock.monotonic()
+        self.started = now
+        model.print_headers()
+        model.advance(now)
+        # The first status line comes a step later, once the player is reading.
+        self._next_status = now + 1.0 / model.options.status_rate
+        if model.options.stall_after is not None:
+            self._stall = now + model.options.stall_after
+        if self._pending:
+            self._handle(b"")
+
+    def _handle(self, data):
+        model = self.model
+        if self.started is None or self.stalled:
+            self._pending += data
+            return
+        model.advance(self.simulation.clock.monotonic())
+        self._pending = model.handle_input(self._pending + data)
+        if not model.running:
+            self._exit()
+
+    def _exit(self, sig=None):
+        if self.exitstatus is None and self.signalstatus is None:
+            if sig is None:
+                self.exitstatus = 0
+            else:
+                self.signalstatus = sig
+            self._ends[1].close()
+
+    # The transport interface.
+
+    def isalive(self):
+        return self.exitstatus is None and self.signalstatus is None
+
+    def wait(self, timeout=None):
+        return not self.isalive()
+
+    def kill(self, sig):
+        with self.simulation._lock:
+            if sig in (signal.SIGTERM, signal.SIGKILL, signal.SIGINT):
+                self._exit(sig)
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.simulation._lock:
+            if self.isalive():
+                self._handle(data)
+        return len(data)
+
+    def terminate(self, force=False):
+        self.kill(signal.SIGTERM)
+        return True
+
+    def close(self, force=True):
+        if self.closed:
+            return
+        if force:
+            self.terminate(force=True)
+        self.closed = True
+        self.child_fd = -1
+        self._ends[0].close()
+
+
+class Simulation(object):
+    """
+    Runs VirtualProcesses on a VirtualClock starting at `start`.
+    """
+
+    _CALL_TIMEOUT = 3600.0 # virtual seconds a `call` may take
+
+    def __init__(self, start=0.0):
+        self.clock = VirtualClock(start)
+        self.processes = []
+        self._lock = Lock()
+
+    def player_class(self, base=OMXPlayer, **options):
+        """
+        Returns a subclass of `base` that runs on this simulation. Keyword
+        arguments are fake omxplayer options, see util.fake_launch_argv.
+        """
+        simulation = self
+
+        class VirtualOMXPlayer(base):
+            _LAUNCH_ARGV = util.fake_launch_argv(**options)
+            clock = simulation.clock
+
+            # Called like the transport class, but as a method, to know the player.
+            def _PROCESS_CLASS(self, argv):
+                return simulation.spawn(argv, self)
+
+        return VirtualOMXPlayer
+
+    def spawn(self, argv, player):
+        process = VirtualProcess(self, argv, player)
+        with self._lock:
+            self.processes = [p for p in self.processes if p.isalive()] + [process]
+        return process
+
+    def advance(self, seconds):
+        """
+        Runs the simulation for `seconds` of virtual time.
+        """
+        target = self.clock.monotonic() + seconds
+        while self.step(target):
+            pass
+
+    def step(self, limit):
+        """
+        Advances the clock to the next event, but not past `limit`, and
+        handles it. Returns False once the clock has reached `limit`.
+        """
+        # Let commands queued since the last step reach the clock first, and
+        # players see processes that exited meanwhile, e.g. on a quit key.
+        self.clock.settle(self._ignored())
+        with self._lock:
+            exited = [p for p in self.processes if not p.isalive()]
+        for process in exited:
+            process.sync()
+        with self._lock:
+            due = [d for d in (p.due() for p in self.processes) if d is not None]
+        now = self.clock.monotonic()
+        if not due or min(due) > limit:
+            self.clock.advance(limit - now, self._ignored())
+            return False
+        self.clock.advance(max(min(due) - now, 0), self._ignored())
+        with self._lock:
+            printed = [p for p in self.processes if p.tick()]
+        for process in printed:
+            process.sync()
+        self.clock.settle(self._ignored())
+        return True
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls `func` on a thread of its own while running the simulation, for
+        calls that block until something happens in virtual time, and returns
+        what it returned or raises what it raised.
+        """
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = func(*args, **kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        limit = self.clock.monotonic() + self._CALL_TIMEOUT
+        while True:
+            # Let the call run until it waits on the clock.
+            deadline = time.monotonic() + VirtualClock._SETTLE_TIMEOUT
+            while (thread.is_alive() and not self._waiting(thread) and
+                   time.monotonic() < deadline):
+                thread.join(0.0002)
+            if not thread.is_alive():
+                break
+            if not self.step(limit):
+                raise AssertionError("%r did not return within %ss" % (func, self._CALL_TIMEOUT))
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    def _waiting(self, thread):
+        return thread.ident in self._ignored() or self.clock.waiting(thread.ident)
+
+    def _ignored(self):
+        """
+        Threads not to wait for: those waiting for headers to be printed.
+        """
+        with self._lock:
+            return set(p.launcher for p in self.processes if p.started is None)
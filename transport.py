@@ -0,0 +1,222 @@
+"""
+Process transports: how omxplayer is spawned on a pty.
+
+Both transports take an argv list, so paths with spaces need no quoting,
+and provide the same small interface: `pid`, `child_fd`, `isalive`, `send`,
+`terminate`, `wait` and `close`.
+
+- PtyProcess (the default) opens the pty with `os.openpty` and starts
+  omxplayer with `os.posix_spawn`, without importing anything else.
+- PexpectProcess wraps `pexpect.spawn`, which is imported when first used.
+"""
+
+import errno
+import logging
+import os
+import signal
+import time
+
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class PtyProcess(object):
+    """
+    A child process whose stdin, stdout and stderr are the slave end of a
+    new pty, in a session of its own. `child_fd` is the master end.
+    """
+
+    _TERMINATE_TIMEOUT = 0.5 # seconds to wait for SIGTERM before SIGKILL
+
+    # Children that were dropped while running, reaped on later spawns.
+    _orphans = []
+
+    def __init__(self, argv, env=None):
+        self.argv = list(argv)
+        self.exitstatus = None
+        self.signalstatus = None
+        self.closed = False
+        self._lock = Lock()
+        self._reap_orphans()
+
+        master, slave = os.openpty()
+        try:
+            # Both ends are close-on-exec; dup2 makes the copies inheritable.
+            self.pid = os.posix_spawnp(self.argv[0], self.argv,
+                                       os.environ if env is None else env,
+                                       file_actions=[(os.POSIX_SPAWN_DUP2, slave, 0),
+                                                     (os.POSIX_SPAWN_DUP2, slave, 1),
+                                                     (os.POSIX_SPAWN_DUP2, slave, 2)],
+                                       setsid=True)
+        except BaseException:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        self.child_fd = master
+
+    def __repr__(self):
+        return "<PtyProcess pid=%s %r>" % (self.pid, self.argv)
+
+    def isalive(self):
+        """
+        Returns whether the child is still running, reaping it if it is not.
+        """
+        with self._lock:
+            if self.exitstatus is not None or self.signalstatus is not None:
+                return False
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Reaped elsewhere; its status is lost.
+                self.exitstatus = -1
+                return False
+            if pid == 0:
+                return True
+            self._set_status(status)
+            return False
+
+    def _set_status(self, status):
+        if os.WIFSIGNALED(status):
+            self.signalstatus = os.WTERMSIG(status)
+        else:
+            self.exitstatus = os.WEXITSTATUS(status)
+
+    def wait(self, timeout=None):
+        """
+        Waits for the child to exit. Returns whether it did within `timeout`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0005
+        while self.isalive():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return True
+
+    def kill(self, sig):
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        return os.write(self.child_fd, data)
+
+    def terminate(self, force=False):
+        """
+        Sends SIGTERM and, if `force`, SIGKILL after `_TERMINATE_TIMEOUT`.
+        Returns whether the child exited.
+        """
+        if not self.isalive():
+            return True
+        self.kill(signal.SIGTERM)
+        if self.wait(self._TERMINATE_TIMEOUT):
+            return True
+        if force:
+            self.kill(signal.SIGKILL)
+            return self.wait(self._TERMINATE_TIMEOUT)
+        return False
+
+    def close(self, force=True):
+        """
+        Closes the pty, terminating the child first if it still runs and
+        `force` is given.
+        """
+        if self.closed:
+            return
+        if force and self.isalive():
+            self.terminate(force=True)
+        self.closed = True
+        fd, self.child_fd = self.child_fd, -1
+        try:
+            os.close(fd)
+        except OSError as e:
+            if e.errno != errno.EBADF:
+                raise
+
+    def __del__(self):
+        # Never block here: this may run in any thread the collector picks.
+        if getattr(self, "closed", True):
+            return
+        try:
+            if self.isalive():
+                self.kill(signal.SIGKILL)
+                self._orphans.append(self.pid)
+            os.close(self.child_fd)
+        except Exception:
+            pass
+        self.closed = True
+
+    @classmethod
+    def _reap_orphans(cls):
+        for pid in list(cls._orphans):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0] == 0:
+                    continue
+            except ChildProcessError:
+                pass
+            try:
+                cls._orphans.remove(pid)
+            except ValueError:
+                pass # reaped by a spawn on another thread
+
+
+class PexpectProcess(object):
+    """
+    The PtyProcess interface on top of `pexpect.spawn`.
+    """
+
+    def __init__(self, argv, env=None):
+        import pexpect
+        self.argv = list(argv)
+        self._process = pexpect.spawn(self.argv[0], self.argv[1:], env=env)
+        # Closing sleeps this long, in whichever thread garbage collects it.
+        self._process.ptyproc.delayafterclose = 0
+        # Keystrokes go out at once; pexpect sleeps 50ms before each by default.
+        self._process.delaybeforesend = None
+        self.pid = self._process.pid
+        self.child_fd = self._process.child_fd
+
+    def __repr__(self):
+        return "<PexpectProcess pid=%s %r>" % (self.pid, self.argv)
+
+    @property
+    def exitstatus(self):
+        return self._process.exitstatus
+
+    @property
+    def signalstatus(self):
+        return self._process.signalstatus
+
+    @property
+    def closed(self):
+        return self._process.closed
+
+    def isalive(self):
+        return self._process.isalive()
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.isalive():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def kill(self, sig):
+        self._process.kill(sig)
+
+    def send(self, data):
+        return self._process.send(data)
+
+    def terminate(self, force=False):
+        return self._process.terminate(force=force)
+
+    def close(self, force=True):
+        self._process.close(force=force)
+        self.child_fd = -1